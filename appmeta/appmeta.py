@@ -2,16 +2,48 @@ import json
 import os
 from typing import TypedDict
 
+from appmeta.metastore import MetaStore, write_json_atomic
+from metrics.metrics import metrics
+
 # submeta type --> serializable
 
 class SubMeta(TypedDict):
 	author: str #should match the author of the source ex https://submeta.io/@lachlangiles/ --> lachlangiles
 
 
+def peek(file_path: str, store: MetaStore | None = None) -> dict | None:
+	"""Returns the metadata of a folder without creating it, None for a folder that has none yet (AppMeta would see it as first)."""
+	if store is not None:
+		data = store.get(file_path)
+		if data is not None:
+			return data
+	if not os.path.exists(file_path):
+		return None
+	with open(file_path, 'r') as file:
+		return json.load(file)
+
+
+"""
+AppMeta is the metadata of a single folder.
+
+By default it lives in the folder's JSON file. When a MetaStore is given, the record lives in the library wide store instead and file_path is only used as its key (the store decides whether data.json is still exported). Either way the data is read once and kept in memory.
+"""
 class AppMeta:
-	def __init__(self, file_path='data/data.json'):
+	def __init__(self, file_path='data/data.json', store: MetaStore | None = None):
 		self.first = False
 		self.file_path = file_path
+		self.store = store
+		self.data: dict | None = None
+		if store is not None:
+			if store.get(file_path) is None:
+				# adopt an existing data.json the first time a folder is seen by the store
+				if os.path.exists(file_path):
+					with open(file_path, 'r') as file:
+						store.put(file_path, json.load(file))
+				else:
+					store.put(file_path, {'name': '', 'ignore': False})
+					self.first = True
+			return
 # Ensure the directory exists
 		os.makedirs(os.path.dirname(file_path), exist_ok=True)
 # Initialize with default data if the file doesn't exist
@@ -20,18 +52,36 @@ class AppMeta:
 			self.first = True
 
 	def _read_data(self):
-		"""Reads the JSON data from the file."""
-		with open(self.file_path, 'r') as file:
-			return json.load(file)
+		"""Reads the JSON data, from memory after the first read."""
+		if self.data is None:
+			with metrics.span("appmeta.read"):
+				if self.store is not None:
+					self.data = self.store.get(self.file_path)
+				else:
+					with open(self.file_path, 'r') as file:
+						self.data = json.load(file)
+		return dict(self.data)
 
 	def _write_data(self, data):
-		"""Writes the JSON data to the file."""
-		with open(self.file_path, 'w') as file:
-			json.dump(data, file, indent=4)
+		"""Writes the JSON data to the store or atomically to the file."""
+		self.data = dict(data)
+		with metrics.span("appmeta.write"):
+			if self.store is not None:
+				self.store.put(self.file_path, data)
+			else:
+				write_json_atomic(self.file_path, data)
 	
 	def change_path(self, new_path):
 		"""Changes the path of the JSON file."""
+		if self.store is not None:
+			self.store.rename(self.file_path, new_path)
+			self.file_path = new_path
+			self.data = None
+			if self.store.get(new_path) is None:
+				self._write_data({'name': '', 'ignore': False})
+			return
 		self.file_path = new_path
+		self.data = None
 		os.makedirs(os.path.dirname(new_path), exist_ok=True)
 		if not os.path.exists(new_path):
 			self._write_data({'name': '', 'ignore': False})
@@ -44,8 +94,8 @@ class AppMeta:
 		"""Returns whether the file should be ignored."""
 		return self._read_data()['ignore']
 
-	def update_data(self, name=None, ignore=None, chapter=None, source=None, submeta=None):
-		"""Updates the data in the JSON file."""
+	def update_data(self, name=None, ignore=None, chapter=None, source=None, submeta=None, url=None):
+		"""Updates the data in the JSON file. source and url record the selected result, so it can be looked up again."""
 		data = self._read_data()
 		if name is not None:
 			data['name'] = name
@@ -55,4 +105,8 @@ class AppMeta:
 			data['chapter'] = chapter
 		if source is not None:
 			data['source'] = source
+		if url is not None:
+			data['url'] = url
+		if submeta is not None:
+			data['submeta'] = submeta
 		self._write_data(data)
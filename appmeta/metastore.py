@@ -0,0 +1,113 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict
+
+
+def write_json_atomic(file_path: str, data: dict):
+	"""Writes JSON to a temp file next to file_path and renames it over, so readers never see a half written file."""
+	os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+	temp_path = f"{file_path}.tmp"
+	with open(temp_path, 'w') as file:
+		json.dump(data, file, indent=4)
+	os.replace(temp_path, file_path)
+
+
+def read_records(root: str, file_name: str = "library.db") -> Dict[str, dict]:
+	"""Reads every record of a library's store without opening it for writing, returns no records when there is no store."""
+	path = os.path.join(root, file_name)
+	if not os.path.exists(path):
+		return {}
+	try:
+		connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+		try:
+			return {key: json.loads(data) for key, data in connection.execute("SELECT key, data FROM meta").fetchall()}
+		finally:
+			connection.close()
+	except sqlite3.Error as e:
+		print(f"Error reading {path} - {e}")
+		return {}
+
+
+"""
+MetaStore keeps the metadata of every folder of a library in one SQLite file at the library root, instead of one data.json per folder.
+
+Everything is loaded into memory with a single query when the store opens. Writes update memory immediately and are committed in batches of batch_size (and on flush/close) inside one transaction. With export set, every write is also mirrored to the folder's data.json for tools that still read it.
+
+Records are keyed by the data.json path relative to the library root, so AppMeta can keep using file paths.
+
+Usage:
+	store = MetaStore("/library")
+	metadata = AppMeta("/library/Leglocks/data.json", store)
+	...
+	store.close()
+"""
+class MetaStore():
+
+	def __init__(self, root: str, file_name: str = "library.db", batch_size: int = 50, export: bool = False):
+		self.root = root
+		self.path = os.path.join(root, file_name)
+		self.batch_size = batch_size
+		self.export = export
+		self.lock = threading.RLock()
+		self.pending: Dict[str, dict | None] = {}
+		self.connection = sqlite3.connect(self.path, check_same_thread=False)
+		# the library root is often a network share, where WAL's shared memory index does not work, so the rollback journal is used
+		# (set explicitly, a database once switched to WAL stays in WAL otherwise)
+		self.connection.execute("PRAGMA journal_mode=DELETE")
+		self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+		self.connection.commit()
+		self.data: Dict[str, dict] = {
+			key: json.loads(data) for key, data in self.connection.execute("SELECT key, data FROM meta").fetchall()
+		}
+
+	def key(self, file_path: str) -> str:
+		return os.path.relpath(os.path.abspath(file_path), os.path.abspath(self.root))
+
+	def get(self, file_path: str) -> dict | None:
+		"""Returns a copy of the record for file_path, or None if there is none."""
+		with self.lock:
+			data = self.data.get(self.key(file_path))
+			return None if data is None else dict(data)
+
+	def put(self, file_path: str, data: dict):
+		key = self.key(file_path)
+		with self.lock:
+			self.data[key] = dict(data)
+			self.pending[key] = self.data[key]
+			if self.export:
+				write_json_atomic(file_path, data)
+			if len(self.pending) >= self.batch_size:
+				self.flush()
+
+	def rename(self, old_path: str, new_path: str):
+		"""Moves a record, used when a folder is renamed after its instructional."""
+		old_key = self.key(old_path)
+		new_key = self.key(new_path)
+		with self.lock:
+			if old_key not in self.data or old_key == new_key:
+				return
+			self.data[new_key] = self.data.pop(old_key)
+			self.pending[old_key] = None
+			self.pending[new_key] = self.data[new_key]
+			if len(self.pending) >= self.batch_size:
+				self.flush()
+
+	def flush(self):
+		"""Commits every pending write in one transaction."""
+		with self.lock:
+			if len(self.pending) == 0:
+				return
+			with self.connection:
+				for key, data in self.pending.items():
+					if data is None:
+						self.connection.execute("DELETE FROM meta WHERE key = ?", (key,))
+					else:
+						self.connection.execute("INSERT OR REPLACE INTO meta (key, data) VALUES (?, ?)", (key, json.dumps(data)))
+			self.pending.clear()
+
+	def close(self):
+		with self.lock:
+			self.flush()
+			self.connection.close()
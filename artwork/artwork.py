@@ -0,0 +1,205 @@
+import contextvars
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, TypedDict
+from urllib.parse import urlsplit
+
+from appmeta.metastore import write_json_atomic
+from metrics.metrics import metrics
+from search.transport.transport import Transport, shared_transport
+
+# downloaded images live once in the library wide store, show folders link to them
+ARTWORK_DIR = ".artwork"
+SIDECAR = ".artwork.json"
+# every artwork file written into a show folder, sources only give one image so they share it (and its stored copy)
+ARTWORK_NAMES = ("poster", "fanart")
+CONTENT_TYPES = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp", "image/gif": ".gif"}
+DEFAULT_WORKERS = 8
+
+class ArtworkState(TypedDict):
+	url: str
+	etag: Optional[str]
+	last_modified: Optional[str]
+	hash: str
+	files: List[str]
+
+
+def extension(content_type: str | None, url: str) -> str:
+	"""Returns the file extension of an image, from its Content-Type or else its URL."""
+	if content_type is not None:
+		kind = content_type.split(";")[0].strip().lower()
+		if kind in CONTENT_TYPES:
+			return CONTENT_TYPES[kind]
+	ext = os.path.splitext(urlsplit(url).path)[1].lower()
+	if ext in CONTENT_TYPES.values() or ext == ".jpeg":
+		return ".jpg" if ext == ".jpeg" else ext
+	return ".jpg"
+
+def downscale(content: bytes, size: Tuple[int, int]) -> bytes:
+	"""Shrinks an image to fit in size keeping its aspect ratio and format, images that already fit are returned as they are."""
+	from PIL import Image
+	with Image.open(io.BytesIO(content)) as image:
+		if image.width <= size[0] and image.height <= size[1]:
+			return content
+		kind = image.format or "JPEG"
+		image.thumbnail(size)
+		output = io.BytesIO()
+		image.save(output, format=kind)
+		return output.getvalue()
+
+def read_state(folder: str) -> ArtworkState | None:
+	try:
+		with open(os.path.join(folder, SIDECAR), 'r') as file:
+			return json.load(file)
+	except (OSError, ValueError):
+		return None
+
+def link(source: str, target: str):
+	"""Points target at the stored file with a hard link (a copy across file systems), replacing it atomically."""
+	if os.path.exists(target) and os.path.samefile(source, target):
+		return
+	temp_path = f"{target}.tmp"
+	if os.path.lexists(temp_path):
+		os.remove(temp_path)
+	try:
+		os.link(source, temp_path)
+	except OSError:
+		shutil.copyfile(source, temp_path)
+	os.replace(temp_path, target)
+
+
+"""
+ArtworkFetcher downloads the artwork of show folders in the background, so media servers find a local poster.jpg and fanart.jpg instead of fetching every remote thumb on first browse.
+
+Downloads run `workers` at a time through the shared Transport (so its rate limits apply). Each show folder keeps a .artwork.json sidecar with the image's URL, ETag and Last-Modified, re-runs revalidate with If-None-Match/If-Modified-Since and a 304 moves no image bytes. Images are stored once per content hash in the library's .artwork folder and hard linked into every show that uses them. With size set (and Pillow installed) stored images are downscaled to fit it.
+
+Usage:
+	artwork = ArtworkFetcher("/library", size=(1000, 1500))
+	artwork.submit("/library/Leglocks", result.image)
+	artwork.revalidate("/library/Back Attacks")
+	artwork.close()
+"""
+class ArtworkFetcher():
+
+	def __init__(self, root: str, workers: int = DEFAULT_WORKERS, size: Tuple[int, int] | None = None, refresh: bool = False, transport: Transport | None = None):
+		self.store = os.path.join(root, ARTWORK_DIR)
+		self.size = size
+		self.refresh = refresh
+		self.transport = shared_transport() if transport is None else transport
+		self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="artwork")
+		self.futures: List[Future] = []
+		# downloads queued per show folder, so a folder can be recorded as handled only once its artwork is written
+		self.folders: Dict[str, List[Future]] = {}
+		self.lock = threading.Lock()
+		if size is not None and importlib.util.find_spec("PIL") is None:
+			print("Pillow is not installed, artwork is stored at its original size")
+			self.size = None
+
+	def submit(self, folder: str, url: str) -> Future | None:
+		"""Queues the artwork of a show folder, returns None when the result has no image."""
+		if url is None or url == "":
+			return None
+		# each download is attributed to the metrics folder that queued it
+		future = self.executor.submit(contextvars.copy_context().run, self.fetch, folder, url)
+		self.futures.append(future)
+		self.folders.setdefault(os.path.abspath(folder), []).append(future)
+		return future
+
+	def queued(self, folder: str) -> List[Future]:
+		"""Returns the downloads of a show folder that are still running."""
+		return [future for future in self.folders.get(os.path.abspath(folder), []) if not future.done()]
+
+	def revalidate(self, folder: str) -> Future | None:
+		"""Queues a revalidation of the artwork a show folder already has, from the URL in its sidecar."""
+		state = read_state(folder)
+		if state is None:
+			return None
+		return self.submit(folder, state["url"])
+
+	def fetch(self, folder: str, url: str) -> str:
+		"""Downloads or revalidates the artwork of a folder, returns "downloaded", "not modified" or "failed"."""
+		try:
+			with metrics.span("artwork.fetch"):
+				return self._fetch(folder, url)
+		except Exception as e:
+			print(f"Error[artwork]: {os.path.basename(folder)} - {e}")
+			metrics.count("artwork_errors")
+			return "failed"
+
+	def _fetch(self, folder: str, url: str) -> str:
+		state = read_state(folder)
+		headers: Dict[str, str] = {}
+		if not self.refresh and state is not None and state["url"] == url and all(os.path.exists(os.path.join(folder, f)) for f in state["files"]):
+			if state["etag"] is not None:
+				headers["If-None-Match"] = state["etag"]
+			if state["last_modified"] is not None:
+				headers["If-Modified-Since"] = state["last_modified"]
+		r = self.transport.get(url, headers=headers)
+		if r.status_code == 304:
+			metrics.count("artwork_not_modified")
+			return "not modified"
+		if r.status_code != 200:
+			print(f"Error[artwork]: {r.status_code} {url}")
+			metrics.count("artwork_errors")
+			return "failed"
+
+		metrics.count("artwork_downloads")
+		metrics.count("artwork_bytes", len(r.content))
+		ext = extension(r.headers.get("Content-Type"), url)
+		digest = hashlib.sha256(r.content).hexdigest()
+		stored = self.stored(digest, ext, r.content)
+		files = [f"{name}{ext}" for name in ARTWORK_NAMES]
+		for file in files:
+			link(stored, os.path.join(folder, file))
+		# artwork left from a previous image with another extension
+		if state is not None:
+			for file in state["files"]:
+				if file not in files and os.path.exists(os.path.join(folder, file)):
+					os.remove(os.path.join(folder, file))
+		write_json_atomic(os.path.join(folder, SIDECAR), ArtworkState(
+			url=url,
+			etag=r.headers.get("ETag"),
+			last_modified=r.headers.get("Last-Modified"),
+			hash=digest,
+			files=files,
+		))
+		return "downloaded"
+
+	def stored(self, digest: str, ext: str, content: bytes) -> str:
+		"""Returns the stored copy of an image, writing (and downscaling) it only the first time its content is seen."""
+		suffix = "" if self.size is None else f"-{self.size[0]}x{self.size[1]}"
+		path = os.path.join(self.store, f"{digest}{suffix}{ext}")
+		with self.lock:
+			if os.path.exists(path):
+				metrics.count("artwork_deduped")
+				return path
+			data = content if self.size is None else downscale(content, self.size)
+			os.makedirs(self.store, exist_ok=True)
+			# the pid keeps processes that store the same image at once from sharing a temp file
+			temp_path = f"{path}.{os.getpid()}.tmp"
+			with open(temp_path, 'wb') as file:
+				file.write(data)
+			os.replace(temp_path, path)
+		return path
+
+	def wait(self) -> Dict[str, int]:
+		"""Waits for every queued download, returns how many ended in each status."""
+		counts: Dict[str, int] = {}
+		for future in self.futures:
+			status = future.result()
+			counts[status] = counts.get(status, 0) + 1
+		self.futures.clear()
+		self.folders.clear()
+		return counts
+
+	def close(self):
+		counts = self.wait()
+		self.executor.shutdown()
+		if len(counts) > 0:
+			print("Artwork - " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+from typing import Dict, List
+
+from search.search import SearchResult
+
+DEFAULT_THRESHOLD = 90
+DEFAULT_MARGIN = 10
+
+
+def rank(results: List[SearchResult]) -> List[SearchResult]:
+	"""Returns the search results sorted by TitleMatcher score, best first. Results without a score sort last."""
+	return sorted(results, key=lambda r: -1 if r.results[0].score is None else r.results[0].score, reverse=True)
+
+
+def pick_confident(results: List[SearchResult], threshold: int = DEFAULT_THRESHOLD, margin: int = DEFAULT_MARGIN) -> SearchResult | None:
+	"""
+	Returns the best result if it can be accepted without asking, None if the folder is ambiguous.
+	A result is accepted when its score is at least threshold and at least margin above the runner up.
+	"""
+	ranked = rank(results)
+	if len(ranked) == 0:
+		return None
+	best = ranked[0].results[0].score
+	if best is None or best < threshold:
+		return None
+	if len(ranked) > 1:
+		runner_up = ranked[1].results[0].score
+		if runner_up is not None and best - runner_up < margin:
+			return None
+	return ranked[0]
+
+
+"""
+ReviewQueue collects folders that batch mode could not decide on, one JSON object per line, so they can be reviewed later with the interactive mode.
+
+A folder has at most one line: queueing it again (on the next batch run) replaces its line with the new candidates. The file is rewritten atomically on every add.
+
+Usage:
+	queue = ReviewQueue(f"{path}/review.jsonl")
+	queue.add("Leglocks", results)
+"""
+class ReviewQueue():
+
+	def __init__(self, file_path: str):
+		self.file_path = file_path
+		self.lock = threading.Lock()
+		self.count = 0
+
+	def add(self, folder: str, results: List[SearchResult], reason: str = "ambiguous"):
+		candidates = [
+			{
+				"title": r.results[0].title,
+				"source": r.source,
+				"score": r.results[0].score,
+				"url": r.results[0].url,
+			}
+			for r in rank(results)
+		]
+		with self.lock:
+			# re-read on every add so lines queued by other processes of a sharded run are kept
+			entries = self.read()
+			entries[folder] = {"folder": folder, "reason": reason, "candidates": candidates}
+			# the pid keeps processes that queue at once from sharing a temp file
+			temp_path = f"{self.file_path}.{os.getpid()}.tmp"
+			with open(temp_path, 'w', encoding='utf-8') as file:
+				for entry in entries.values():
+					file.write(json.dumps(entry) + "\n")
+			os.replace(temp_path, self.file_path)
+			self.count += 1
+
+	def read(self) -> Dict[str, dict]:
+		"""Returns the queued entries keyed by folder, the last line of a folder wins."""
+		entries: Dict[str, dict] = {}
+		if not os.path.exists(self.file_path):
+			return entries
+		with open(self.file_path, 'r', encoding='utf-8') as file:
+			for line in file:
+				if line.strip() == "":
+					continue
+				entry = json.loads(line)
+				entries[entry["folder"]] = entry
+		return entries
+
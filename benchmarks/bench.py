@@ -0,0 +1,194 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+from benchmarks import fixtures
+from nfo.nfo import NFODocument
+from search.search import SearchEngine
+from search.services.bjjfanatics import BJJFanatics, extract_product_page, toEntry
+from search.services.submeta import SubMeta
+from search.titlematcher.titlematcher import TitleMatcher
+
+QUERY = "Leglocks Enter The System Gordon Ryan"
+
+
+class StubResponse():
+	def __init__(self, text: str, status_code: int = 200):
+		self.text = text
+		self.status_code = status_code
+		self.encoding = "utf-8"
+		self.headers: Dict[str, str] = {}
+
+	def json(self):
+		return json.loads(self.text)
+
+	def iter_content(self, chunk_size: int = 1):
+		content = self.text.encode("utf-8")
+		for i in range(0, len(content), chunk_size):
+			yield content[i:i + chunk_size]
+
+	def close(self):
+		pass
+
+
+"""
+StubTransport answers every request from the saved fixtures, so source code paths run end to end without the network.
+"""
+class StubTransport():
+
+	def __init__(self, payloads: Dict[str, str]):
+		self.payloads = payloads
+
+	def get(self, url: str, **kwargs) -> StubResponse:
+		if "/products/search" in url:
+			return StubResponse(self.payloads[fixtures.SEARCH_PAYLOAD])
+		return StubResponse(self.payloads[fixtures.PRODUCT_PAGE])
+
+	def post(self, url: str, **kwargs) -> StubResponse:
+		body = kwargs.get("json") or {}
+		if body.get("operationName") == "SearchCourses":
+			return StubResponse(self.payloads[fixtures.SEARCH_COURSES])
+		if body.get("operationName") == "GetCourses":
+			# every alias of a batched request resolves to the saved course
+			result = json.loads(self.payloads[fixtures.GET_COURSE])["data"]["result"]
+			return StubResponse(json.dumps({"data": {alias: result for alias in body["variables"]}}))
+		return StubResponse(self.payloads[fixtures.GET_COURSE])
+
+
+def measure(function: Callable[[], object], repeat: int, warmup: int = 1) -> dict:
+	for _ in range(warmup):
+		function()
+	timings = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function()
+		timings.append(time.perf_counter() - start)
+	return {
+		"runs": repeat,
+		"min": min(timings),
+		"median": statistics.median(timings),
+		"mean": statistics.fmean(timings),
+		"max": max(timings),
+	}
+
+
+def benchmarks(payloads: Dict[str, str]) -> Dict[str, Callable[[], object]]:
+	search_payload = json.loads(payloads[fixtures.SEARCH_PAYLOAD])
+	entries = toEntry(search_payload["videos"])
+	html = payloads[fixtures.PRODUCT_PAGE]
+	course = json.loads(payloads[fixtures.SEARCH_COURSES])["data"]["result"]["courses"][0]
+	transport = StubTransport(payloads)
+
+	submeta = SubMeta(5)
+	submeta.transport = transport
+	bjjfanatics = BJJFanatics(5)
+	bjjfanatics.transport = transport
+	result = BJJFanatics(1).toInstructionalResult(search_payload["videos"][0])
+	extracted = extract_product_page(html)
+	result.description = extracted["description"]
+	result.episodes = extracted["episodes"]
+	output = tempfile.mkdtemp(prefix="bjj-nfo-bench-")
+
+	def nfo():
+		document = NFODocument("tvshow")
+		document.add_instructional_result(result)
+		document.save(os.path.join(output, "tvshow.nfo"))
+
+	def end_to_end():
+		# fresh sources every run so per-instance caches do not hide the work
+		bjj = BJJFanatics(1)
+		sub = SubMeta(5)
+		for source in (bjj, sub):
+			source.transport = transport
+		engine = SearchEngine([bjj, sub])
+		for found in engine.search(QUERY):
+			found.results[0].hydrate()
+
+	return {
+		"titlematcher.get_best_matches": lambda: TitleMatcher(QUERY, entries).get_best_matches(),
+		"bjjfanatics.extract_product_page": lambda: extract_product_page(html),
+		"bjjfanatics.query_stream": lambda: bjjfanatics.query(QUERY),
+		"submeta.get_episodes_from_course": lambda: submeta.get_episodes_from_course(course),
+		"nfo.add_instructional_result_save": nfo,
+		"searchengine.search_end_to_end": end_to_end,
+	}
+
+
+def version() -> str:
+	try:
+		return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return "unknown"
+
+
+def compare(current: dict, baseline_path: str, tolerance: float) -> list[str]:
+	"""Returns the benchmarks whose median got slower than the baseline by more than tolerance (0.1 = 10%)."""
+	with open(baseline_path, 'r') as f:
+		baseline = json.load(f)["results"]
+	regressions = []
+	for name, timing in current["results"].items():
+		if name not in baseline:
+			continue
+		ratio = timing["median"] / baseline[name]["median"]
+		print(f"{name}: {ratio:.2f}x baseline")
+		if ratio > 1 + tolerance:
+			regressions.append(name)
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Offline benchmarks for matching, parsing and NFO generation.")
+	parser.add_argument("--repeat", type=int, default=5)
+	parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+	parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+	parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+	parser.add_argument("--tolerance", type=float, default=0.1)
+	parser.add_argument("--fixtures", default=fixtures.FIXTURE_DIR)
+	parser.add_argument("--regenerate", action="store_true", help="rewrite the generated fixtures")
+	args = parser.parse_args()
+
+	if args.regenerate:
+		fixtures.generate(args.fixtures)
+	names = [fixtures.SEARCH_PAYLOAD, fixtures.PRODUCT_PAGE, fixtures.SEARCH_COURSES, fixtures.GET_COURSE]
+	payloads = {name: fixtures.load(name, args.fixtures) for name in names}
+
+	results = {}
+	for name, function in benchmarks(payloads).items():
+		if args.filter not in name:
+			continue
+		print(f"Running {name}", file=sys.stderr)
+		# the sources log progress with print, keep stdout for the JSON report
+		with contextlib.redirect_stdout(sys.stderr):
+			results[name] = measure(function, args.repeat)
+	report = {
+		"version": version(),
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"timestamp": time.time(),
+		"results": results,
+	}
+
+	text = json.dumps(report, indent=4)
+	if args.output is None:
+		print(text)
+	else:
+		with open(args.output, 'w') as f:
+			f.write(text)
+
+	if args.baseline is not None:
+		regressions = compare(report, args.baseline, args.tolerance)
+		if len(regressions) > 0:
+			print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,127 @@
+import json
+import os
+import random
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+SEARCH_PAYLOAD = "bjjfanatics_search.json"
+PRODUCT_PAGE = "bjjfanatics_product.html"
+SEARCH_COURSES = "submeta_search_courses.json"
+GET_COURSE = "submeta_get_course.json"
+
+WORDS = (
+	"leglocks guard pass back attack system enter the half butterfly closed open mount escape "
+	"submissions kimura armbar triangle choke heel hook single leg takedown wrestling defense "
+	"fundamentals advanced details volume gordon ryan john danaher craig jones lachlan giles "
+	"mikey musumeci tom deblass bernardo faria no gi gi pressure passing front headlock"
+).split()
+
+
+def title(rng: random.Random) -> str:
+	return " ".join(rng.choices(WORDS, k=rng.randint(3, 8))).title()
+
+
+def search_payload(rng: random.Random, count: int = 10000) -> dict:
+	"""A BJJFanatics products/search response with `count` videos, with every field the real API sends."""
+	videos = []
+	for i in range(count):
+		videos.append({
+			"id": 100000 + i,
+			"title": title(rng),
+			"url": f"https://bjjfanatics.com/products/video-{i}",
+			"image": f"https://cdn.shopify.com/s/files/video-{i}.jpg",
+			"product_type": "Digital",
+			"thumbnail": [{"image": f"https://cdn.shopify.com/thumb-{i}-{j}.jpg", "urls": [f"https://cdn.shopify.com/thumb-{i}-{j}-{k}.jpg" for k in range(3)]} for j in range(2)],
+			"video_thumbs": [f"https://cdn.shopify.com/video-thumb-{i}-{j}.jpg" for j in range(4)],
+			"price": 97.0,
+			"site": "bjjfanatics",
+			"compare_at_price": 197.0,
+			"authors": [" ".join(rng.choices(WORDS, k=2)).title()],
+			"categories": ["Leglocks", "Guard"],
+			"sub_categories": ["Heel Hooks"],
+			"published_at": "2024-01-01T00:00:00Z",
+			"tags": rng.choices(WORDS, k=10),
+			"shopify_status": "active",
+			"review": {"average_score": 4.8, "total_reviews": rng.randint(0, 500)},
+			"search_identifier": f"video-{i}",
+			"_updated_from": "shopify",
+			"_updated_at": f"2024-01-{1 + i % 28:02d}T00:00:00Z",
+		})
+	return {"videos": videos, "totalResults": count, "ids": [v["id"] for v in videos]}
+
+
+def product_page(rng: random.Random, episodes: int = 40, chapters: int = 15, noise: int = 2000) -> str:
+	"""A large BJJFanatics product page: the description and course content regions buried in unrelated markup."""
+	filler = "".join(f'<div class="grid__item"><a href="/products/other-{i}"><img src="x.jpg"><span>{title(rng)}</span></a></div>' for i in range(noise))
+	description = "".join(f"<h3>{title(rng)}</h3><p>{' '.join(rng.choices(WORDS, k=60))}</p><ul><li>{title(rng)}</li><li>{title(rng)}</li></ul>" for _ in range(10))
+	accordion = ""
+	for e in range(episodes):
+		rows = "".join(f"<tr><td>{title(rng)}</td><td>{c}:00 - {c + 1}:00</td></tr>" for c in range(chapters))
+		accordion += f'<h3 class="product__course-title">Volume {e + 1}</h3><figure class="table"><table><tbody>{rows}</tbody></table></figure>'
+	return (
+		f"<html><head><title>Product</title></head><body>{filler}"
+		f'<div class="product_description">{description}</div>'
+		f'<div class="product__course-content-accordion">{accordion}</div>'
+		f"{filler}</body></html>"
+	)
+
+
+def course(rng: random.Random, i: int) -> dict:
+	return {
+		"id": str(5000 + i),
+		"title": title(rng),
+		"slug": f"course-{i}",
+		"description": " ".join(rng.choices(WORDS, k=80)),
+		"level": "Advanced",
+		"publishedAt": f"2024-02-{1 + i % 28:02d}T00:00:00Z",
+		"category": "Leglocks",
+		"cover": {"fileName": f"cover-{i}.jpg", "__typename": "File"},
+		"charge": "subscription",
+		"vimeo": None,
+		"authors": [{"id": "1", "handle": "lachlangiles", "name": "Lachlan Giles", "role": "creator", "bio": " ".join(rng.choices(WORDS, k=40)), "connectAccountId": "acct_1", "prices": [{"id": "p", "currency": "usd", "unitAmount": 1500, "status": "active", "connectAccountId": "acct_1", "billingPeriod": "month"}], "avatar": {"fileName": "avatar.jpg"}}],
+		"contentCount": {"videos": 40},
+		"isNew": False,
+		"lastContent": None,
+		"chapterCount": 20,
+		"duration": 7200.0,
+		"progress": None,
+	}
+
+
+def search_courses(rng: random.Random, count: int = 200) -> dict:
+	return {"data": {"result": {"courses": [course(rng, i) for i in range(count)], "pageInfo": {"hasNextPage": False, "hasPreviousPage": False}}}}
+
+
+def get_course(rng: random.Random, chapters: int = 20, videos: int = 10) -> dict:
+	full = course(rng, 0)
+	full["chapters"] = [
+		{
+			"id": f"ch{c}", "hidden": False, "title": title(rng), "order": c,
+			"contents": [{"id": f"v{c}-{v}", "title": title(rng), "duration": rng.randint(30, 900), "__typename": "Video"} for v in range(videos)],
+		}
+		for c in range(chapters)
+	]
+	return {"data": {"result": {"course": full, "errors": None}}}
+
+
+def generate(directory: str = FIXTURE_DIR, seed: int = 1):
+	"""Writes every fixture to directory. The output is deterministic for a given seed."""
+	rng = random.Random(seed)
+	os.makedirs(directory, exist_ok=True)
+	with open(os.path.join(directory, SEARCH_PAYLOAD), 'w') as f:
+		json.dump(search_payload(rng), f)
+	with open(os.path.join(directory, PRODUCT_PAGE), 'w') as f:
+		f.write(product_page(rng))
+	with open(os.path.join(directory, SEARCH_COURSES), 'w') as f:
+		json.dump(search_courses(rng), f)
+	with open(os.path.join(directory, GET_COURSE), 'w') as f:
+		json.dump(get_course(rng), f)
+
+
+def load(name: str, directory: str = FIXTURE_DIR) -> str:
+	"""Returns a fixture's text, generating the fixture set first if it is missing."""
+	path = os.path.join(directory, name)
+	if not os.path.exists(path):
+		generate(directory)
+	with open(path, 'r') as f:
+		return f.read()
@@ -0,0 +1,116 @@
+import json
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from search.result import EpisodeResult
+
+# (title, start, end) in seconds, end is None when the source only gives start times
+ChapterMark = Tuple[str, int, int | None]
+
+
+def chapter_marks(episode: EpisodeResult) -> List[ChapterMark]:
+	"""Converts the chapters of an episode into (title, start, end) marks."""
+	return [(chapter.title.strip(), chapter.start, chapter.end) for chapter in episode.chapters]
+
+
+def escape_metadata(value: str) -> str:
+	for char in ("\\", "=", ";", "#", "\n"):
+		value = value.replace(char, "\\" + char)
+	return value
+
+
+def ffmetadata(marks: List[ChapterMark], duration: float | None) -> str:
+	"""Renders chapter marks as an FFMETADATA1 document, a chapter without an end runs until the next one (or the end of the file)."""
+	lines = [";FFMETADATA1"]
+	for i, (title, start, end) in enumerate(marks):
+		if end is None or end <= start:
+			end = marks[i + 1][1] if i + 1 < len(marks) else int(duration or start + 1)
+		lines += ["[CHAPTER]", "TIMEBASE=1/1000", f"START={start * 1000}", f"END={end * 1000}", f"title={escape_metadata(title)}"]
+	return "\n".join(lines) + "\n"
+
+
+def probe(video: str) -> Tuple[List[ChapterMark], float | None]:
+	"""Returns the chapters already in a video and its duration, using ffprobe."""
+	output = subprocess.run(
+		["ffprobe", "-v", "error", "-print_format", "json", "-show_chapters", "-show_format", video],
+		capture_output=True, text=True, check=True
+	).stdout
+	data = json.loads(output)
+	chapters = [
+		(chapter.get("tags", {}).get("title", "").strip(), round(float(chapter["start_time"])), round(float(chapter["end_time"])))
+		for chapter in data.get("chapters", [])
+	]
+	duration = data.get("format", {}).get("duration")
+	return chapters, None if duration is None else float(duration)
+
+
+def chapters_match(existing: List[ChapterMark], marks: List[ChapterMark]) -> bool:
+	if len(existing) != len(marks):
+		return False
+	return all(a[0] == b[0] and abs(a[1] - b[1]) <= 1 for a, b in zip(existing, marks))
+
+
+def inject(video: str, marks: List[ChapterMark]) -> bool:
+	"""
+	Writes chapter marks into a video with a stream-copy remux, replacing the file atomically.
+	Returns False when the video already carries the same chapters.
+	"""
+	existing, duration = probe(video)
+	if chapters_match(existing, marks):
+		return False
+	# hidden temp files, so a remux left behind by a crash is never listed as a video of the folder
+	folder, name = os.path.split(video)
+	root, extension = os.path.splitext(name)
+	metadata_path = os.path.join(folder, f".{root}.chapters.txt")
+	temp_path = os.path.join(folder, f".{root}.chapters{extension}")
+	try:
+		with open(metadata_path, 'w', encoding='utf-8') as f:
+			f.write(ffmetadata(marks, duration))
+		subprocess.run(
+			["ffmpeg", "-v", "error", "-y", "-i", video, "-f", "ffmetadata", "-i", metadata_path,
+			"-map", "0", "-map_metadata", "0", "-map_chapters", "1", "-codec", "copy", temp_path],
+			capture_output=True, text=True, check=True
+		)
+		os.replace(temp_path, video)
+	finally:
+		for path in (metadata_path, temp_path):
+			if os.path.exists(path):
+				os.remove(path)
+	return True
+
+
+def inject_task(task: Tuple[str, List[ChapterMark]]) -> Tuple[str, bool | str]:
+	video, marks = task
+	try:
+		return video, inject(video, marks)
+	except (OSError, subprocess.CalledProcessError) as e:
+		return video, str(getattr(e, "stderr", "") or e).strip()
+
+
+"""
+ChapterInjector writes the chapters of each episode into its video file.
+
+Every file is remuxed with ffmpeg stream copy (no re-encode) in its own worker process, and files that already carry the same chapters are skipped, so a run is bound by disk I/O.
+
+Usage:
+	injector = ChapterInjector()
+	injector.inject_all(list(zip(video_files, result.episodes)))
+"""
+class ChapterInjector():
+
+	def __init__(self, workers: int | None = None):
+		self.workers = workers
+
+	def inject_all(self, pairs: List[Tuple[str, EpisodeResult]]) -> dict[str, bool | str]:
+		"""
+		Injects chapters into every (video, episode) pair.
+		:return: A mapping of video to True (written), False (already up to date) or an error message.
+		"""
+		tasks = [(video, chapter_marks(episode)) for video, episode in pairs]
+		tasks = [task for task in tasks if len(task[1]) > 0]
+		if len(tasks) == 0:
+			return {}
+		with ProcessPoolExecutor(max_workers=self.workers) as pool:
+			return dict(pool.map(inject_task, tasks))
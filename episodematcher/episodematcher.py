@@ -0,0 +1,193 @@
+import functools
+import json
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from appmeta.metastore import write_json_atomic
+from metrics.metrics import metrics
+from search.result import EpisodeResult
+
+# probed durations of a show folder's videos, keyed by inode, size and mtime
+SIDECAR = ".probe.json"
+DEFAULT_WORKERS = 8
+
+# a video this much longer or shorter than its episode (relative) gets the full duration cost
+DURATION_TOLERANCE = 0.25
+# cost weights when both durations are known, the order weight keeps name order for otherwise equal files
+TITLE_WEIGHT = 0.4
+DURATION_WEIGHT = 0.5
+ORDER_WEIGHT = 0.1
+# when the counts differ a pair costing more than this is left unmatched rather than forced
+MAX_COST = 0.75
+
+
+def file_key(stat: os.stat_result) -> str:
+	return f"{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}"
+
+@functools.cache
+def ffprobe_available() -> bool:
+	if shutil.which("ffprobe") is None:
+		print("ffprobe not found, episodes are matched to videos by title and name order")
+		return False
+	return True
+
+def probe_duration(video: str) -> float | None:
+	"""Returns the duration of a video in seconds using ffprobe, None when it cannot be probed."""
+	try:
+		output = subprocess.run(
+			["ffprobe", "-v", "error", "-print_format", "json", "-show_entries", "format=duration", video],
+			capture_output=True, text=True, check=True
+		).stdout
+		duration = json.loads(output).get("format", {}).get("duration")
+		return None if duration is None else float(duration)
+	except (OSError, subprocess.CalledProcessError, ValueError) as e:
+		print(f"Error[probe]: {os.path.basename(video)} - {str(getattr(e, 'stderr', '') or e).strip()}")
+		return None
+
+def episode_duration(episode: EpisodeResult) -> int | None:
+	"""Returns the length of an episode from the end of its last chapter, None when its chapters have no end times."""
+	ends = [chapter.end for chapter in episode.chapters if chapter.end is not None]
+	return max(ends) if len(ends) > 0 else None
+
+
+"""
+ProbeIndex returns the durations of a show folder's videos, probing each file with ffprobe only once.
+
+Durations are kept in a .probe.json sidecar keyed by each file's inode, size and mtime, so renamed files are still hits and a replaced or re-muxed file is probed again. Misses are probed `workers` at a time.
+
+Usage:
+	index = ProbeIndex("/library/Leglocks")
+	durations = index.durations(list_videos("/library/Leglocks"))
+"""
+class ProbeIndex():
+
+	def __init__(self, folder: str, workers: int = DEFAULT_WORKERS):
+		self.path = os.path.join(folder, SIDECAR)
+		self.workers = workers
+		self.entries: Dict[str, float] = {}
+		try:
+			with open(self.path, 'r') as file:
+				self.entries = json.load(file)
+		except (OSError, ValueError):
+			pass
+
+	def durations(self, videos: List[str]) -> List[float | None]:
+		keys = [file_key(os.stat(video)) for video in videos]
+		missing = [(video, key) for video, key in zip(videos, keys) if key not in self.entries]
+		metrics.count("probe_cache_hits", len(videos) - len(missing))
+		if len(missing) > 0:
+			with metrics.span("episodematcher.probe"), ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="probe") as pool:
+				probed = list(pool.map(probe_duration, [video for video, _ in missing]))
+			metrics.count("probes", len(missing))
+			for (_, key), duration in zip(missing, probed):
+				if duration is not None:
+					self.entries[key] = duration
+		# entries of files that are gone are dropped
+		current = {key: self.entries[key] for key in keys if key in self.entries}
+		if len(missing) > 0 or len(current) != len(self.entries):
+			self.entries = current
+			write_json_atomic(self.path, current)
+		return [self.entries.get(key) for key in keys]
+
+
+def assign(cost: List[List[float]]) -> List[int]:
+	"""
+	Solves the assignment problem with the Hungarian algorithm in O(n^2 m).
+	Returns, for each row, the column assigned to it so that the total cost is minimal. Needs no more rows than columns.
+	"""
+	n = len(cost)
+	m = len(cost[0]) if n > 0 else 0
+	inf = float("inf")
+	# potentials and matching, 1-based with column 0 as the free start
+	u = [0.0] * (n + 1)
+	v = [0.0] * (m + 1)
+	match = [0] * (m + 1)
+	way = [0] * (m + 1)
+	for i in range(1, n + 1):
+		match[0] = i
+		j0 = 0
+		minv = [inf] * (m + 1)
+		used = [False] * (m + 1)
+		while True:
+			used[j0] = True
+			i0 = match[j0]
+			delta = inf
+			j1 = 0
+			for j in range(1, m + 1):
+				if not used[j]:
+					current = cost[i0 - 1][j - 1] - u[i0] - v[j]
+					if current < minv[j]:
+						minv[j] = current
+						way[j] = j0
+					if minv[j] < delta:
+						delta = minv[j]
+						j1 = j
+			for j in range(m + 1):
+				if used[j]:
+					u[match[j]] += delta
+					v[j] -= delta
+				else:
+					minv[j] -= delta
+			j0 = j1
+			if match[j0] == 0:
+				break
+		while True:
+			j1 = way[j0]
+			match[j0] = match[j1]
+			j0 = j1
+			if j0 == 0:
+				break
+	result = [-1] * n
+	for j in range(1, m + 1):
+		if match[j] != 0:
+			result[match[j] - 1] = j - 1
+	return result
+
+def pair_cost(video: str, episode: EpisodeResult, order: float, video_duration: float | None, duration: int | None) -> float:
+	"""Cost of showing a video as an episode, between 0 (same title, same length, same position) and 1."""
+	from fuzzywuzzy import fuzz
+	title = 1 - fuzz.token_set_ratio(os.path.splitext(os.path.basename(video))[0], episode.title) / 100
+	if video_duration is None or duration is None or duration <= 0:
+		return (1 - ORDER_WEIGHT) * title + ORDER_WEIGHT * order
+	off = min(1.0, abs(video_duration - duration) / duration / DURATION_TOLERANCE)
+	return TITLE_WEIGHT * title + DURATION_WEIGHT * off + ORDER_WEIGHT * order
+
+def match_episodes(videos: List[str], episodes: List[EpisodeResult], durations: List[float | None] | None = None) -> List[str | None]:
+	"""
+	Assigns videos to episodes by title similarity and duration, with one optimal assignment over every pair instead of a greedy pass.
+	durations[i] is the length of videos[i] in seconds, or None when unknown. Without any, titles and name order decide.
+	:return: The video of each episode, None for episodes left without one.
+	"""
+	if len(videos) == 0 or len(episodes) == 0:
+		return [None] * len(episodes)
+	durations = [None] * len(videos) if durations is None else durations
+	lengths = [episode_duration(episode) for episode in episodes]
+	span = max(len(videos), len(episodes)) - 1 or 1
+	with metrics.span("episodematcher.match"):
+		cost = [
+			[pair_cost(video, episode, abs(i - j) / span, durations[j], lengths[i]) for j, video in enumerate(videos)]
+			for i, episode in enumerate(episodes)
+		]
+		# the algorithm needs no more rows than columns, more episodes than videos are solved transposed
+		if len(episodes) <= len(videos):
+			columns = assign(cost)
+		else:
+			rows = assign([list(column) for column in zip(*cost)])
+			columns = [-1] * len(episodes)
+			for j, i in enumerate(rows):
+				columns[i] = j
+	forced = len(videos) == len(episodes)
+	return [
+		videos[j] if j >= 0 and (forced or cost[i][j] <= MAX_COST) else None
+		for i, j in enumerate(columns)
+	]
+
+def match_folder(folder: str, videos: List[str], episodes: List[EpisodeResult]) -> List[str | None]:
+	"""Matches a show folder's videos to episodes, probing durations only when the episodes have some to compare against."""
+	durations = None
+	if any(episode_duration(episode) is not None for episode in episodes) and len(videos) > 0 and ffprobe_available():
+		durations = ProbeIndex(folder).durations(videos)
+	return match_episodes(videos, episodes, durations)
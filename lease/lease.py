@@ -0,0 +1,163 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, TypedDict
+
+# lease files sit next to each folder's data.json
+LEASE_FILE = ".lease"
+DEFAULT_TTL = 300
+
+class Lease(TypedDict):
+	holder: str # host:pid of the process holding the folder
+	token: str # tells holders apart when a pid is reused on another host
+	acquired: float
+	expires: float
+
+
+def holder() -> str:
+	return f"{socket.gethostname()}:{os.getpid()}"
+
+def read_lease(path: str) -> Lease | None:
+	"""Returns the lease stored at path, None if there is none or it is still being written."""
+	try:
+		with open(path, 'r') as file:
+			return json.load(file)
+	except (OSError, ValueError):
+		return None
+
+
+"""
+LeaseManager coordinates the processes, on one machine or many sharing the library, that work on the same folders.
+
+A folder is leased by creating its .lease file with O_CREAT|O_EXCL, which only one process can win. The lease records its holder (host:pid) and when it expires, held leases are renewed in the background every ttl/3 seconds, so a lease only expires when its holder crashed or lost the share. An expired lease is taken over by renaming it away first (only one rename succeeds) and then creating a new one, so a crashed worker never strands a folder for longer than ttl.
+
+Usage:
+	leases = LeaseManager(ttl=300)
+	if leases.acquire("/library/Leglocks"):
+		process("/library/Leglocks")
+		leases.release("/library/Leglocks")
+	leases.close()
+"""
+class LeaseManager():
+
+	def __init__(self, ttl: float = DEFAULT_TTL):
+		self.ttl = ttl
+		self.holder = holder()
+		self.token = uuid.uuid4().hex
+		self.held: Dict[str, Lease] = {}
+		self.lock = threading.Lock()
+		self.stopped = threading.Event()
+		self.renewer: threading.Thread | None = None
+
+	def path(self, folder: str) -> str:
+		return os.path.join(folder, LEASE_FILE)
+
+	def lease(self) -> Lease:
+		now = time.time()
+		return Lease(holder=self.holder, token=self.token, acquired=now, expires=now + self.ttl)
+
+	def acquire(self, folder: str) -> bool:
+		"""Leases a folder, returns False when another live process holds it."""
+		path = self.path(folder)
+		if self.create(path):
+			self.hold(folder, path)
+			return True
+		current = read_lease(path)
+		if current is None:
+			# a lease that cannot be read is being written right now, unless it was abandoned half written
+			try:
+				if os.path.getmtime(path) + self.ttl > time.time():
+					return False
+			except OSError:
+				return False
+		elif current["expires"] > time.time():
+			return False
+		print(f"Taking over expired lease of {os.path.basename(folder)}" + ("" if current is None else f" from {current['holder']}"))
+		stale = f"{path}.{self.token}"
+		try:
+			os.rename(path, stale)
+		except FileNotFoundError:
+			# another process took it over first
+			return False
+		moved = read_lease(stale)
+		if moved is not None and moved["expires"] > time.time():
+			# the expired lease was replaced by a live one before the rename, put it back
+			try:
+				os.link(stale, path)
+			except OSError:
+				pass
+			os.remove(stale)
+			return False
+		os.remove(stale)
+		if not self.create(path):
+			return False
+		self.hold(folder, path)
+		return True
+
+	def create(self, path: str) -> bool:
+		try:
+			fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+		except FileExistsError:
+			return False
+		with os.fdopen(fd, 'w') as file:
+			json.dump(self.lease(), file)
+		return True
+
+	def hold(self, folder: str, path: str):
+		with self.lock:
+			self.held[folder] = read_lease(path) or self.lease()
+			if self.renewer is None:
+				self.renewer = threading.Thread(target=self.renew_loop, name="lease-renew", daemon=True)
+				self.renewer.start()
+
+	def renew_loop(self):
+		while not self.stopped.wait(self.ttl / 3):
+			self.renew()
+
+	def renew(self):
+		"""Pushes back the expiry of every held lease, leases that were taken over meanwhile are dropped."""
+		with self.lock:
+			for folder in list(self.held.keys()):
+				path = self.path(folder)
+				current = read_lease(path)
+				if current is None or current["token"] != self.token:
+					print(f"Lost lease of {os.path.basename(folder)}")
+					del self.held[folder]
+					continue
+				lease = Lease(holder=self.holder, token=self.token, acquired=current["acquired"], expires=time.time() + self.ttl)
+				temp_path = f"{path}.{self.token}.tmp"
+				try:
+					with open(temp_path, 'w') as file:
+						json.dump(lease, file)
+					os.replace(temp_path, path)
+				except OSError as e:
+					print(f"Error renewing lease of {os.path.basename(folder)} - {e}")
+					continue
+				self.held[folder] = lease
+
+	def moved(self, folder: str, new_folder: str):
+		"""Follows a leased folder that was renamed, its lease file moved with it."""
+		with self.lock:
+			if folder in self.held:
+				self.held[new_folder] = self.held.pop(folder)
+
+	def release(self, folder: str):
+		"""Removes the lease of a folder, if this process still holds it."""
+		with self.lock:
+			if self.held.pop(folder, None) is None:
+				return
+			path = self.path(folder)
+			current = read_lease(path)
+			if current is not None and current["token"] == self.token:
+				try:
+					os.remove(path)
+				except FileNotFoundError:
+					pass
+
+	def close(self):
+		self.stopped.set()
+		for folder in list(self.held.keys()):
+			self.release(folder)
@@ -0,0 +1,531 @@
+import argparse
+import json
+import os
+import re
+import socket
+import sqlite3
+import time
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from typing import Dict, List, Tuple
+from appmeta.appmeta import AppMeta, peek
+from artwork.artwork import ArtworkFetcher
+from appmeta.metastore import MetaStore, read_records, write_json_atomic
+from batch.batch import ReviewQueue, pick_confident
+from chapterinjection.chapterinjector import ChapterInjector, chapter_marks
+from episodematcher.episodematcher import match_folder
+from lease.lease import LeaseManager
+from metrics.metrics import metrics
+from nfo.nfo import list_videos, write_show
+from prefetch.prefetch import Prefetcher
+from scanner.scanner import FolderState, Scanner, watch
+from search.cache.cache import ResponseCache
+from search.catalog.catalog import Catalog
+from search.search import AsyncSearchEngine, SearchEngine, SearchResult, SearchResults, create_source
+from search.transport.transport import share_transport
+
+bjj: SearchEngine | None = None
+# downloads the artwork of processed folders for the length of a run, None with --no-artwork
+artwork: ArtworkFetcher | None = None
+# folders leased by this process in a sharded run, None otherwise
+leases: LeaseManager | None = None
+# the library store's records in a sharded worker, read once by the parent
+shard_records: Dict[str, dict] = {}
+# folders handled while their artwork was still being written, recorded by flush_marks once it is done
+deferred_marks: List[Tuple[Scanner, str, List[Future]]] = []
+
+def engine() -> SearchEngine:
+	"""Returns the search engine, its sources are imported and built on first use."""
+	global bjj
+	if bjj is None:
+		bjj = SearchEngine(
+			[
+				create_source("BJJFanatics", 1),
+				create_source("SubMeta", 5)
+			]
+		)
+	return bjj
+
+def sanitize_filename(filename: str) -> str:
+    # Replace problematic characters like ':' with '_'
+    return re.sub(r'[\/:*?"<>|]', '_', filename)
+
+def run(path: str, args: argparse.Namespace):
+	"""Processes a library folder as described by the parsed command line."""
+	# --metrics writes metrics.json and a bjj_nfo.prom for the node exporter, to --metrics-dir or the library root
+	if args.metrics:
+		metrics.enable()
+	if args.shards > 0:
+		try:
+			sharded(path, args)
+		finally:
+			write_metrics(path, args)
+		return
+
+	setup(path, args)
+	# folder metadata lives in one store at the library root, --export-json keeps writing each data.json too
+	store = MetaStore(path, export=args.export_json)
+	global artwork
+	if not args.no_artwork:
+		artwork = ArtworkFetcher(path, size=args.artwork_size, refresh=args.refresh)
+	try:
+		library(path, args, store)
+	finally:
+		if artwork is not None:
+			artwork.close()
+			artwork = None
+		store.close()
+		write_metrics(path, args)
+
+def setup(path: str, args: argparse.Namespace):
+	"""Points the search engine at the response cache, the local catalog and the library's SubMeta creators."""
+	# --refresh bypasses cached responses but still stores the fresh ones
+	engine().set_cache(ResponseCache(refresh=args.refresh))
+	# sources that have been synced with `catalog sync` are searched locally
+	engine().set_catalog(Catalog())
+	use_creators(submeta_creators(AppMeta(f"{path}/folder.json")))
+
+def write_metrics(path: str, args: argparse.Namespace):
+	if metrics.enabled:
+		metrics_dir = args.metrics_dir or path
+		metrics.write_json(f"{metrics_dir}/metrics.json")
+		metrics.write_prometheus(f"{metrics_dir}/bjj_nfo.prom")
+
+def library(path: str, args: argparse.Namespace, store: MetaStore):
+	scanner = Scanner(path)
+	try:
+		folders(path, args, store, scanner)
+	finally:
+		flush_marks()
+		scanner.save()
+
+def mark(scanner: Scanner, file: str, folder: str | None = None):
+	"""
+	Records a folder as handled. Writing artwork changes a folder's mtime, so a folder whose artwork is still downloading is recorded by flush_marks once it is written.
+	folder is where the artwork goes, when the folder was renamed after its instructional.
+	"""
+	queued = [] if artwork is None else artwork.queued(folder or os.path.join(scanner.root, file))
+	if len(queued) == 0:
+		scanner.mark(file)
+	else:
+		deferred_marks.append((scanner, file, queued))
+
+def flush_marks():
+	"""Records the folders whose marks waited on their artwork, once it is written."""
+	for scanner, file, queued in deferred_marks:
+		wait(queued)
+		scanner.mark(file)
+	deferred_marks.clear()
+
+def folders(path: str, args: argparse.Namespace, store: MetaStore, scanner: Scanner):
+	chaptermode = args.chapters
+	if args.watch:
+		watch_library(path, store, scanner, args.threshold, args.margin, args.workers)
+		return
+
+	# only new or changed folders are listed, chapter mode works on already processed folders so it always sees everything
+	dir = scanner.scan(full=chaptermode or args.full)
+	if args.batch:
+		batch(path, dir, store, scanner, args.threshold, args.margin, args.workers)
+		return
+
+	print(f"Files in {path}")
+	for file in dir:
+		print(f"{file}")
+			
+	c = input("Is this okay? [Y/N]\n")
+	if c != "Y" and c != "y":
+		return 
+	
+	foldermeta = AppMeta(f"{path}/folder.json")
+	submetaOnly = foldermeta.get_data()['submeta'] is not None
+	# the next folders are searched while the current prompt is answered
+	prefetcher = Prefetcher(lambda name: engine().search(name, submetaOnly), args.lookahead)
+	try:
+		for i, file in enumerate(dir):
+			prefetcher.schedule(upcoming for upcoming in dir[i:] if needs_search(path, upcoming, chaptermode, store))
+			with metrics.folder(file):
+				interactive_folder(path, file, chaptermode, store, scanner, foldermeta, prefetcher)
+	finally:
+		prefetcher.close()
+
+def needs_search(path: str, file: str, chaptermode: bool, store: MetaStore) -> bool:
+	"""
+	Returns whether interactive_folder will search a folder, the same checks it makes before searching.
+	The folder's record is only read, creating it here would hide from interactive_folder that the folder was never processed.
+	"""
+	# chapter mode looks up the result selected when the folder was processed instead of searching
+	if chaptermode:
+		return False
+	data = peek(f"{path}/{file}/data.json", store)
+	if data is None:
+		return True
+	return not data['ignore'] and data['name'] == ""
+
+def take_prefetch(prefetcher: Prefetcher | None, file: str) -> SearchResults | None:
+	return None if prefetcher is None else prefetcher.take(file)
+
+def cancel_prefetch(prefetcher: Prefetcher | None, file: str):
+	if prefetcher is not None:
+		prefetcher.cancel(file)
+
+def interactive_folder(path: str, file: str, chaptermode: bool, store: MetaStore, scanner: Scanner, foldermeta: AppMeta, prefetcher: Prefetcher | None = None):
+	print("\n")
+	metadata = AppMeta(f"{path}/{file}/data.json", store)
+	submetaOnly = False
+	if foldermeta.get_data()['submeta'] is not None:
+		submetaOnly = True
+	if metadata.should_ignore():
+			print(f"Ignoring {file}")
+			cancel_prefetch(prefetcher, file)
+			scanner.mark(file)
+			return
+	if chaptermode:
+		if metadata.first:
+			print(f"Please process - {file} before using chapter mode")
+			cancel_prefetch(prefetcher, file)
+			return
+		# chapters are written into the videos, so they come from the result the user selected and never from a new search
+		data = metadata.get_data()
+		result = engine().resolve(data.get('source', ''), data.get('url', ''), data['name'])
+		if result is None:
+			print(f"No selected result recorded for {file}, process it again before using chapter mode")
+			return
+		print(f"Selected: {result.title}")
+		try:
+			result.hydrate()
+		except Exception as e:
+			print(f"Error: {e}")
+			return
+		if result.episodes is None or len(result.episodes) == 0:
+			print(f"No episodes found for {file}")
+			return
+		print(f"Episodes found: {len(result.episodes)}")
+		for i in range(len(result.episodes)):
+			for title, start, end in chapter_marks(result.episodes[i]):
+				print(f"[{i}] - {title} - {start}s")
+		# videos are matched to episodes by title and duration, episodes without a video get no chapters
+		videos = match_folder(f"{path}/{file}", list_videos(f"{path}/{file}"), result.episodes)
+		pairs = [(video, episode) for video, episode in zip(videos, result.episodes) if video is not None]
+		if len(pairs) == 0:
+			print(f"No videos match the episodes of {file}, not injecting chapters")
+			return
+		if len(pairs) != len(result.episodes):
+			print(f"Matched {len(pairs)} of {len(result.episodes)} episodes to videos")
+		for video, status in ChapterInjector().inject_all(pairs).items():
+			if status is True:
+				print(f"Chapters written - {os.path.basename(video)}")
+			elif status is False:
+				print(f"Chapters up to date - {os.path.basename(video)}")
+			else:
+				print(f"Error: {os.path.basename(video)} - {status}")
+	else:
+		if metadata.get_data()['name'] != "":
+			print(f"Already processed {file} - {metadata.get_data()['name']}")
+			cancel_prefetch(prefetcher, file)
+			revalidate_artwork(f"{path}/{file}")
+			mark(scanner, file)
+			return
+		results = take_prefetch(prefetcher, file)
+		if results is None:
+			results = engine().search(file, submetaOnly)
+		# a source that failed is not a no-match, the folder stays unmarked and is searched again next run
+		if unavailable(file, results):
+			return
+		if results.is_partial():
+			print(f"{', '.join(results.partial)} did not answer, results may be incomplete")
+		result = search(file, submetaOnly, results)
+		if result is None:
+			metadata.update_data(ignore=True)
+			scanner.mark(file)
+			return
+		print(f"Selected: {result}")
+		# a folder that could not be written stays unmarked and is processed again next run
+		folder = apply_result(path, file, metadata, foldermeta, result)
+		if folder is not None:
+			mark(scanner, file, folder)
+
+def unavailable(file: str, results: SearchResults) -> bool:
+	"""Returns whether a search found nothing because sources failed, rather than because nothing matched."""
+	if len(results) > 0 or not results.is_partial():
+		return False
+	print(f"{', '.join(results.partial)} did not answer, {file} is retried on the next run")
+	return True
+
+def apply_result(path: str, file: str, metadata: AppMeta, foldermeta: AppMeta, result: SearchResult) -> str | None:
+	"""Writes the NFO of the selected result and renames the folder after it, returns the renamed folder or None on errors."""
+	try:
+		# only the selected candidate pays for its detail fetch, before the folder is touched
+		result.results[0].hydrate()
+		# change the name of the folder to the title of the instructional
+		folder = f"{path}/{sanitize_filename(result.results[0].title)}"
+		os.rename(f"{path}/{file}", folder)
+		if leases is not None:
+			leases.moved(f"{path}/{file}", folder)
+		# episode NFOs are written for the videos matched to an episode by title and duration
+		write_show(folder, result.results[0], match_folder(folder, list_videos(folder), result.results[0].episodes))
+		if artwork is not None:
+			artwork.submit(folder, result.results[0].image)
+		metadata.change_path(f"{path}/{sanitize_filename(result.results[0].title)}/data.json")
+		metadata.update_data(name=result.results[0].title, ignore=False, source=result.results[0].source, url=result.results[0].url, submeta=foldermeta.get_data()['submeta'])
+		return folder
+	except Exception as e:
+		print(f"Error: {e}")
+		return None
+
+def revalidate_artwork(folder: str):
+	"""Re-checks the artwork of an already processed folder, a 304 costs no image bytes."""
+	if artwork is not None:
+		artwork.revalidate(folder)
+
+def watch_library(path: str, store: MetaStore, scanner: Scanner, threshold: int, margin: int, workers: int):
+	"""Runs batch mode on every folder that lands in the library until interrupted."""
+	# folders sent to review stay unmarked for interactive mode, remember them so they are not queued again until they change
+	reviewed = {}
+	print(f"Watching {path}")
+	try:
+		for changed in watch(scanner):
+			changed = [file for file in changed if reviewed.get(file) != scanner.seen.get(file)]
+			if len(changed) == 0:
+				continue
+			for file in batch(path, changed, store, scanner, threshold, margin, workers):
+				reviewed[file] = scanner.seen.get(file)
+			store.flush()
+			flush_marks()
+			scanner.save()
+	except KeyboardInterrupt:
+		print("Stopped watching")
+
+def batch(path: str, dir: list[str], store: MetaStore | None, scanner: Scanner, threshold: int, margin: int, workers: int) -> list[str]:
+	"""
+	Processes every folder without prompting.
+	Searches run concurrently on one event loop and feed a single writer, confident matches are applied and the rest go to review.jsonl.
+	Returns the folders that were sent to review.
+	"""
+	foldermeta = AppMeta(f"{path}/folder.json")
+	submetaOnly = foldermeta.get_data()['submeta'] is not None
+	review = ReviewQueue(f"{path}/review.jsonl")
+	accepted = 0
+	retried = 0
+	failed = 0
+	reviewed = []
+
+	def write_folder(file: str, metadata: AppMeta, result: SearchResult) -> str | None:
+		with metrics.folder(file):
+			return apply_result(path, file, metadata, foldermeta, result)
+
+	pending = {}
+	for file in dir:
+		metadata = AppMeta(f"{path}/{file}/data.json", store)
+		data = metadata.get_data()
+		if data['ignore'] or data['name'] != "":
+			if data['name'] != "":
+				revalidate_artwork(f"{path}/{file}")
+			mark(scanner, file)
+			continue
+		pending[file] = metadata
+
+	with ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer") as writer:
+		writes = []
+		# searches run on one event loop, `workers` at a time, confident matches arrive already hydrated
+		searches = AsyncSearchEngine(engine()).search_all(list(pending), submetaOnly, workers, lambda results: pick_confident(results, threshold, margin))
+		for file, results, result in searches:
+			metadata = pending[file]
+			if result is None and results.is_partial():
+				# the missing source may hold the match, the folder stays unmarked and is searched again next run
+				print(f"Retry: {file} - {', '.join(results.partial)} did not answer")
+				retried += 1
+				continue
+			if result is None:
+				print(f"Review: {file}")
+				review.add(file, results, "no match" if len(results) == 0 else "ambiguous")
+				reviewed.append(file)
+				continue
+			print(f"Accepted: {file} -> {result.results[0].title} ({result.results[0].score})")
+			# folder renames and NFO writes go through one writer so searches never wait on disk
+			writes.append((file, writer.submit(write_folder, file, metadata, result)))
+		# a folder is only recorded as handled once it was written, failed folders are processed again next run
+		for file, write in writes:
+			folder = write.result()
+			if folder is None:
+				print(f"Failed: {file}")
+				failed += 1
+				continue
+			accepted += 1
+			mark(scanner, file, folder)
+
+	print(f"Accepted {accepted}, queued {review.count} for review in {review.file_path}" + (f", {retried} to retry" if retried > 0 else "") + (f", {failed} failed" if failed > 0 else ""))
+	return reviewed
+
+def sharded(path: str, args: argparse.Namespace):
+	"""
+	Batch processes the library with `args.shards` worker processes.
+	Folders are handed out in chunks and a worker only processes the folders it can lease, so any number of machines can run on the same library at once. Their metadata is kept in each folder's data.json, which the leases guard, and copied into the library store at the end.
+	"""
+	scanner = Scanner(path)
+	dir = scanner.scan(full=args.full)
+	# machines sharing the library start at different folders so they rarely race for the same leases
+	if len(dir) > 0:
+		start = zlib.crc32(socket.gethostname().encode()) % len(dir)
+		dir = dir[start:] + dir[:start]
+	size = max(args.workers, 1) * 2
+	chunks = [dir[i:i + size] for i in range(0, len(dir), size)]
+	# created once here instead of racing in every worker
+	AppMeta(f"{path}/folder.json")
+	records = read_records(path)
+	written: List[str] = []
+	counts: Dict[str, int] = {}
+	print(f"Processing {len(dir)} folders with {args.shards} workers")
+	try:
+		with ProcessPoolExecutor(max_workers=args.shards, initializer=shard_init, initargs=(path, args, records)) as pool:
+			for future in as_completed([pool.submit(shard_chunk, path, chunk, args) for chunk in chunks]):
+				handled, folders, artwork_counts, summary = future.result()
+				scanner.snapshot.update(handled)
+				written += folders
+				for status, count in artwork_counts.items():
+					counts[status] = counts.get(status, 0) + count
+				metrics.merge(summary)
+	finally:
+		scanner.save()
+		if len(counts) > 0:
+			print("Artwork - " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+		store_records(path, written, args.lease_ttl)
+
+def shard_init(path: str, args: argparse.Namespace, records: Dict[str, dict]):
+	"""Sets up a worker process of a sharded run."""
+	global artwork, leases, shard_records
+	if args.metrics:
+		metrics.enable()
+	# the workers of a machine split its rate limits instead of multiplying them
+	share_transport(args.shards)
+	setup(path, args)
+	if not args.no_artwork:
+		artwork = ArtworkFetcher(path, size=args.artwork_size, refresh=args.refresh)
+	leases = LeaseManager(args.lease_ttl)
+	shard_records = records
+
+def shard_chunk(path: str, chunk: List[str], args: argparse.Namespace) -> Tuple[Dict[str, FolderState], List[str], Dict[str, int], dict]:
+	"""
+	Batch processes the folders of a chunk that no other process holds.
+	Returns the scanner state of the folders it handled, the folders whose data.json it wrote, its artwork statuses and its metrics.
+	"""
+	# only the folders handled by this chunk are reported back to the parent's snapshot
+	scanner = Scanner(path)
+	scanner.snapshot.clear()
+	leased = []
+	for file in chunk:
+		folder = f"{path}/{file}"
+		if not os.path.isdir(folder) or not leases.acquire(folder):
+			continue
+		seed_data(path, file)
+		leased.append(file)
+	written = []
+	counts: Dict[str, int] = {}
+	try:
+		if len(leased) > 0:
+			batch(path, leased, None, scanner, args.threshold, args.margin, args.workers)
+	finally:
+		# artwork is written into the folders, so they stay leased until it is done
+		if artwork is not None:
+			counts = artwork.wait()
+		flush_marks()
+		written = [os.path.basename(folder) for folder in leases.held]
+		for folder in list(leases.held):
+			leases.release(folder)
+	# removing the lease changed the folders' mtime
+	for file in leased:
+		if file in scanner.snapshot:
+			scanner.mark(file)
+	summary = metrics.summary()
+	metrics.reset()
+	return scanner.snapshot, written, counts, summary
+
+def seed_data(path: str, file: str):
+	"""Writes a folder's data.json from the library store when only the store has its record, so workers skip folders that single process runs already handled."""
+	data_path = f"{path}/{file}/data.json"
+	record = shard_records.get(os.path.join(file, "data.json"))
+	if record is not None and not os.path.exists(data_path):
+		write_json_atomic(data_path, record)
+
+def store_records(path: str, written: List[str], ttl: float):
+	"""
+	Copies the data.json of the folders a sharded run wrote into the library store, so single process runs see them.
+	SQLite's own locking cannot be trusted on a share, so machines take turns through a lease on the library root, waiting up to ttl for it.
+	"""
+	if len(written) == 0:
+		return
+	lock = LeaseManager(ttl)
+	deadline = time.monotonic() + ttl
+	while not lock.acquire(path):
+		if time.monotonic() >= deadline:
+			# single process runs adopt the data.json of folders the store does not know
+			print(f"Could not update {path}/library.db - another machine is writing it, the data.json files are up to date")
+			lock.close()
+			return
+		time.sleep(1)
+	try:
+		store = MetaStore(path)
+		try:
+			for file in written:
+				data_path = f"{path}/{file}/data.json"
+				if os.path.exists(data_path):
+					with open(data_path, 'r') as data:
+						store.put(data_path, json.load(data))
+		finally:
+			store.close()
+	except sqlite3.Error as e:
+		print(f"Could not update {path}/library.db - {e}")
+	finally:
+		lock.close()
+
+def submeta_creators(foldermeta: AppMeta) -> list[str]:
+	"""Returns the SubMeta handles a library asks for, from the `submeta` author in its folder.json."""
+	submeta = foldermeta.get_data().get('submeta')
+	if isinstance(submeta, dict) and submeta.get('author'):
+		return [submeta['author']]
+	if isinstance(submeta, str) and submeta != "":
+		return [submeta]
+	return []
+
+def use_creators(creators: list[str]):
+	"""Points the SubMeta source at the given creator handles, the default handles are kept when there are none."""
+	if len(creators) == 0:
+		return
+	for source in engine().sources:
+		if source.source == "SubMeta":
+			source.creators = creators
+
+def catalog_sync(creators: list[str] | None = None, libraries: list[str] | None = None):
+	"""Syncs every source into the local catalog, crawling the given SubMeta creators and those of each library's folder.json."""
+	handles = [] if creators is None else list(creators)
+	for path in [] if libraries is None else libraries:
+		handles += submeta_creators(AppMeta(f"{path}/folder.json"))
+	use_creators(list(dict.fromkeys(handles)))
+	# sources sync concurrently on one event loop
+	changed = AsyncSearchEngine(engine()).sync(Catalog())
+	for source, count in changed.items():
+		print(f"{source} - {count} new or updated")
+
+def search(name, submetaOnly = False, results: SearchResults | None = None):
+	try:
+		if results is None:
+			results = engine().search(name, submetaOnly)
+		i = 0
+		for result in results:
+			print(f"[{i}] - {result.resultsToString()}")
+			i += 1
+		print(f"[{i}] - Search by keyword")
+		print(f"[{i + 1}] - Ignore")
+		index = input("Enter the closest match: ")
+		index = int(index)
+		if index == i:
+			return search(input("Enter search query: "))
+		elif index == i + 1:
+			return None
+		while index < 0 or index >= len(results):
+			index = int(input("Enter the closest match: "))
+		
+		return results[index]
+	except Exception as e:
+		print(f"Error: {e}")
+		return None
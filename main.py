@@ -1,151 +1,74 @@
 #main
 
-import os
-import re
+# only the standard library is imported here so --help and argument errors start instantly,
+# the library and its search sources are imported when a command actually runs
+import argparse
 import sys
-from appmeta.appmeta import AppMeta
-from nfo.nfo import NFODocument
-from search.search import SearchEngine
-from search.services.bjjfanatics import BJJFanatics
-from search.services.submeta import SubMeta
 
-bjj = SearchEngine(
-	[
-		BJJFanatics(1),
-		SubMeta(5)
-	]
-)
+DEFAULT_THRESHOLD = 90
+DEFAULT_MARGIN = 10
+DEFAULT_WORKERS = 4
+DEFAULT_LOOKAHEAD = 3
+DEFAULT_LEASE_TTL = 300
 
-def sanitize_filename(filename: str) -> str:
-    # Replace problematic characters like ':' with '_'
-    return re.sub(r'[\/:*?"<>|]', '_', filename)
-
-def split_time_string(time_str: str) -> str:
-    """
-    Splits a time string like "0:00 - 1:24" into "1:24".
-    Leaves strings like "1:24" unchanged.
-    
-    Args:
-        time_str (str): The input time string.
-    
-    Returns:
-        str: The cleaned time string.
-    """
-    if " - " in time_str:
-        # Split the string and take the second part
-        return time_str.split(" - ")[1]
-    else:
-        # Return the string as is
-        return time_str
 
+def image_size(value: str) -> tuple[int, int]:
+	"""Parses a WIDTHxHEIGHT argument."""
+	try:
+		width, height = value.lower().split("x")
+		return int(width), int(height)
+	except ValueError:
+		raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {value!r}")
 
 
-def main():
+def library_parser() -> argparse.ArgumentParser:
+	parser = argparse.ArgumentParser(
+		prog="main.py",
+		description="Match instructional folders against BJJFanatics and SubMeta and write NFO metadata.",
+		epilog="Run `main.py catalog sync` to download the source catalogs for offline matching.",
+	)
+	parser.add_argument("path", help="library folder holding one folder per instructional")
+	parser.add_argument("-c", "--chapters", action="store_true", help="inject chapters into already processed folders")
+	parser.add_argument("--refresh", action="store_true", help="bypass cached responses and refresh them")
+	parser.add_argument("--export-json", action="store_true", help="also write each folder's data.json")
+	parser.add_argument("--full", action="store_true", help="rescan every folder, not only new or changed ones")
+	parser.add_argument("--metrics", action="store_true", help="write metrics.json and bjj_nfo.prom at the end of the run")
+	parser.add_argument("--metrics-dir", help="folder for the metrics files (default: the library)")
+	mode = parser.add_mutually_exclusive_group()
+	mode.add_argument("--batch", action="store_true", help="process without prompting, ambiguous folders go to review.jsonl")
+	mode.add_argument("--watch", action="store_true", help="keep running and batch process folders as they land")
+	mode.add_argument("--shards", type=int, default=0, metavar="PROCESSES", help="batch process with this many worker processes, other machines can process the same library at once")
+	parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD, help="minimum score to accept a match in batch mode")
+	parser.add_argument("--margin", type=int, default=DEFAULT_MARGIN, help="minimum lead over the runner up in batch mode")
+	parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="concurrent searches in batch mode")
+	parser.add_argument("--no-artwork", action="store_true", help="do not download poster and fanart images into the show folders")
+	parser.add_argument("--artwork-size", type=image_size, metavar="WIDTHxHEIGHT", help="downscale downloaded artwork to fit this size (needs Pillow)")
+	parser.add_argument("--lease-ttl", type=int, default=DEFAULT_LEASE_TTL, help="seconds before the folder lease of a crashed worker can be taken over with --shards")
+	parser.add_argument("--lookahead", type=int, default=DEFAULT_LOOKAHEAD, help="folders searched ahead while a prompt is open in interactive mode, 0 disables")
+	return parser
 
-	chaptermode = False
-	#get args
-	args = sys.argv[1:]
-	if len(args) == 0:
-		print("Usage: python main.py [path]")
-		return
-	path = args[0]
-	commandargs = args[1:]
-	if "-h" in commandargs or "--help" in commandargs:
-		print("Usage: python main.py [path] -hc")
-		return
 
-	if "-c" in commandargs:
-		chaptermode = True
+def catalog_parser() -> argparse.ArgumentParser:
+	parser = argparse.ArgumentParser(prog="main.py catalog", description="Manage the local catalog index.")
+	parser.add_argument("action", choices=["sync"], help="sync: download every source's catalog into the local index")
+	parser.add_argument("--creator", action="append", default=[], help="SubMeta creator handle to crawl, can be repeated")
+	parser.add_argument("--library", action="append", default=[], help="library whose folder.json names a SubMeta creator, can be repeated")
+	return parser
 
-	dir = os.listdir(path)
-	print(f"Files in {path}")
-	for file in dir:
-		if os.path.isfile(f"{path}/{file}"):
-			continue
-		print(f"{file}")
-			
-	c = input("Is this okay? [Y/N]\n")
-	if c != "Y" and c != "y":
-		return 
-	
-	foldermeta = AppMeta(f"{path}/folder.json")
-	for file in dir:
-		if os.path.isfile(f"{path}/{file}"):
-			continue
-		print("\n")
-		metadata = AppMeta(f"{path}/{file}/data.json")
-		submetaOnly = False
-		if foldermeta.get_data()['submeta'] is not None:
-			submetaOnly = True
-		if metadata.should_ignore():
-				print(f"Ignoring {file}")
-				continue
-		if chaptermode:
-			if metadata.first:
-				print(f"Please process - {file} before using chapter mode")
-				continue
-			result = bjj.search(file, submetaOnly)[0].results[0] 
-			if result is None:
-				print(f"Could not find {file}")
-				continue
-			print(f"Selected: {result.title}")
-			if result.episodes is None or len(result.episodes) == 0:
-				print(f"No episodes found for {file}")
-				continue
-			print(f"Episodes found: {len(result.episodes)}")
-			#filter o		
-			for i in range(len(result.episodes)):
-				episode = result.episodes[i]
-				for c in range(len(episode.chapters)):
-					chapter = episode.chapters[c]
-					chapter.time = split_time_string(chapter.time)
-					print(f"[{i}] - {chapter}")
-		else:
-			if metadata.get_data()['name'] != "":
-				print(f"Already processed {file} - {metadata.get_data()['name']}")
-				continue
-			result = search(file, submetaOnly)
-			if result is None:
-				metadata.update_data(ignore=True)
-				continue
-			print(f"Selected: {result}")
-			nfo = NFODocument("tvshow")
-			nfo.add_instructional_result(result.results[0])
-			episodes = result.results[0].episodes
 
-			try:
-				# change the name of the folder to the title of the instructional
-				os.rename(f"{path}/{file}", f"{path}/{sanitize_filename(result.results[0].title)}")
-				nfo.save(f"{path}/{sanitize_filename(result.results[0].title)}/tvshow.nfo")
-				metadata.change_path(f"{path}/{sanitize_filename(result.results[0].title)}/data.json")
-				metadata.update_data(name=result.results[0].title, ignore=False, submeta=foldermeta.get_data()['submeta'])
-			except Exception as e:
-				print(f"Error: {e}")
-			continue
+def main(argv: list[str] | None = None):
+	argv = sys.argv[1:] if argv is None else argv
+	if len(argv) > 0 and argv[0] == "catalog":
+		args = catalog_parser().parse_args(argv[1:])
+		from library.library import catalog_sync
+		catalog_sync(args.creator, args.library)
+		return
 
-def search(name, submetaOnly = False):
-	try:
-		results = bjj.search(name, submetaOnly)
-		i = 0
-		for result in results:
-			print(f"[{i}] - {result.resultsToString()}")
-			i += 1
-		print(f"[{i}] - Search by keyword")
-		print(f"[{i + 1}] - Ignore")
-		index = input("Enter the closest match: ")
-		index = int(index)
-		if index == i:
-			return search(input("Enter search query: "))
-		elif index == i + 1:
-			return None
-		while index < 0 or index >= len(results):
-			index = int(input("Enter the closest match: "))
-		
-		return results[index]
-	except Exception as e:
-		print(f"Error: {e}")
-		return None
-	
+	args = library_parser().parse_args(argv)
+	from library.library import run
+	run(args.path, args)
 
 
-main()
+# guarded so ChapterInjector's worker processes can import this module without starting a run
+if __name__ == "__main__":
+	main()
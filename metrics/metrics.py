@@ -0,0 +1,174 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+
+PREFIX = "bjj_nfo"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# folder whose work is currently being measured, carried into worker threads with contextvars.copy_context()
+current_folder: contextvars.ContextVar[str | None] = contextvars.ContextVar("current_folder", default=None)
+
+
+def labels_of(labels: dict) -> Labels:
+	return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def format_labels(labels: Labels) -> str:
+	if len(labels) == 0:
+		return ""
+	escaped = [f'{key}="{value.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for key, value in labels]
+	return "{" + ",".join(escaped) + "}"
+
+
+"""
+Metrics records span timings and counters for a run, and per folder totals of both.
+
+It is a no-op until enabled, so the instrumentation in the engine, sources, matcher, metadata and NFO code costs nothing by default. The summary can be written as JSON and as a Prometheus text file for the node exporter's textfile collector.
+
+Usage:
+	metrics.enable()
+	with metrics.folder("Leglocks"):
+		with metrics.span("search", source="BJJFanatics"):
+			...
+		metrics.count("http_requests", host="bjjfanatics.com")
+	metrics.write_prometheus("bjj_nfo.prom")
+"""
+class Metrics():
+
+	def __init__(self):
+		self.enabled = False
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		with self.lock:
+			self.started = time.time()
+			self.spans: Dict[Tuple[str, Labels], Dict[str, float]] = {}
+			self.counters: Dict[Tuple[str, Labels], float] = {}
+			self.folders: Dict[str, Dict[str, float]] = {}
+
+	def enable(self):
+		self.enabled = True
+
+	@contextmanager
+	def span(self, name: str, **labels) -> Iterator[None]:
+		"""Times the block and adds it to the span's count, total and max."""
+		if not self.enabled:
+			yield
+			return
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - start
+			key = (name, labels_of(labels))
+			with self.lock:
+				span = self.spans.setdefault(key, {"count": 0, "seconds": 0.0, "max": 0.0})
+				span["count"] += 1
+				span["seconds"] += elapsed
+				span["max"] = max(span["max"], elapsed)
+				self._folder_add(f"{name}_seconds", elapsed)
+
+	def count(self, name: str, value: float = 1, **labels):
+		"""Adds value to a counter."""
+		if not self.enabled:
+			return
+		key = (name, labels_of(labels))
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+			self._folder_add(name, value)
+
+	@contextmanager
+	def folder(self, name: str) -> Iterator[None]:
+		"""Attributes every span and counter recorded inside the block, including in threads started with a copied context, to a folder."""
+		if not self.enabled:
+			yield
+			return
+		token = current_folder.set(name)
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			with self.lock:
+				self._folder_add("seconds", time.perf_counter() - start)
+			current_folder.reset(token)
+
+	def _folder_add(self, name: str, value: float):
+		folder = current_folder.get()
+		if folder is None:
+			return
+		totals = self.folders.setdefault(folder, {})
+		totals[name] = totals.get(name, 0) + value
+
+	def summary(self) -> dict:
+		with self.lock:
+			return {
+				"started": self.started,
+				"seconds": time.time() - self.started,
+				"spans": [{"name": name, "labels": dict(labels), **span} for (name, labels), span in self.spans.items()],
+				"counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self.counters.items()],
+				"folders": {folder: dict(totals) for folder, totals in self.folders.items()},
+			}
+
+	def merge(self, summary: dict):
+		"""Adds the spans, counters and folder totals of another process's summary() to this run."""
+		with self.lock:
+			for entry in summary["spans"]:
+				key = (entry["name"], labels_of(entry["labels"]))
+				span = self.spans.setdefault(key, {"count": 0, "seconds": 0.0, "max": 0.0})
+				span["count"] += entry["count"]
+				span["seconds"] += entry["seconds"]
+				span["max"] = max(span["max"], entry["max"])
+			for entry in summary["counters"]:
+				key = (entry["name"], labels_of(entry["labels"]))
+				self.counters[key] = self.counters.get(key, 0) + entry["value"]
+			for folder, totals in summary["folders"].items():
+				merged = self.folders.setdefault(folder, {})
+				for name, value in totals.items():
+					merged[name] = merged.get(name, 0) + value
+
+	def prometheus(self) -> str:
+		"""Renders the run as Prometheus text exposition format. Per folder totals stay in the JSON summary to keep label cardinality low."""
+		with self.lock:
+			lines = [
+				f"# TYPE {PREFIX}_run_seconds gauge",
+				f"{PREFIX}_run_seconds {time.time() - self.started}",
+				f"# TYPE {PREFIX}_folders gauge",
+				f"{PREFIX}_folders {len(self.folders)}",
+				f"# TYPE {PREFIX}_span_seconds_total counter",
+			]
+			for (name, labels), span in sorted(self.spans.items()):
+				lines.append(f"{PREFIX}_span_seconds_total{format_labels((('span', name),) + labels)} {span['seconds']}")
+			lines.append(f"# TYPE {PREFIX}_span_count_total counter")
+			for (name, labels), span in sorted(self.spans.items()):
+				lines.append(f"{PREFIX}_span_count_total{format_labels((('span', name),) + labels)} {span['count']}")
+			typed = set()
+			for (name, labels), value in sorted(self.counters.items()):
+				if name not in typed:
+					lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+					typed.add(name)
+				lines.append(f"{PREFIX}_{name}_total{format_labels(labels)} {value}")
+			return "\n".join(lines) + "\n"
+
+	def write_json(self, path: str):
+		write_atomic(path, json.dumps(self.summary(), indent=4))
+
+	def write_prometheus(self, path: str):
+		# the textfile collector may read at any moment, so the file is replaced atomically
+		write_atomic(path, self.prometheus())
+
+
+def write_atomic(path: str, content: str):
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	temp_path = f"{path}.tmp"
+	with open(temp_path, 'w', encoding='utf-8') as f:
+		f.write(content)
+	os.replace(temp_path, path)
+
+
+metrics = Metrics()
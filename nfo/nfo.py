@@ -1,22 +1,46 @@
+import hashlib
 import os
 import re
-import html
 import xml.etree.ElementTree as ET
+from typing import List
 
+from metrics.metrics import metrics
 from search.result import EpisodeResult, InstructionalResult
 
-def escape( str_xml: str ):
-    str_xml = str_xml.replace("&", "&amp;")
-    str_xml = str_xml.replace("<", "&lt;")
-    str_xml = str_xml.replace(">", "&gt;")
-    str_xml = str_xml.replace("\"", "&quot;")
-    str_xml = str_xml.replace("'", "&apos;")
-    return str_xml
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".m4v", ".mov", ".avi", ".wmv", ".webm")
+
+# characters XML 1.0 does not allow, even escaped
+INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
 
 def sanitize_text(text: str) -> str:
-	text = escape(text)
+	# ElementTree escapes on serialization, escaping here as well would show up as &amp;amp; in the media server
+	text = INVALID_XML.sub("", text)
 	return text
 
+def list_videos(folder: str) -> List[str]:
+	"""Returns the video files of a folder sorted by name, hidden files (temp files, macOS ._ forks) are skipped."""
+	return sorted([entry.path for entry in os.scandir(folder) if entry.is_file() and not entry.name.startswith(".") and entry.name.lower().endswith(VIDEO_EXTENSIONS)])
+
+def write_if_changed(path: str, content: str) -> bool:
+	"""
+	Writes content atomically (temp file and rename) unless the file already holds exactly that content.
+	Returns whether the file was written, an unchanged file is never touched so media servers do not rescan it.
+	"""
+	data = content.encode('utf-8')
+	with metrics.span("nfo.write"):
+		if os.path.exists(path) and os.path.getsize(path) == len(data):
+			with open(path, 'rb') as f:
+				if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+					metrics.count("nfo_unchanged")
+					return False
+		temp_path = f"{path}.tmp"
+		with open(temp_path, 'wb') as f:
+			f.write(data)
+		os.replace(temp_path, path)
+	metrics.count("nfo_written")
+	metrics.count("nfo_bytes", len(data))
+	return True
+
 class NFODocument():
 
 	def __init__(self, root: str):
@@ -24,7 +48,6 @@ class NFODocument():
 		self.root = ET.Element(root)
 		
 	def add(self, key: str, value: str, parent = None):
-		key = sanitize_text(key)
 		value = sanitize_text(value)
 		if parent is None:
 			ele = ET.SubElement(self.root, key)
@@ -59,22 +82,58 @@ class NFODocument():
 		self.add("mpaa", "NR")
 		pass
 
-	def add_episode(self, episode: EpisodeResult):
+	def add_episode(self, episode: EpisodeResult, show: str = "", number: int = 1, season: int = 1):
+		"""Fills an episodedetails document."""
 		self.add("title", episode.title)
-		self.add("episodedetails", episode.description)
+		self.add("showtitle", show)
+		self.add("season", str(season))
+		self.add("episode", str(number))
+		plot = episode.description
+		if plot == "" and len(episode.chapters) > 0:
+			plot = "\n".join([str(chapter) for chapter in episode.chapters])
+		self.add("plot", plot)
 
 	def __str__(self):
 		return ET.tostring(self.root, encoding='utf8').decode('utf8')
 
-	def save(self, path: str):
-		tree = ET.ElementTree(self.root)
-		ET.indent(tree, space="\t", level=0)
+	def render(self) -> str:
+		with metrics.span("nfo.render"):
+			tree = ET.ElementTree(self.root)
+			ET.indent(tree, space="\t", level=0)
+
+			xml_declaration = '<?xml version="1.0" encoding="utf-8" standalone="yes"?>\n'
+			xml_content = ET.tostring(self.root, encoding='utf-8').decode('utf-8')
+			return xml_declaration + xml_content
 
-		xml_declaration = '<?xml version="1.0" encoding="utf-8" standalone="yes"?>\n'
-		xml_content = ET.tostring(self.root, encoding='utf-8').decode('utf-8')
+	def save(self, path: str) -> bool:
+		"""Saves the document, returns False when the file on disk already matched."""
+		return write_if_changed(path, self.render())
 
-		with open(path, 'w', encoding='utf-8') as f:
-			f.write(xml_declaration)
-			f.write(xml_content)
 
+def render_show(result: InstructionalResult, episode_files: List[str | None] | None = None) -> dict[str, str]:
+	"""
+	Renders tvshow.nfo and one episodedetails document per episode in one pass.
+	Episode documents are named after the video they describe, episode_files[i] being the video of result.episodes[i] (None for an episode without one, see episodematcher.match_folder). Without files, or when the counts differ, only tvshow.nfo is rendered.
+	:return: A mapping of file name, relative to the show folder, to document.
+	"""
+	show = NFODocument("tvshow")
+	show.add_instructional_result(result)
+	documents = {"tvshow.nfo": show.render()}
+	if episode_files is None or len(episode_files) != len(result.episodes):
+		return documents
+	for i, (episode, video) in enumerate(zip(result.episodes, episode_files)):
+		if video is None:
+			continue
+		document = NFODocument("episodedetails")
+		document.add_episode(episode, result.title, i + 1)
+		# episode_files may be full paths (relative or absolute), the document sits next to its video in the show folder
+		documents[f"{os.path.splitext(os.path.basename(video))[0]}.nfo"] = document.render()
+	return documents
 
+def write_show(folder: str, result: InstructionalResult, episode_files: List[str | None] | None = None) -> int:
+	"""Writes the show and episode NFOs of a folder, returns the number of files that actually changed."""
+	written = 0
+	for path, content in render_show(result, episode_files).items():
+		if write_if_changed(os.path.join(folder, path), content):
+			written += 1
+	return written
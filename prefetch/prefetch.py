@@ -0,0 +1,90 @@
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List
+
+from metrics.metrics import current_folder, metrics
+from search.progress.progress import captured
+from search.search import SearchResults
+
+DEFAULT_LOOKAHEAD = 3
+
+"""
+Prefetcher runs the searches of the next folders in the background while the current one is being answered, so their prompts can show up without waiting on the network.
+
+A prefetch searches the folder and hydrates every candidate, at most `lookahead` folders are in flight at a time. Prefetches that are no longer needed are cancelled, a prefetch that already started finishes in the background and its results are dropped.
+
+Prefetches run while a prompt is open, so the progress and error lines of their sources are kept and only printed when the folder's results are taken.
+
+Usage:
+	prefetcher = Prefetcher(lambda name: engine.search(name), lookahead=3)
+	prefetcher.schedule(["Leglocks", "Back Attacks"])
+	results = prefetcher.take("Leglocks")
+	prefetcher.cancel("Back Attacks")
+	prefetcher.close()
+"""
+class Prefetcher():
+
+	def __init__(self, search: Callable[[str], SearchResults], lookahead: int = DEFAULT_LOOKAHEAD):
+		self.search = search
+		self.lookahead = lookahead
+		self.executor = ThreadPoolExecutor(max_workers=max(lookahead, 1), thread_name_prefix="prefetch")
+		self.futures: Dict[str, Future] = {}
+		self.output: Dict[str, List[str]] = {}
+
+	def schedule(self, names: Iterable[str]):
+		"""Starts prefetching names in order until `lookahead` folders are in flight, names already in flight are skipped."""
+		for name in names:
+			if len(self.futures) >= self.lookahead:
+				return
+			if name in self.futures:
+				continue
+			# the prefetch is attributed to its folder without counting towards the folder's own time
+			context = contextvars.copy_context()
+			context.run(current_folder.set, name)
+			self.output[name] = []
+			context.run(captured.set, self.output[name])
+			self.futures[name] = self.executor.submit(context.run, self.prefetch, name)
+
+	def prefetch(self, name: str) -> SearchResults:
+		with metrics.span("prefetch"):
+			results = self.search(name)
+			for result in results:
+				for candidate in result.results:
+					try:
+						candidate.hydrate()
+					except Exception:
+						# a failed detail fetch stays lazy, it is fetched again (and reported) if the candidate is selected
+						pass
+			return results
+
+	def take(self, name: str) -> SearchResults | None:
+		"""
+		Returns the prefetched results of a folder, waiting for a prefetch that is still running.
+		Returns None when the folder was never scheduled or its prefetch failed, the caller then searches it itself.
+		"""
+		future = self.futures.pop(name, None)
+		if future is None:
+			return None
+		metrics.count("prefetch_hits" if future.done() else "prefetch_waits")
+		try:
+			return future.result()
+		except Exception as e:
+			print(f"Error[prefetch]: {e}")
+			return None
+		finally:
+			for line in self.output.pop(name, []):
+				print(line)
+
+	def cancel(self, name: str):
+		"""Drops the prefetch of a folder that turned out not to need a search."""
+		future = self.futures.pop(name, None)
+		if future is not None:
+			future.cancel()
+		self.output.pop(name, None)
+
+	def close(self):
+		for future in self.futures.values():
+			future.cancel()
+		self.futures.clear()
+		self.output.clear()
+		self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,158 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import time
+from typing import Dict, Iterator, List, Tuple, TypedDict
+
+from appmeta.metastore import write_json_atomic
+
+
+class FolderState(TypedDict):
+	inode: int
+	mtime: int
+
+
+"""
+Scanner lists the folders of a library with a single os.scandir pass and compares them with a snapshot (inode and mtime per folder) saved at the library root.
+
+Only new or changed folders are returned, so rescanning a large library costs one stat per folder. Folders are recorded in the snapshot with mark() once they have been handled, and the snapshot is written by save().
+
+Usage:
+	scanner = Scanner("/library")
+	for folder in scanner.scan():
+		process(folder)
+		scanner.mark(folder)
+	scanner.save()
+"""
+class Scanner():
+
+	def __init__(self, root: str, file_name: str = "scan.json"):
+		self.root = root
+		self.path = os.path.join(root, file_name)
+		self.seen: Dict[str, FolderState] = {}
+		self.snapshot: Dict[str, FolderState] = {}
+		if os.path.exists(self.path):
+			with open(self.path, 'r') as file:
+				self.snapshot = json.load(file)
+
+	def scan(self, full: bool = False) -> List[str]:
+		"""Returns the names of the folders that are new or changed since they were last marked, every folder when full is set."""
+		changed = []
+		self.seen = {}
+		with os.scandir(self.root) as entries:
+			for entry in entries:
+				if not entry.is_dir(follow_symlinks=False) or entry.name.startswith("."):
+					continue
+				stat = entry.stat(follow_symlinks=False)
+				state = FolderState(inode=stat.st_ino, mtime=stat.st_mtime_ns)
+				self.seen[entry.name] = state
+				if full or self.snapshot.get(entry.name) != state:
+					changed.append(entry.name)
+		# forget folders that were removed or renamed
+		for name in list(self.snapshot.keys()):
+			if name not in self.seen:
+				del self.snapshot[name]
+		return sorted(changed)
+
+	def mark(self, name: str):
+		"""Records a folder as handled, using its state at the time it was handled."""
+		path = os.path.join(self.root, name)
+		try:
+			stat = os.stat(path, follow_symlinks=False)
+		except FileNotFoundError:
+			# the folder was renamed after its instructional, the new name is picked up by the next scan
+			self.snapshot.pop(name, None)
+			return
+		self.snapshot[name] = FolderState(inode=stat.st_ino, mtime=stat.st_mtime_ns)
+
+	def save(self):
+		write_json_atomic(self.path, self.snapshot)
+
+
+# inotify flags, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def inotify_fd(path: str) -> int | None:
+	"""Returns an inotify descriptor watching path for new folders, None where inotify is not available."""
+	name = ctypes.util.find_library("c")
+	if name is None:
+		return None
+	try:
+		libc = ctypes.CDLL(name, use_errno=True)
+		fd = libc.inotify_init()
+	except (OSError, AttributeError):
+		return None
+	if fd < 0:
+		return None
+	if libc.inotify_add_watch(fd, path.encode(), IN_CREATE | IN_MOVED_TO | IN_MODIFY | IN_CLOSE_WRITE) < 0:
+		os.close(fd)
+		return None
+	return fd
+
+
+def folder_signature(path: str) -> tuple:
+	"""Returns the size and mtime of every file below a folder, a copy into the folder changes it until the copy is done."""
+	files = []
+	for root, _, names in os.walk(path):
+		for name in names:
+			try:
+				stat = os.stat(os.path.join(root, name), follow_symlinks=False)
+			except FileNotFoundError:
+				continue
+			files.append((os.path.relpath(os.path.join(root, name), path), stat.st_size, stat.st_mtime_ns))
+	return tuple(sorted(files))
+
+
+def watch(scanner: Scanner, settle: float = 10, poll: float = 60) -> Iterator[List[str]]:
+	"""
+	Yields batches of new or changed folders as they land in the library, forever.
+	Uses inotify when available and falls back to polling every `poll` seconds. A folder is only yielded once the size and mtime of every file in it stayed the same for `settle` seconds, so folders that are still being copied are not picked up half way. inotify only watches the library root, files landing in a folder are caught by re-checking pending folders every `settle` seconds.
+	"""
+	fd = inotify_fd(scanner.root)
+	if fd is None:
+		print("inotify unavailable, polling for new folders")
+	# folders waiting to settle, with their signature and when it was first seen
+	pending: Dict[str, Tuple[tuple, float]] = {}
+	# signature of every folder when it was yielded, it is not yielded again until it changes
+	yielded: Dict[str, tuple] = {}
+	try:
+		while True:
+			changed = scanner.scan()
+			now = time.monotonic()
+			ready = []
+			for name in changed:
+				signature = folder_signature(os.path.join(scanner.root, name))
+				if yielded.get(name) == signature:
+					pending.pop(name, None)
+					continue
+				previous = pending.get(name)
+				if previous is None or previous[0] != signature:
+					pending[name] = (signature, now)
+				elif now - previous[1] >= settle:
+					ready.append(name)
+					yielded[name] = signature
+					del pending[name]
+			# folders that were handled, removed or renamed meanwhile
+			for name in [name for name in pending if name not in scanner.seen]:
+				del pending[name]
+			for name in [name for name in yielded if name not in scanner.seen]:
+				del yielded[name]
+			if len(ready) > 0:
+				yield ready
+			timeout = settle if len(pending) > 0 else None
+			if fd is None:
+				time.sleep(poll if timeout is None else min(poll, timeout))
+				continue
+			if len(select.select([fd], [], [], timeout)[0]) > 0:
+				os.read(fd, 64 * (EVENT_HEADER.size + 256))
+	finally:
+		if fd is not None:
+			os.close(fd)
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "bjj-nfo", "http.db")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# seconds a response stays fresh, keyed by the source that stored it
+DEFAULT_TTLS: Dict[str, float] = {
+	"BJJFanatics": 60 * 60 * 24,
+	"SubMeta": 60 * 60 * 24 * 7,
+}
+DEFAULT_TTL = 60 * 60 * 24
+
+
+def make_key(method: str, url: str, body: dict | None = None) -> str:
+	"""
+	Builds a normalized cache key for a request.
+	Query parameters are sorted so equivalent URLs share an entry, GraphQL bodies are keyed by their operation name and variables only.
+	"""
+	parts = urlsplit(url)
+	query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+	normalized = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+	key = f"{method.upper()} {normalized}"
+	if body is not None:
+		if "operationName" in body:
+			body = {"operationName": body["operationName"], "variables": body.get("variables", {})}
+		key += " " + json.dumps(body, sort_keys=True, separators=(",", ":"))
+	return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+"""
+ResponseCache is a persistent, size-bounded response cache stored in a single SQLite file.
+
+Entries are grouped by namespace (the source name), each namespace has its own TTL. When the total stored size grows over max_bytes, the least recently used entries are evicted. With refresh set, reads always miss but responses are still written, which refreshes the cache.
+
+Usage:
+	cache = ResponseCache()
+	key = make_key("GET", url)
+	text = cache.get("BJJFanatics", key)
+	if text is None:
+		text = requests.get(url).text
+		cache.set("BJJFanatics", key, text)
+"""
+class ResponseCache():
+
+	def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = DEFAULT_MAX_BYTES, ttls: Dict[str, float] = DEFAULT_TTLS, refresh: bool = False):
+		self.path = path
+		self.max_bytes = max_bytes
+		self.ttls = dict(ttls)
+		self.refresh = refresh
+		self.lock = threading.Lock()
+		os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+		self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+		self.connection.execute("PRAGMA journal_mode=WAL")
+		self.connection.execute(
+			"CREATE TABLE IF NOT EXISTS responses ("
+			"key TEXT PRIMARY KEY, namespace TEXT NOT NULL, value TEXT NOT NULL, "
+			"size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+		)
+		self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+	def ttl(self, namespace: str) -> float:
+		return self.ttls.get(namespace, DEFAULT_TTL)
+
+	def get(self, namespace: str, key: str) -> str | None:
+		"""Returns the cached value, or None if it is missing, expired or refresh is set."""
+		if self.refresh:
+			return None
+		now = time.time()
+		with self.lock:
+			row = self.connection.execute(
+				"SELECT value, created FROM responses WHERE key = ? AND namespace = ?", (key, namespace)
+			).fetchone()
+			if row is None:
+				return None
+			value, created = row
+			if now - created > self.ttl(namespace):
+				self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+				return None
+			self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+			return value
+
+	def set(self, namespace: str, key: str, value: str):
+		"""Stores a value and evicts least recently used entries if the cache is over its size bound."""
+		now = time.time()
+		size = len(value.encode("utf-8"))
+		with self.lock:
+			self.connection.execute(
+				"INSERT OR REPLACE INTO responses (key, namespace, value, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+				(key, namespace, value, size, now, now)
+			)
+			self._evict()
+
+	def _evict(self):
+		total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+		if total <= self.max_bytes:
+			return
+		rows = self.connection.execute("SELECT key, size FROM responses ORDER BY accessed ASC").fetchall()
+		stale = []
+		for key, size in rows:
+			if total <= self.max_bytes:
+				break
+			stale.append((key,))
+			total -= size
+		self.connection.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+	def clear(self):
+		with self.lock:
+			self.connection.execute("DELETE FROM responses")
+
+	def close(self):
+		with self.lock:
+			self.connection.close()
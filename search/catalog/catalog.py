@@ -0,0 +1,111 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Set
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "bjj-nfo", "catalog.db")
+
+
+"""
+Catalog is a local index of every item a source offers, stored in a single SQLite file.
+
+It is filled by `python main.py catalog sync` and read by the search sources so queries are resolved locally instead of over the network. Syncs are incremental: an item is only rewritten when its update marker (BJJFanatics `_updated_at`, SubMeta `publishedAt`) differs from the stored one, and the newest marker seen is kept as the source's sync cursor.
+
+A source that only lists part of its catalog per sync (SubMeta lists the courses of some creators) records the scopes it listed completely, and resolves queries outside of them over the network.
+
+Usage:
+	catalog = Catalog()
+	catalog.upsert("BJJFanatics", videos, id_key="id", updated_key="_updated_at")
+	videos = catalog.items("BJJFanatics")
+"""
+class Catalog():
+
+	def __init__(self, path: str = DEFAULT_PATH):
+		self.path = path
+		self.lock = threading.Lock()
+		self.memo: Dict[str, List[dict]] = {}
+		self.scopeMemo: Dict[str, Set[str]] = {}
+		os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+		self.connection = sqlite3.connect(path, check_same_thread=False)
+		self.connection.execute("PRAGMA journal_mode=WAL")
+		self.connection.execute(
+			"CREATE TABLE IF NOT EXISTS items ("
+			"source TEXT NOT NULL, id TEXT NOT NULL, updated TEXT, data TEXT NOT NULL, "
+			"PRIMARY KEY (source, id))"
+		)
+		self.connection.execute(
+			"CREATE TABLE IF NOT EXISTS sync (source TEXT PRIMARY KEY, cursor TEXT, synced REAL NOT NULL)"
+		)
+		self.connection.execute(
+			"CREATE TABLE IF NOT EXISTS scopes (source TEXT NOT NULL, scope TEXT NOT NULL, synced REAL NOT NULL, PRIMARY KEY (source, scope))"
+		)
+		self.connection.commit()
+
+	def upsert(self, source: str, items: Iterable[dict], id_key: str = "id", updated_key: str | None = None, scopes: Iterable[str] = ()) -> int:
+		"""
+		Inserts new items and rewrites changed ones in a single transaction, and records the sync along with the scopes the items cover.
+		Nothing is written when items raises, so a listing that failed halfway is not taken for a complete one.
+		:return: The number of items that were inserted or updated.
+		"""
+		changed = 0
+		with self.lock:
+			known = dict(self.connection.execute("SELECT id, updated FROM items WHERE source = ?", (source,)).fetchall())
+			cursor = self._cursor(source)
+			rows = []
+			for item in items:
+				item_id = str(item[id_key])
+				updated = None if updated_key is None else item.get(updated_key)
+				updated = None if updated is None else str(updated)
+				if item_id in known and (updated is None or known[item_id] == updated):
+					continue
+				rows.append((source, item_id, updated, json.dumps(item, separators=(",", ":"))))
+				if updated is not None and (cursor is None or updated > cursor):
+					cursor = updated
+			self.connection.executemany("INSERT OR REPLACE INTO items (source, id, updated, data) VALUES (?, ?, ?, ?)", rows)
+			self.connection.execute(
+				"INSERT OR REPLACE INTO sync (source, cursor, synced) VALUES (?, ?, ?)", (source, cursor, time.time())
+			)
+			self.connection.executemany(
+				"INSERT OR REPLACE INTO scopes (source, scope, synced) VALUES (?, ?, ?)", [(source, scope, time.time()) for scope in scopes]
+			)
+			self.connection.commit()
+			changed = len(rows)
+			self.memo.pop(source, None)
+			self.scopeMemo.pop(source, None)
+		return changed
+
+	def items(self, source: str) -> List[dict]:
+		"""Returns every stored item of a source, loaded once per process."""
+		with self.lock:
+			if source not in self.memo:
+				rows = self.connection.execute("SELECT data FROM items WHERE source = ? ORDER BY rowid", (source,)).fetchall()
+				self.memo[source] = [json.loads(row[0]) for row in rows]
+			return self.memo[source]
+
+	def scopes(self, source: str) -> Set[str]:
+		"""Returns the scopes of a source that have been synced completely at least once, loaded once per process."""
+		with self.lock:
+			if source not in self.scopeMemo:
+				rows = self.connection.execute("SELECT scope FROM scopes WHERE source = ?", (source,)).fetchall()
+				self.scopeMemo[source] = {row[0] for row in rows}
+			return self.scopeMemo[source]
+
+	def has(self, source: str) -> bool:
+		"""Returns whether the source has been synced at least once."""
+		with self.lock:
+			return self.connection.execute("SELECT 1 FROM sync WHERE source = ?", (source,)).fetchone() is not None
+
+	def cursor(self, source: str) -> str | None:
+		"""Returns the newest update marker seen for a source."""
+		with self.lock:
+			return self._cursor(source)
+
+	def _cursor(self, source: str) -> str | None:
+		row = self.connection.execute("SELECT cursor FROM sync WHERE source = ?", (source,)).fetchone()
+		return None if row is None else row[0]
+
+	def close(self):
+		with self.lock:
+			self.connection.close()
@@ -0,0 +1,148 @@
+import codecs
+import json
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List
+
+DECODER = json.JSONDecoder()
+WHITESPACE = " \t\n\r"
+
+
+"""
+ArrayParser extracts the elements of the array stored under `key` in a top level JSON object from text that arrives in chunks, holding only the part of the document that has not been consumed yet.
+
+Text is pushed with feed(), which returns the elements completed by that chunk, so the same parser serves blocking iterators and async streams. Other top level values are decoded and discarded.
+
+Values are decoded with JSONDecoder.raw_decode as soon as they are complete, a value that ends exactly at the end of the buffer is only accepted once more text arrived (or the document ended), since a number may continue in the next chunk.
+
+Usage:
+	parser = ArrayParser("videos")
+	for chunk in chunks:
+		for video in parser.feed(chunk):
+			...
+	parser.close()
+"""
+class ArrayParser():
+
+	def __init__(self, key: str):
+		self.key = key
+		self.buffer = ""
+		self.position = 0
+		self.state = "start"
+		self.name = None
+		self.ended = False
+
+	def feed(self, text: str) -> List[object]:
+		self.buffer = self.buffer[self.position:] + text
+		self.position = 0
+		return self.parse()
+
+	def close(self) -> List[object]:
+		"""Marks the end of the document, returns the last elements and raises ValueError if the document is incomplete."""
+		self.ended = True
+		items = self.parse()
+		if self.state != "done":
+			raise ValueError("truncated JSON document")
+		return items
+
+	def peek(self) -> str:
+		while self.position < len(self.buffer) and self.buffer[self.position] in WHITESPACE:
+			self.position += 1
+		return self.buffer[self.position] if self.position < len(self.buffer) else ""
+
+	def decode(self) -> tuple[bool, object]:
+		"""Decodes the next value, returns (False, None) when it is not complete yet."""
+		try:
+			value, end = DECODER.raw_decode(self.buffer, self.position)
+		except json.JSONDecodeError:
+			if self.ended:
+				raise
+			return False, None
+		if end == len(self.buffer) and not self.ended:
+			return False, None
+		self.position = end
+		return True, value
+
+	def expect(self, character: str, characters: str) -> str:
+		if character not in characters:
+			raise ValueError(f"expected one of {characters!r} at offset {self.position}, found {character!r}")
+		self.position += 1
+		return character
+
+	def parse(self) -> List[object]:
+		items = []
+		while True:
+			character = self.peek()
+			if character == "":
+				return items
+			if self.state == "start":
+				self.expect(character, "{")
+				self.state = "first key"
+			elif self.state == "first key":
+				if character == "}":
+					self.position += 1
+					self.state = "done"
+				else:
+					self.state = "key"
+			elif self.state == "key":
+				complete, self.name = self.decode()
+				if not complete:
+					return items
+				self.state = "colon"
+			elif self.state == "colon":
+				self.expect(character, ":")
+				self.state = "array" if self.name == self.key else "value"
+			elif self.state == "array":
+				if character != "[":
+					self.state = "value"
+					continue
+				self.position += 1
+				self.state = "first item"
+			elif self.state == "value":
+				complete, _ = self.decode()
+				if not complete:
+					return items
+				self.state = "next key"
+			elif self.state == "first item":
+				if character == "]":
+					self.position += 1
+					self.state = "next key"
+				else:
+					self.state = "item"
+			elif self.state == "item":
+				complete, item = self.decode()
+				if not complete:
+					return items
+				items.append(item)
+				self.state = "next item"
+			elif self.state == "next item":
+				self.state = "item" if self.expect(character, ",]") == "," else "next key"
+			elif self.state == "next key":
+				self.state = "key" if self.expect(character, ",}") == "," else "done"
+			else:
+				raise ValueError(f"unexpected data after the JSON document at offset {self.position}")
+
+
+def iter_array(chunks: Iterable[str], key: str) -> Iterator[object]:
+	"""Yields the elements of the array stored under `key` in a top level JSON object one at a time, while the document streams in."""
+	parser = ArrayParser(key)
+	for chunk in chunks:
+		yield from parser.feed(chunk)
+	yield from parser.close()
+
+
+def decode_chunks(chunks: Iterable[bytes], encoding: str = "utf-8") -> Iterator[str]:
+	"""Decodes a byte stream into text, characters split across chunks are carried over to the next one."""
+	decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+	for chunk in chunks:
+		yield decoder.decode(chunk)
+	yield decoder.decode(b"", final=True)
+
+
+async def aiter_array(chunks: AsyncIterable[bytes], key: str, encoding: str = "utf-8") -> AsyncIterator[object]:
+	"""Async variant of iter_array over a byte stream, such as httpx's Response.aiter_bytes()."""
+	parser = ArrayParser(key)
+	decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+	async for chunk in chunks:
+		for item in parser.feed(decoder.decode(chunk)):
+			yield item
+	for item in parser.feed(decoder.decode(b"", final=True)) + parser.close():
+		yield item
@@ -0,0 +1,14 @@
+import contextvars
+from typing import List
+
+# lines reported by a search that runs in the background, kept instead of printed (see Prefetcher), None prints right away
+captured: contextvars.ContextVar[List[str] | None] = contextvars.ContextVar("captured", default=None)
+
+
+def report(message: str):
+	"""Prints a search's progress or error message, or keeps it for later while the search runs in the background."""
+	lines = captured.get()
+	if lines is None:
+		print(message)
+	else:
+		lines.append(message)
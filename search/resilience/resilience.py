@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import deque
+from typing import Deque
+
+from metrics.metrics import metrics
+from search.progress.progress import report
+
+DEFAULT_FAILURES = 5
+DEFAULT_COOLDOWN = 60
+DEFAULT_WINDOW = 100
+DEFAULT_MIN_SAMPLES = 20
+# at most this share of calls is duplicated, so a source that is slow across the board does not get twice the load
+DEFAULT_HEDGE_BUDGET = 0.1
+# a call is never hedged sooner than this, however fast the source usually answers
+DEFAULT_MIN_HEDGE_DELAY = 1.0
+
+
+class SourceError(Exception):
+	"""Raised by a source that could not answer (connection error, 5xx, error body), as opposed to answering without a match."""
+
+
+"""
+CircuitBreaker stops calling a source after `failures` calls in a row failed or timed out.
+
+The circuit then stays open for `cooldown` seconds, calls are skipped right away instead of waiting on the source. After the cool-down a single trial call is let through (half open): a success closes the circuit again, a failure opens it for another cool-down.
+
+Usage:
+	breaker = CircuitBreaker("SubMeta")
+	if breaker.allow():
+		try:
+			call()
+			breaker.succeeded()
+		except Exception:
+			breaker.failed()
+"""
+class CircuitBreaker():
+
+	def __init__(self, name: str, failures: int = DEFAULT_FAILURES, cooldown: float = DEFAULT_COOLDOWN):
+		self.name = name
+		self.failures = failures
+		self.cooldown = cooldown
+		self.consecutive = 0
+		self.opened: float | None = None
+		self.trial = False
+		self.lock = threading.Lock()
+
+	def state(self) -> str:
+		with self.lock:
+			if self.opened is None:
+				return "closed"
+			return "half open" if self.trial or time.monotonic() - self.opened >= self.cooldown else "open"
+
+	def allow(self) -> bool:
+		"""Returns whether a call may go to the source now, letting one trial call through once the cool-down is over."""
+		with self.lock:
+			if self.opened is None:
+				return True
+			if self.trial or time.monotonic() - self.opened < self.cooldown:
+				return False
+			self.trial = True
+			return True
+
+	def succeeded(self):
+		with self.lock:
+			if self.opened is not None:
+				report(f"{self.name} - Recovered, circuit closed")
+			self.consecutive = 0
+			self.opened = None
+			self.trial = False
+
+	def failed(self):
+		with self.lock:
+			self.consecutive += 1
+			if self.trial or (self.opened is None and self.consecutive >= self.failures):
+				report(f"{self.name} - {self.consecutive} failures in a row, skipping it for {self.cooldown:g}s")
+				metrics.count("circuit_opened", source=self.name)
+				self.opened = time.monotonic()
+				self.trial = False
+
+
+"""
+LatencyTracker keeps the latencies of a source's last `window` successful network calls and tells the engine when a call is worth hedging.
+
+A call that is still running after the source's p95 latency is likely stuck in the tail, a duplicate started then usually answers first. Hedging only starts once `min_samples` latencies are known, never sooner than `min_delay` seconds, and stays within `budget` (hedges per call). Calls answered from the cache or the catalog are not recorded, they would drag p95 down to milliseconds.
+
+Usage:
+	latency = LatencyTracker()
+	latency.add(0.4)
+	delay = latency.hedge_delay()
+"""
+class LatencyTracker():
+
+	def __init__(self, window: int = DEFAULT_WINDOW, min_samples: int = DEFAULT_MIN_SAMPLES, budget: float = DEFAULT_HEDGE_BUDGET, min_delay: float = DEFAULT_MIN_HEDGE_DELAY):
+		self.samples: Deque[float] = deque(maxlen=window)
+		self.min_samples = min_samples
+		self.budget = budget
+		self.min_delay = min_delay
+		self.calls = 0
+		self.hedges = 0
+		self.lock = threading.Lock()
+
+	def add(self, seconds: float):
+		with self.lock:
+			self.samples.append(seconds)
+
+	def percentile(self, fraction: float) -> float | None:
+		with self.lock:
+			if len(self.samples) < self.min_samples:
+				return None
+			ordered = sorted(self.samples)
+			return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+	def hedge_delay(self) -> float | None:
+		"""Counts a call and returns the seconds after which it should be hedged, None when it should not be."""
+		with self.lock:
+			self.calls += 1
+			if self.hedges >= self.calls * self.budget:
+				return None
+		p95 = self.percentile(0.95)
+		return None if p95 is None else max(p95, self.min_delay)
+
+	def hedged(self):
+		with self.lock:
+			self.hedges += 1
@@ -1,28 +1,88 @@
 
-from typing import List
+import threading
+from typing import Callable, List
 
 
+def parse_timestamp(timestamp: str) -> int:
+	"""Parses "1:24", "1:02:03" or a plain number of seconds into seconds."""
+	seconds = 0
+	for part in timestamp.strip().split(":"):
+		seconds = seconds * 60 + int(float(part))
+	return seconds
+
+def format_timestamp(seconds: int) -> str:
+	"""Formats seconds as "m:ss", or "h:mm:ss" past an hour."""
+	hours, rest = divmod(seconds, 3600)
+	minutes, seconds = divmod(rest, 60)
+	if hours > 0:
+		return f"{hours}:{minutes:02d}:{seconds:02d}"
+	return f"{minutes}:{seconds:02d}"
+
+"""
+Chapter is one part of an episode, start and end are in seconds from the start of the video. end is None when the source only gives start times.
+
+Serialized chapters are [title, start, end] lists, see to_list/from_list.
+"""
 class Chapter():
-	def __init__(self, title, time):
+	__slots__ = ("title", "start", "end")
+
+	def __init__(self, title: str, start: int = 0, end: int | None = None):
 		self.title = title
-		self.time = time
-	
+		self.start = start
+		self.end = end
+
+	@classmethod
+	def parse(cls, title: str, time: str) -> "Chapter":
+		"""Builds a chapter from a "0:00 - 1:24" range or a "1:24" start time, a time that does not parse starts the chapter at 0."""
+		try:
+			if " - " in time:
+				start, end = time.split(" - ", 1)
+				return cls(title, parse_timestamp(start), parse_timestamp(end))
+			return cls(title, parse_timestamp(time))
+		except ValueError:
+			return cls(title)
+
+	@property
+	def time(self) -> str:
+		"""The chapter's range as display text, "0:00 - 1:24"."""
+		if self.end is None:
+			return format_timestamp(self.start)
+		return f"{format_timestamp(self.start)} - {format_timestamp(self.end)}"
+
+	def to_list(self) -> list:
+		return [self.title, self.start, self.end]
+
+	@classmethod
+	def from_list(cls, data: list) -> "Chapter":
+		return cls(data[0], data[1], data[2])
+
 	def __str__(self):
 		return f"{self.title} - {self.time}"
 
 
 class EpisodeResult():
-	def __init__(self, title, chapters: List[Chapter], description = ""):
+	__slots__ = ("title", "chapters", "description")
+
+	def __init__(self, title: str, chapters: List[Chapter] | None = None, description: str = ""):
 		self.title = title
-		self.description = ""
-		self.chapters = chapters
+		self.description = description
+		self.chapters = [] if chapters is None else chapters
+
+	def to_dict(self) -> dict:
+		return {"title": self.title, "description": self.description, "chapters": [chapter.to_list() for chapter in self.chapters]}
+
+	@classmethod
+	def from_dict(cls, data: dict) -> "EpisodeResult":
+		return cls(data["title"], [Chapter(c[0], c[1], c[2]) for c in data["chapters"]], data.get("description", ""))
 
 	def __str__(self):
 		return f"{self.title} - {self.chapters}"
 	
 
 class Review():
-	def __init__(self, score, total):
+	__slots__ = ("score", "total")
+
+	def __init__(self, score: float, total: int):
 		self.score = score
 		self.total = total
 
@@ -31,21 +91,102 @@ InstructionalResult is a class that holds the result of a bjj instructional quer
 
 This class is meant to be subclassed by the various sources of search results.
 
+score is the TitleMatcher similarity (0-100) between the query and the title when the result came from a search, None otherwise.
+
+description and episodes can be loaded lazily: sources pass description_loader/episodes_loader instead of the values, and the detail fetch only happens on first access or when hydrate() is called. This keeps unselected candidates from paying for their product page or episode request.
+
 Usage:
 	result = InstructionalResult("title", "url", "source", "image", "instructor", Review(5, 5), "category", [])
+	result = InstructionalResult("title", episodes_loader=lambda: fetch_episodes(course))
+	result.hydrate()
+	copy = InstructionalResult.from_dict(result.to_dict())
 
 """
 class InstructionalResult():
-	def __init__(self, title, description = "", url = "", source = "", image = "", instructor: List[str] = [], review = None, category: List[str] = [], episodes: List[EpisodeResult] =[]):
+	__slots__ = ("title", "url", "_description", "source", "image", "instructor", "review", "category", "_episodes", "description_loader", "episodes_loader", "score", "lock")
+
+	def __init__(self, title, description = "", url = "", source = "", image = "", instructor: List[str] | None = None, review: Review | None = None, category: List[str] | None = None, episodes: List[EpisodeResult] | None = None, description_loader: Callable[[], str] | None = None, episodes_loader: Callable[[], List[EpisodeResult]] | None = None, score: int | None = None):
 		self.title = title
 		self.url = url
-		self.description = description
+		self._description = description
 		self.source = source
 		self.image = image
-		self.instructor = instructor
+		self.instructor = [] if instructor is None else instructor
 		self.review = review
-		self.category = category
-		self.episodes = episodes
+		self.category = [] if category is None else category
+		self._episodes = [] if episodes is None else episodes
+		self.description_loader = description_loader
+		self.episodes_loader = episodes_loader
+		self.score = score
+		self.lock = threading.Lock()
+
+	@property
+	def description(self) -> str:
+		with self.lock:
+			if self.description_loader is not None:
+				self._description = self.description_loader()
+				self.description_loader = None
+			return self._description
+
+	@description.setter
+	def description(self, value: str):
+		with self.lock:
+			self._description = value
+			self.description_loader = None
+
+	@property
+	def episodes(self) -> List[EpisodeResult]:
+		with self.lock:
+			if self.episodes_loader is not None:
+				self._episodes = self.episodes_loader()
+				self.episodes_loader = None
+			return self._episodes
+
+	@episodes.setter
+	def episodes(self, value: List[EpisodeResult]):
+		with self.lock:
+			self._episodes = value
+			self.episodes_loader = None
+
+	def is_hydrated(self) -> bool:
+		return self.description_loader is None and self.episodes_loader is None
+
+	def hydrate(self):
+		"""Loads every lazy field now, returns self so it can be chained."""
+		self.description
+		self.episodes
+		return self
+
+	def to_dict(self) -> dict:
+		"""Serializes the result to plain JSON types, lazy fields are loaded first."""
+		return {
+			"title": self.title,
+			"description": self.description,
+			"url": self.url,
+			"source": self.source,
+			"image": self.image,
+			"instructor": self.instructor,
+			"review": None if self.review is None else [self.review.score, self.review.total],
+			"category": self.category,
+			"episodes": [episode.to_dict() for episode in self.episodes],
+			"score": self.score,
+		}
+
+	@classmethod
+	def from_dict(cls, data: dict) -> "InstructionalResult":
+		review = data.get("review")
+		return cls(
+			title=data["title"],
+			description=data.get("description", ""),
+			url=data.get("url", ""),
+			source=data.get("source", ""),
+			image=data.get("image", ""),
+			instructor=data.get("instructor"),
+			review=None if review is None else Review(review[0], review[1]),
+			category=data.get("category"),
+			episodes=[EpisodeResult.from_dict(episode) for episode in data.get("episodes", [])],
+			score=data.get("score"),
+		)
 
 	def episodesToString(self):
 		return "".join([f"{episode.title} - {episode.chapters}" for episode in self.episodes])
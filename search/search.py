@@ -1,7 +1,21 @@
-from abc import ABC, abstractmethod, abstractproperty
-from typing import List, TypedDict
 
+from abc import ABC, abstractmethod
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import contextvars
+import importlib
+import queue
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from search.cache.cache import ResponseCache
+from search.catalog.catalog import Catalog
+from metrics.metrics import metrics
+from search.progress.progress import report
+from search.resilience.resilience import CircuitBreaker, LatencyTracker
 from search.result import InstructionalResult
+from search.transport.transport import AsyncTransport, Transport, async_available, sent_requests, shared_transport
 
 
 class SearchResult():
@@ -18,20 +32,95 @@ class SearchResult():
 	def __str__(self):
 		return f"{self.source} - {self.resultsToString()}"
 
+"""
+SearchResults is the list returned by SearchEngine.search. It behaves exactly like a plain list of SearchResult, but also records which sources did not answer: they missed their deadline, failed or were skipped while their circuit is open.
+
+An empty but partial result is not a "no match", the folder should be searched again later.
+
+Usage:
+	results = engine.search("Leglocks")
+	if "SubMeta" in results.partial:
+		print("SubMeta did not answer, results may be incomplete")
+"""
+class SearchResults(list[SearchResult]):
+
+	def __init__(self, results: Iterable[SearchResult] | None = None, partial: Iterable[str] | None = None):
+		super().__init__(() if results is None else results)
+		self.partial = [] if partial is None else list(partial)
+
+	def is_partial(self) -> bool:
+		return len(self.partial) > 0
+
 """
 SearchSource is an abstract class that represents a source of search results from a certian source.
 
-Such an example is the BJJFanatics website, which provides results for a search query using their internal search engine. 
+Such an example is the BJJFanatics website, which provides results for a search query using their internal search engine.
 
 To implement a new source of search results, you must subclass this class and implement the search method.
+
+timeout is the per-source deadline in seconds used by SearchEngine, None means the source is only bound by the engine's total deadline.
+
+cache is the shared ResponseCache set by SearchEngine, sources should route their network calls through cached() so repeat runs do not hit the network.
+
+transport is the HTTP layer (pooled sessions, rate limits, retries) the source must send its requests through, every source shares one by default.
+
+catalog is the shared local Catalog set by SearchEngine, sources that override sync() should resolve queries against it once it has been synced.
+
+search should return None (or an empty list) only when the source answered without a match, and raise (SourceError for bad responses) when it could not answer, so the engine can tell a failure from a no-match. breaker and latency are used by the engines to skip a failing source for a cool-down and to hedge calls that run past the source's p95 latency.
+
+search_async, sync_async and hydrate_async are the async variants used by AsyncSearchEngine. By default they adapt the blocking methods by running them on a worker thread, so every source can be awaited. Sources with native async requests override them and send their requests through async_transport, which AsyncSearchEngine sets for the length of a run when httpx is installed (None otherwise, in which case they should fall back to the default).
 """
 class SearchSource(ABC):
 
-	def __init__(self, source, limit = 1):
+	def __init__(self, source, limit = 1, timeout: float | None = None):
 		self.source = source
 		self.limit = limit
+		self.timeout = timeout
+		self.cache: ResponseCache | None = None
+		self.catalog: Catalog | None = None
+		self.transport: Transport = shared_transport()
+		self.async_transport: AsyncTransport | None = None
+		self.breaker = CircuitBreaker(source)
+		self.latency = LatencyTracker()
 		pass
 
+	def catalog_items(self) -> List[dict] | None:
+		"""Returns this source's synced catalog, or None if queries must go to the network."""
+		if self.catalog is None or not self.catalog.has(self.source):
+			return None
+		return self.catalog.items(self.source)
+
+	def cached(self, key: str, fetch: Callable[[], str | None]) -> str | None:
+		"""
+		Returns the cached response for key, calling fetch and storing its result on a miss.
+		fetch should return None for responses that must not be cached (errors, non-200 status).
+		"""
+		if self.cache is None:
+			return fetch()
+		value = self.cache.get(self.source, key)
+		if value is not None:
+			metrics.count("cache_hits", source=self.source)
+			return value
+		metrics.count("cache_misses", source=self.source)
+		value = fetch()
+		if value is not None:
+			self.cache.set(self.source, key, value)
+		return value
+
+	async def cached_async(self, key: str, fetch: Callable[[], Awaitable[str | None]]) -> str | None:
+		"""Async variant of cached(), fetch is awaited on a miss."""
+		if self.cache is None:
+			return await fetch()
+		value = self.cache.get(self.source, key)
+		if value is not None:
+			metrics.count("cache_hits", source=self.source)
+			return value
+		metrics.count("cache_misses", source=self.source)
+		value = await fetch()
+		if value is not None:
+			self.cache.set(self.source, key, value)
+		return value
+
 	"""
 	Searches for a query and returns the results.
 	"""
@@ -39,18 +128,346 @@ class SearchSource(ABC):
 	def search(self, query) -> List[InstructionalResult] | None:
 		pass
 
+	"""
+	Downloads the source's full catalog into the local index, returns the number of new or changed items.
+	Sources that cannot list their catalog keep this default and are always searched online.
+	"""
+	def sync(self, catalog: Catalog) -> int:
+		return 0
+
+	def resolve(self, url: str, title: str) -> InstructionalResult | None:
+		"""
+		Returns the result a previous search selected, from the url it recorded, with its details loaded lazily.
+		Sources that cannot look a result up again keep this default.
+		"""
+		return None
+
+	async def search_async(self, query) -> List[InstructionalResult] | None:
+		return await asyncio.to_thread(self.search, query)
+
+	async def sync_async(self, catalog: Catalog) -> int:
+		return await asyncio.to_thread(self.sync, catalog)
+
+	async def hydrate_async(self, results: List[InstructionalResult]):
+		"""Loads the lazy fields of results that came from this source."""
+		await asyncio.gather(*[asyncio.to_thread(result.hydrate) for result in results])
+
+# every known source, imported and built only when an engine asks for it so unused sources cost nothing at startup
+SOURCES = {
+	"BJJFanatics": ("search.services.bjjfanatics", "BJJFanatics"),
+	"SubMeta": ("search.services.submeta", "SubMeta"),
+}
+
+def create_source(name: str, *args, **kwargs) -> SearchSource:
+	"""Imports and instantiates a registered source, arguments are passed to its constructor."""
+	module, cls = SOURCES[name]
+	return getattr(importlib.import_module(module), cls)(*args, **kwargs)
+
+def skip(source: SearchSource, results: SearchResults):
+	report(f"{source.source} - Skipped, circuit open")
+	metrics.count("circuit_skips", source=source.source)
+	results.partial.append(source.source)
+
+def hedge(source: SearchSource):
+	report(f"{source.source} - Slower than usual, sending a hedged request")
+	source.latency.hedged()
+	metrics.count("hedged_requests", source=source.source)
+
+"""
+SearchEngine queries every enabled source at the same time and collects whatever finishes before the deadlines.
+
+Each source gets its own deadline (SearchSource.timeout) and the whole search is bound by the engine's total deadline. A source that misses its deadline or fails does not block the run, it is simply left out and its name is added to SearchResults.partial.
+
+Every source sits behind its circuit breaker, a source whose circuit is open is skipped (and reported as partial) without being called. A call still running after the source's p95 latency is hedged: a duplicate is started and whichever answers first is used.
+
+concurrency is the number of searches (batch workers, interactive prefetches) that can run at the same time without queuing behind each other for the engine's threads.
+"""
 class SearchEngine():
 
-	def __init__(self, sources: list[SearchSource]):
+	def __init__(self, sources: list[SearchSource], timeout: float | None = 60, cache: ResponseCache | None = None, catalog: Catalog | None = None, concurrency: int = 4):
 		self.sources = sources
+		self.timeout = timeout
+		self.executor = ThreadPoolExecutor(max_workers=max(len(sources), 1) * concurrency, thread_name_prefix="search")
+		self.set_cache(cache)
+		self.set_catalog(catalog)
+
+	def set_cache(self, cache: ResponseCache | None):
+		"""Shares a response cache with every source."""
+		self.cache = cache
+		for source in self.sources:
+			source.cache = cache
+
+	def set_catalog(self, catalog: Catalog | None):
+		"""Shares a local catalog with every source."""
+		self.catalog = catalog
+		for source in self.sources:
+			source.catalog = catalog
+
+	def resolve(self, source: str, url: str, title: str) -> InstructionalResult | None:
+		"""Looks up a result selected earlier by the source and url it was recorded with, None when no source can resolve it."""
+		for candidate in self.sources:
+			if candidate.source == source and url != "":
+				return candidate.resolve(url, title)
+		return None
 
-	def search(self, query, subMetaOnly = False) -> List[SearchResult]:
-		results = []
+	def sync(self, catalog: Catalog) -> dict[str, int]:
+		"""Syncs every source into the catalog, returns the number of changed items per source."""
+		changed = {}
 		for source in self.sources:
-			if subMetaOnly and source.source != "SubMeta":
+			report(f"Syncing {source.source}...")
+			changed[source.source] = source.sync(catalog)
+		return changed
+
+	def search(self, query, subMetaOnly = False) -> SearchResults:
+		with metrics.span("engine.search"):
+			return self._search(query, subMetaOnly)
+
+	def _search(self, query, subMetaOnly = False) -> SearchResults:
+		sources = [source for source in self.sources if not (subMetaOnly and source.source != "SubMeta")]
+		start = time.monotonic()
+		results = SearchResults()
+		# every call of a source, the first one and its hedge
+		calls: Dict[SearchSource, List[Future]] = {}
+		hedge_at: Dict[SearchSource, float] = {}
+		for source in sources:
+			if not source.breaker.allow():
+				skip(source, results)
 				continue
+			calls[source] = [self.submit(source, query)]
+			delay = source.latency.hedge_delay()
+			if delay is not None:
+				hedge_at[source] = start + delay
+
+		answers = {}
+		while len(calls) > 0:
+			now = time.monotonic()
+			deadlines = {source: self._deadline(source, start) for source in calls}
+			events = [t for t in list(deadlines.values()) + [hedge_at[source] for source in calls if source in hedge_at] if t is not None]
+			timeout = None if len(events) == 0 else max(min(events) - now, 0)
+			wait([future for futures in calls.values() for future in futures if not future.done()], timeout=timeout, return_when=FIRST_COMPLETED)
+			now = time.monotonic()
+			for source in list(calls.keys()):
+				futures = calls[source]
+				answered = [future for future in futures if future.done() and future.exception() is None]
+				if len(answered) > 0:
+					source.breaker.succeeded()
+					answers[source] = answered[0].result()
+				elif all(future.done() for future in futures):
+					report(f"{source.source} Error[search]: {futures[0].exception()}")
+					source.breaker.failed()
+					results.partial.append(source.source)
+				elif deadlines[source] is not None and now >= deadlines[source]:
+					report(f"{source.source} - Timed out")
+					source.breaker.failed()
+					results.partial.append(source.source)
+				else:
+					if source in hedge_at and now >= hedge_at[source]:
+						del hedge_at[source]
+						hedge(source)
+						futures.append(self.submit(source, query))
+					continue
+				for future in futures:
+					future.cancel()
+				del calls[source]
+
+		for source in sources:
+			result = answers.get(source)
+			if result is not None:
+				for rr in result:
+					results.append(SearchResult(source.source, [rr]))
+		return results
+
+	def submit(self, source: SearchSource, query) -> Future:
+		# each call runs in a copy of the caller's context so its metrics are attributed to the caller's folder
+		return self.executor.submit(contextvars.copy_context().run, self._search_source, source, query)
+
+	def _search_source(self, source: SearchSource, query) -> List[InstructionalResult] | None:
+		with metrics.span("source.search", source=source.source):
+			# cache hits and catalog lookups take milliseconds, counting them would hedge nearly every network call
+			sent = [0]
+			sent_requests.set(sent)
+			started = time.monotonic()
 			result = source.search(query)
+			if sent[0] > 0:
+				source.latency.add(time.monotonic() - started)
+			return result
+
+	def _deadline(self, source: SearchSource, start: float) -> float | None:
+		"""Returns the absolute deadline for a source, the earlier of its own timeout and the engine's total timeout."""
+		deadlines = [start + t for t in (source.timeout, self.timeout) if t is not None]
+		if len(deadlines) == 0:
+			return None
+		return min(deadlines)
+
+"""
+AsyncSearchEngine runs the sources of a SearchEngine on one event loop, so a batch run or a catalog sync can keep hundreds of requests in flight without a thread per request.
+
+It shares the engine's sources, cache, catalog and deadlines. Sources are awaited through their async variants (SearchSource.search_async...), when httpx is installed every run opens an AsyncTransport for the sources that use one natively, the rest run on worker threads.
+
+Usage:
+	engine = AsyncSearchEngine(SearchEngine([...]))
+	for query, results, selected in engine.search_all(["Leglocks", "Back Attacks"], concurrency=100, select=pick_confident):
+		...
+	changed = engine.sync(catalog)
+"""
+class AsyncSearchEngine():
+
+	def __init__(self, engine: SearchEngine, max_connections: int = 100):
+		self.engine = engine
+		self.max_connections = max_connections
+
+	async def open(self):
+		if not async_available():
+			return
+		transport = AsyncTransport(max_connections=self.max_connections)
+		for source in self.engine.sources:
+			source.async_transport = transport
+
+	async def close(self):
+		transports = {id(source.async_transport): source.async_transport for source in self.engine.sources if source.async_transport is not None}
+		for source in self.engine.sources:
+			source.async_transport = None
+		for transport in transports.values():
+			await transport.close()
+
+	async def search(self, query, subMetaOnly = False) -> SearchResults:
+		with metrics.span("engine.search"):
+			return await self._search(query, subMetaOnly)
+
+	async def _search(self, query, subMetaOnly = False) -> SearchResults:
+		sources = [source for source in self.engine.sources if not (subMetaOnly and source.source != "SubMeta")]
+		start = time.monotonic()
+		results = SearchResults()
+		tasks = {}
+		for source in sources:
+			if not source.breaker.allow():
+				skip(source, results)
+				continue
+			tasks[source] = asyncio.create_task(self._hedged(source, query))
+
+		for source, task in tasks.items():
+			deadline = self.engine._deadline(source, start)
+			remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+			done, _ = await asyncio.wait([task], timeout=remaining)
+			if len(done) == 0:
+				report(f"{source.source} - Timed out")
+				task.cancel()
+				source.breaker.failed()
+				results.partial.append(source.source)
+				continue
+			try:
+				result = task.result()
+			except Exception as e:
+				report(f"{source.source} Error[search]: {e}")
+				source.breaker.failed()
+				results.partial.append(source.source)
+				continue
+			source.breaker.succeeded()
 			if result is not None:
 				for rr in result:
 					results.append(SearchResult(source.source, [rr]))
-		return results 
+		return results
+
+	async def _hedged(self, source: SearchSource, query) -> List[InstructionalResult] | None:
+		"""Searches a source, starting a duplicate call once the first one runs past the source's p95 latency. The first answer wins, an error is only raised once every call failed."""
+		calls = [asyncio.create_task(self._search_source(source, query))]
+		try:
+			delay = source.latency.hedge_delay()
+			if delay is not None:
+				done, _ = await asyncio.wait(calls, timeout=delay)
+				if len(done) == 0:
+					hedge(source)
+					calls.append(asyncio.create_task(self._search_source(source, query)))
+			while True:
+				done, _ = await asyncio.wait(calls, return_when=asyncio.FIRST_COMPLETED)
+				for call in done:
+					if call.exception() is None:
+						return call.result()
+				calls = [call for call in calls if call not in done]
+				if len(calls) == 0:
+					raise next(iter(done)).exception()
+		finally:
+			for call in calls:
+				call.cancel()
+
+	async def _search_source(self, source: SearchSource, query) -> List[InstructionalResult] | None:
+		with metrics.span("source.search", source=source.source):
+			sent = [0]
+			sent_requests.set(sent)
+			started = time.monotonic()
+			result = await source.search_async(query)
+			if sent[0] > 0:
+				source.latency.add(time.monotonic() - started)
+			return result
+
+	async def hydrate(self, result: SearchResult):
+		"""Loads the lazy fields of a selected result through its source."""
+		for source in self.engine.sources:
+			if source.source == result.source:
+				await source.hydrate_async(result.results)
+				return
+		await asyncio.to_thread(lambda: [r.hydrate() for r in result.results])
+
+	def search_all(self, queries: Iterable[str], subMetaOnly = False, concurrency: int = 100, select: Callable[[SearchResults], SearchResult | None] | None = None) -> Iterator[Tuple[str, SearchResults, SearchResult | None]]:
+		"""
+		Searches every query on one event loop, at most `concurrency` at a time, and yields (query, results, selected) as each finishes.
+		select picks the result to hydrate before it is yielded (None leaves everything lazy), selected is its pick.
+		Every span and counter of a query is attributed to the query as a metrics folder.
+		The loop runs on a background thread so the caller can consume results while later queries are still in flight.
+		"""
+		finished: queue.Queue = queue.Queue()
+		done = object()
+
+		async def search_one(query: str, limit: asyncio.Semaphore):
+			async with limit:
+				with metrics.folder(query):
+					results = await self.search(query, subMetaOnly)
+					selected = None if select is None else select(results)
+					if selected is not None:
+						try:
+							await self.hydrate(selected)
+						except Exception as e:
+							# the selection stays lazy and is hydrated again when it is used
+							report(f"{selected.source} Error[hydrate]: {e}")
+				finished.put((query, results, selected))
+
+		async def run():
+			limit = asyncio.Semaphore(concurrency)
+			await self.open()
+			try:
+				outcomes = await asyncio.gather(*[search_one(query, limit) for query in queries], return_exceptions=True)
+				for outcome in outcomes:
+					if isinstance(outcome, Exception):
+						report(f"Error[search]: {outcome}")
+			finally:
+				await self.close()
+
+		def loop():
+			try:
+				asyncio.run(run())
+			finally:
+				finished.put(done)
+
+		thread = threading.Thread(target=contextvars.copy_context().run, args=(loop,), name="search-loop", daemon=True)
+		thread.start()
+		while True:
+			item = finished.get()
+			if item is done:
+				break
+			yield item
+		thread.join()
+
+	def sync(self, catalog: Catalog) -> dict[str, int]:
+		"""Syncs every source into the catalog concurrently, returns the number of changed items per source."""
+		async def run() -> dict[str, int]:
+			await self.open()
+			try:
+				counts = await asyncio.gather(*[self._sync_source(source, catalog) for source in self.engine.sources])
+				return {source.source: count for source, count in zip(self.engine.sources, counts)}
+			finally:
+				await self.close()
+		return asyncio.run(run())
+
+	async def _sync_source(self, source: SearchSource, catalog: Catalog) -> int:
+		report(f"Syncing {source.source}...")
+		return await source.sync_async(catalog)
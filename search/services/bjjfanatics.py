@@ -1,12 +1,24 @@
-from bs4 import BeautifulSoup
-
-from typing import List, Optional, TypedDict, cast
-from search.result import EpisodeResult, InstructionalResult
+import asyncio
+from collections import OrderedDict
+import threading
+from typing import TYPE_CHECKING, AsyncIterator, Iterator, List, Optional, Tuple, TypedDict, cast
+from metrics.metrics import metrics
+from search.cache.cache import make_key
+from search.catalog.catalog import Catalog
+from search.jsonstream.jsonstream import aiter_array, decode_chunks, iter_array
+from search.progress.progress import report
+from search.resilience.resilience import SourceError
+from search.result import Chapter, EpisodeResult, InstructionalResult
+from search.result import Review as ReviewResult
 from search.search import SearchSource
-import requests
+import json
 
 from search.titlematcher import titlematcher
-from search.titlematcher.titlematcher import TitleMatcher
+from search.titlematcher.titlematcher import TitleIndex, TitleMatcher, TopMatches
+
+# bs4 is imported when the first product page is parsed
+if TYPE_CHECKING:
+	from bs4 import BeautifulSoup
 
 #types
 
@@ -49,6 +61,76 @@ class BJJFanaticsQuery(TypedDict):
 #class
 API_LINK = "https://bjjfanatics-msigw.ondigitalocean.app/v4/products/search?term=%REPLACE%&qtyBestSellers=5&qtyNewReleases=3&qtyAll=10000"
 
+# the only regions of a product page we read, everything else is skipped by the parser
+DESCRIPTION_CLASS = "product_description"
+EPISODES_CLASS = "product__course-content-accordion"
+DESCRIPTION_TAGS = ["h1", "h2", "h3", "h4", "h5", "h6", "p", "li"]
+
+# the only video fields matching, results and the catalog read, everything else is dropped while a search response streams in
+VIDEO_FIELDS = ("id", "title", "url", "image", "authors", "categories", "review", "_updated_at")
+STREAM_CHUNK_SIZE = 64 * 1024
+
+class ProductPage(TypedDict):
+	description: str
+	episodes: List[EpisodeResult]
+
+def is_product_region(classes: str | None) -> bool:
+	if classes is None:
+		return False
+	names = classes.split()
+	return DESCRIPTION_CLASS in names or EPISODES_CLASS in names
+
+def extract_product_page(html: str) -> ProductPage:
+	"""
+	Parses a product page once, keeping only the description and course content regions, and extracts both from that single parse.
+	"""
+	from bs4 import BeautifulSoup, SoupStrainer
+	content = BeautifulSoup(html, "html.parser", parse_only=SoupStrainer("div", class_=is_product_region))
+	return ProductPage(description=extract_description(content), episodes=extract_episodes(content))
+
+def extract_description(content: "BeautifulSoup") -> str:
+	description = content.find("div", {"class": DESCRIPTION_CLASS})
+	if description is None:
+		return ""
+	# add all text in the description	from header tags, paragraphs, and list items
+	return "".join([tag.get_text() + "\n" for tag in description.find_all(DESCRIPTION_TAGS)])
+
+def extract_episodes(content: "BeautifulSoup") -> List[EpisodeResult]:
+	try:
+		list = []
+		# find the div that contains the episodes
+		episodes = content.find("div", {"class": EPISODES_CLASS})
+		if episodes is None or len(episodes.contents) == 0:
+			return list
+		episode_name = episodes.find_all("h3", {"class": "product__course-title"})
+		episode_chapters = episodes.find_all("figure", {"class": "table"})
+		if len(episode_name) != len(episode_chapters):
+			return list
+		for i in range(len(episode_name)):
+			chapters = []
+			for chapter in episode_chapters[i].find_all("tr"):
+				tds = chapter.find_all("td")
+				chapters.append(Chapter.parse(tds[0].get_text().strip(), tds[1].get_text()))
+			list.append(EpisodeResult(title=episode_name[i].get_text(), chapters=chapters))
+
+		return list
+	except Exception as e:
+		report(f"BJJFanatics Error[get_episodes]: {e}")
+		return []
+
+def project(video: dict) -> BJJFanaticsVideo:
+	return cast(BJJFanaticsVideo, {key: video[key] for key in VIDEO_FIELDS if key in video})
+
+def product_page_json(html: str) -> str:
+	"""Extracts a product page and serializes it to JSON, the form product pages are cached in."""
+	with metrics.span("bjjfanatics.parse"):
+		page = extract_product_page(html)
+	return json.dumps({"description": page["description"], "episodes": [episode.to_dict() for episode in page["episodes"]]})
+
+def load_product_page(text: str) -> ProductPage:
+	data = json.loads(text)
+	return ProductPage(description=data["description"], episodes=[EpisodeResult.from_dict(episode) for episode in data["episodes"]])
+
 def toEntry(videos: List[BJJFanaticsVideo]) -> List[titlematcher.Entry]:
 	entries = []
 	for i, video in enumerate(videos):
@@ -59,41 +141,160 @@ def toEntry(videos: List[BJJFanaticsVideo]) -> List[titlematcher.Entry]:
 
 class BJJFanatics(SearchSource):
 
-	lastSearch = ""
-	cachedHTML = None 
-
-	def __init__(self, limit = 1):
+	def __init__(self, limit = 1, pageCacheSize = 32):
 		super().__init__("BJJFanatics", limit)
+		# extracted product pages keyed by url, least recently used first
+		self.pageCache: OrderedDict[str, ProductPage] = OrderedDict()
+		self.pageCacheSize = pageCacheSize
+		self.pageLock = threading.Lock()
+		# title index of the synced catalog, built once and reused for every query
+		self.catalogIndex: TitleIndex | None = None
+		self.catalogIndexed: List | None = None
 	
 	def search(self, query) -> List[InstructionalResult] | None:
-		queryObject = self.query(query)
-		if queryObject is None:
-			return None
-		best_result = self.get_best_result(query, queryObject)
+		videos = cast(List[BJJFanaticsVideo] | None, self.catalog_items())
+		if videos is not None:
+			best_result = self.get_best_result(query, BJJFanaticsQuery(videos=videos, totalResults=len(videos), ids=[]))
+		else:
+			best_result = self.query(query)
+		return self.results(best_result)
+
+	async def search_async(self, query) -> List[InstructionalResult] | None:
+		if self.async_transport is None:
+			return await super().search_async(query)
+		videos = cast(List[BJJFanaticsVideo] | None, self.catalog_items())
+		if videos is not None:
+			best_result = await asyncio.to_thread(self.get_best_result, query, BJJFanaticsQuery(videos=videos, totalResults=len(videos), ids=[]))
+		else:
+			best_result = await self.query_async(query)
+		return self.results(best_result)
+
+	def results(self, best_result: List[Tuple[BJJFanaticsVideo, int]] | None) -> List[InstructionalResult] | None:
 		if best_result is None:
 			return None
 		results = []
-		for video in best_result:
-			print(f"Fetching data for {video['title']}...")
-			results.append(self.toInstructionalResult(video))
-		print(f"BJJFanatics - Done")
+		for video, score in best_result:
+			results.append(self.toInstructionalResult(video, score))
+		report(f"BJJFanatics - Done")
 		return results
 
-	def query(self, name) -> BJJFanaticsQuery | None:
-		try:
-			print(f"Querying BJJFanatics for {name}")
-			link = API_LINK.replace("%REPLACE%", name.replace(" ", "%20"))
-			response = requests.get(link)
-			json = response.json()
-			obj = cast(BJJFanaticsQuery, json)
-			return obj
-		except Exception as e:
-			print(f"BJJFanatics Error[query]: {e}")
+	def query(self, name) -> List[Tuple[BJJFanaticsVideo, int]] | None:
+		"""
+		Searches BJJFanatics and returns the best matching videos with their scores.
+		On a cache miss the response is streamed, each video is projected down to VIDEO_FIELDS and scored as it arrives, and only the projected list is cached.
+		Failures are raised rather than returned as None, so the engine can tell them from a no-match.
+		"""
+		report(f"Querying BJJFanatics for {name}")
+		link = API_LINK.replace("%REPLACE%", name.replace(" ", "%20"))
+		matches: TopMatches[BJJFanaticsVideo] = TopMatches(name, self.limit)
+		streamed = False
+
+		def fetch() -> str | None:
+			nonlocal streamed
+			videos = self.stream_videos(link)
+			if videos is None:
+				return None
+			streamed = True
+			kept = []
+			for video in videos:
+				matches.add(video["title"], video)
+				kept.append(video)
+			return json.dumps(BJJFanaticsQuery(videos=kept, totalResults=len(kept), ids=[]))
+
+		text = self.cached(make_key("GET", link), fetch)
+		return self.best_matches(matches, text, streamed)
+
+	async def query_async(self, name) -> List[Tuple[BJJFanaticsVideo, int]] | None:
+		"""Async variant of query()."""
+		report(f"Querying BJJFanatics for {name}")
+		link = API_LINK.replace("%REPLACE%", name.replace(" ", "%20"))
+		matches: TopMatches[BJJFanaticsVideo] = TopMatches(name, self.limit)
+		streamed = False
+
+		async def fetch() -> str | None:
+			nonlocal streamed
+			videos = await self.stream_videos_async(link)
+			if videos is None:
+				return None
+			streamed = True
+			kept = []
+			async for video in videos:
+				matches.add(video["title"], video)
+				kept.append(video)
+			return json.dumps(BJJFanaticsQuery(videos=kept, totalResults=len(kept), ids=[]))
+
+		text = await self.cached_async(make_key("GET", link), fetch)
+		return self.best_matches(matches, text, streamed)
+
+	def best_matches(self, matches: TopMatches[BJJFanaticsVideo], text: str | None, streamed: bool) -> List[Tuple[BJJFanaticsVideo, int]] | None:
+		"""Returns the best matches of a query, scoring the cached response first when it was not streamed. Raises SourceError when the search failed, so it is not taken for a no-match."""
+		if text is None:
+			raise SourceError("BJJFanatics did not answer the search")
+		if not streamed:
+			for video in cast(BJJFanaticsQuery, json.loads(text))["videos"]:
+				matches.add(video["title"], project(video))
+		return [(video, score) for _, score, video in matches.best()]
+
+	def sync(self, catalog: Catalog) -> int:
+		# an empty term lists every product, fetched directly so a sync is never served from the response cache
+		link = API_LINK.replace("%REPLACE%", "")
+		videos = self.stream_videos(link)
+		if videos is None:
+			return 0
+		return catalog.upsert(self.source, videos, id_key="id", updated_key="_updated_at")
+
+	async def sync_async(self, catalog: Catalog) -> int:
+		if self.async_transport is None:
+			return await super().sync_async(catalog)
+		videos = await self.stream_videos_async(API_LINK.replace("%REPLACE%", ""))
+		if videos is None:
+			return 0
+		kept = [video async for video in videos]
+		return await asyncio.to_thread(catalog.upsert, self.source, kept, id_key="id", updated_key="_updated_at")
+
+	def stream_videos(self, link: str) -> Iterator[BJJFanaticsVideo] | None:
+		"""Streams a search response and yields its videos projected to VIDEO_FIELDS, returns None on a non-200 response."""
+		r = self.transport.get(link, stream=True)
+		if r.status_code != 200:
+			report(f"BJJFanatics Error[fetch]: {r.status_code} {link}")
+			r.close()
 			return None
-		
-	def get_best_result(self, title: str, queryResult: BJJFanaticsQuery) -> List[BJJFanaticsVideo] | None:
-		entries = toEntry(queryResult["videos"])
-		titlematcher = TitleMatcher(title, entries)
+		return self.projected(r)
+
+	def projected(self, r) -> Iterator[BJJFanaticsVideo]:
+		with metrics.span("bjjfanatics.stream"):
+			try:
+				for video in iter_array(decode_chunks(r.iter_content(STREAM_CHUNK_SIZE), r.encoding or "utf-8"), "videos"):
+					yield project(cast(dict, video))
+			finally:
+				r.close()
+
+	async def stream_videos_async(self, link: str) -> AsyncIterator[BJJFanaticsVideo] | None:
+		"""Async variant of stream_videos()."""
+		r = await self.async_transport.get(link, stream=True)
+		if r.status_code != 200:
+			report(f"BJJFanatics Error[fetch]: {r.status_code} {link}")
+			await r.aclose()
+			return None
+		return self.projected_async(r)
+
+	async def projected_async(self, r) -> AsyncIterator[BJJFanaticsVideo]:
+		with metrics.span("bjjfanatics.stream"):
+			try:
+				async for video in aiter_array(r.aiter_bytes(STREAM_CHUNK_SIZE), "videos", r.encoding or "utf-8"):
+					yield project(cast(dict, video))
+			finally:
+				await r.aclose()
+
+	def get_best_result(self, title: str, queryResult: BJJFanaticsQuery) -> List[Tuple[BJJFanaticsVideo, int]] | None:
+		videos = queryResult["videos"]
+		index = None
+		if videos is self.catalog_items():
+			if self.catalogIndex is None or self.catalogIndexed is not videos:
+				self.catalogIndex = TitleIndex(toEntry(videos))
+				self.catalogIndexed = videos
+			index = self.catalogIndex
+		titlematcher = TitleMatcher(title, toEntry(videos) if index is None else index.title_list, index)
 		best_matches = titlematcher.get_best_matches()
 		if len(best_matches) == 0:
 			return []
@@ -104,77 +305,120 @@ class BJJFanatics(SearchSource):
 			for match in best_matches:
 				if i >= self.limit:
 					break
-				results.append(queryResult["videos"][match[2]])
+				results.append((queryResult["videos"][match[2]], match[1]))
 				i += 1
 			return results
 		else:
 			best_match = best_matches[0]
-			return [queryResult["videos"][best_match[2]]]
+			return [(queryResult["videos"][best_match[2]], best_match[1])]
 
 	def get_description(self, video: BJJFanaticsVideo) -> str:
-		content = self.get_video_page(video)
-		description = content.find("div", {"class": "product_description"})
-		if description is None:
-			return ""
-		text = ""
-		# add all text in the description	from header tags, paragraphs, and list items
-		for tag in description.find_all(["h1", "h2", "h3", "h4", "h5", "h6", "p", "li"]):
-			text += tag.get_text() + "\n"
-		return text
-
-	def get_video_page(self, video: BJJFanaticsVideo) -> BeautifulSoup:
-		if self.cachedHTML is None or video["url"] != self.lastSearch:
-			r = requests.get(video["url"])
-			if r.status_code != 200:
-				return ""
-			html = r.text
-			content = BeautifulSoup(html, "html.parser")
-			self.cachedHTML = content
-		return self.cachedHTML
-
+		return self.get_product_page(video)["description"]
 
 	def get_episodes(self, video: BJJFanaticsVideo) -> List[EpisodeResult]:
-		try:
-			content = self.get_video_page(video)
-			list = []
-			if content == "":
-				return list
-			# find the div that contains the episodes
-			list_div = "product__course-content-accordion"
-			episodes = content.find("div", {"class": list_div})
-			if episodes is None or len(episodes.contents) == 0:
-				return list
-			episode_name = episodes.find_all("h3", {"class": "product__course-title"})
-			episode_chapters = episodes.find_all("figure", {"class": "table"})
-			if len(episode_name) != len(episode_chapters):
-				return list
-			for i in range(len(episode_name)):
-				chapters = []
-				for chapter in episode_chapters[i].find_all("tr"):
-					tds = chapter.find_all("td")
-					chapter_title = tds[0].get_text()
-					chapter_time = tds[1].get_text()
-					chapters.append({"title": chapter_title, "time": chapter_time})
-				list.append(EpisodeResult(title=episode_name[i].get_text(), chapters=chapters))
+		return self.get_product_page(video)["episodes"]
 
-			return list
-		except Exception as e:
-			print(f"BJJFanatics Error[get_episodes]: {e}")
-			return []
-		
+	def get_product_page(self, video: BJJFanaticsVideo) -> ProductPage:
+		"""
+		Returns the extracted product page of a video, parsing each page at most once while it stays in the LRU.
+		Raises SourceError when the page could not be fetched, so an empty page is never taken for the instructional's details.
+		"""
+		url = video["url"]
+		page = self.cached_page(url)
+		if page is not None:
+			return page
+		report(f"Fetching data for {video['title']}...")
+		# the extracted page is cached instead of the html, so a cache hit skips parsing
+		text = self.cached(make_key("GET", url, {"extract": "product_page"}), lambda: self.fetch_product_page(url))
+		if text is None:
+			raise SourceError(f"BJJFanatics did not answer the product page of {url}")
+		return self.remember_page(url, load_product_page(text))
+
+	async def get_product_page_async(self, url: str, title: str) -> ProductPage:
+		"""Async variant of get_product_page(), the page is parsed on a worker thread."""
+		page = self.cached_page(url)
+		if page is not None:
+			return page
+		report(f"Fetching data for {title}...")
+		text = await self.cached_async(make_key("GET", url, {"extract": "product_page"}), lambda: self.fetch_product_page_async(url))
+		if text is None:
+			raise SourceError(f"BJJFanatics did not answer the product page of {url}")
+		return self.remember_page(url, load_product_page(text))
+
+	async def hydrate_async(self, results: List[InstructionalResult]):
+		if self.async_transport is None:
+			return await super().hydrate_async(results)
+
+		async def hydrate(result: InstructionalResult):
+			if result.is_hydrated():
+				return
+			page = await self.get_product_page_async(result.url, result.title)
+			result.description = page["description"]
+			result.episodes = page["episodes"]
+
+		await asyncio.gather(*[hydrate(result) for result in results])
+
+	def cached_page(self, url: str) -> ProductPage | None:
+		with self.pageLock:
+			if url not in self.pageCache:
+				return None
+			metrics.count("page_cache_hits", source=self.source)
+			self.pageCache.move_to_end(url)
+			return self.pageCache[url]
+
+	def remember_page(self, url: str, page: ProductPage) -> ProductPage:
+		with self.pageLock:
+			self.pageCache[url] = page
+			self.pageCache.move_to_end(url)
+			while len(self.pageCache) > self.pageCacheSize:
+				self.pageCache.popitem(last=False)
+		return page
+
+	def fetch_product_page(self, url: str) -> str | None:
+		"""Fetches and extracts a product page, returns it serialized to JSON or None if the fetch failed."""
+		html = self.fetch(url)
+		if html is None:
+			return None
+		return product_page_json(html)
+
+	async def fetch_product_page_async(self, url: str) -> str | None:
+		r = await self.async_transport.get(url)
+		if r.status_code != 200:
+			report(f"BJJFanatics Error[fetch]: {r.status_code} {url}")
+			return None
+		return await asyncio.to_thread(product_page_json, r.text)
+
+	def fetch(self, url: str) -> str | None:
+		"""GETs a url, returns None on a non-200 response so it is not cached."""
+		r = self.transport.get(url)
+		if r.status_code != 200:
+			report(f"BJJFanatics Error[fetch]: {r.status_code} {url}")
+			return None
+		return r.text
+
+	def resolve(self, url: str, title: str) -> InstructionalResult | None:
+		# the product page holds everything chapters and NFOs need
+		video = cast(BJJFanaticsVideo, {"url": url, "title": title})
+		return InstructionalResult(
+			title=title,
+			url=url,
+			source="BJJFanatics",
+			description_loader=lambda: self.get_description(video),
+			episodes_loader=lambda: self.get_episodes(video),
+		)
 
-	def toInstructionalResult(self, video: BJJFanaticsVideo) -> InstructionalResult:
+	def toInstructionalResult(self, video: BJJFanaticsVideo, score: int | None = None) -> InstructionalResult:
 		return InstructionalResult(
 			title=video["title"],
-			description=self.get_description(video),
+			description_loader=lambda: self.get_description(video),
 			url=video["url"],
 			source="BJJFanatics",
 			image=video["image"],
 			instructor=video["authors"],
-			review=Review(average_score=video["review"]["average_score"], total_reviews=video["review"]["total_reviews"]),
+			review=ReviewResult(video["review"]["average_score"], video["review"]["total_reviews"]),
 			category=video["categories"],
-			#to be implemented
-			episodes=self.get_episodes(video)
+			episodes_loader=lambda: self.get_episodes(video),
+			score=score
 		)
 
 		
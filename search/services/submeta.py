@@ -1,48 +1,36 @@
-from typing import List, Optional, TypedDict, Union, cast
-
-import requests
-
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple, TypedDict, Union, cast
+
+from metrics.metrics import metrics
+from search.cache.cache import make_key
+from search.catalog.catalog import Catalog
+from search.progress.progress import report
+from search.resilience.resilience import SourceError
 from search.result import EpisodeResult, InstructionalResult
 from search.search import SearchSource
 from search.services.bjjfanatics import API_LINK
-from search.titlematcher.titlematcher import Entry, TitleMatcher
+from search.titlematcher.titlematcher import Entry, TitleIndex, TitleMatcher
 from search.result import Chapter as ChapterResult
 
 #episodes 
 
-class Price(TypedDict):
-	amount: int
-
 class Video(TypedDict):
-    id: str
     title: str
     duration: int
 
 class Group(TypedDict):
-    id: str
+    pass
 
 class Chapter(TypedDict):
     contents: List[Union[Video, Group]]
-    id: str
-    hidden: bool
     title: str
-    order: int
-
-class Avatar(TypedDict):
-	fileName: Optional[str]
 
 class Creator(TypedDict):
-	avatar: Optional[Avatar]
-	bio: Optional[str]
-	connectAccountId: Optional[str]
 	handle: str
-	id: Optional[str]
 	name: str
-	prices: Optional[List[Price]]
-	role: str
-
-class ContentCount(TypedDict):
-	videos: int
 
 class Cover(TypedDict):
 	fileName: str
@@ -50,130 +38,339 @@ class Cover(TypedDict):
 class Course(TypedDict):
 	id: str
 	title: str
-	slug: str
 	description: Optional[str]
 	level: str
 	publishedAt: Optional[str]
 	category: str
 	cover: Cover
-	charge: str
-	vimeo: Optional[str]
 	authors: List[Creator]
-	contentCount: ContentCount
-	isNew: bool
-	lastContent: Optional[str]
-	chapterCount: Optional[int]
-	duration: float
-	progress: Optional[float]
 	chapters: Optional[List[Chapter]]
 
-class CourseGrouping(TypedDict):
-	groupingTitle: str
-	totalCount: int
-	courses: List[Course]
-
 class ErrorsFields(TypedDict):
 	key: str
 	message: str
 
-class CoursesPageResult(TypedDict):
-	groupings: List[CourseGrouping]
-	hasMore: bool
-	errors: Optional[List[ErrorsFields]]
+class PageInfo(TypedDict):
+	hasNextPage: bool
 
 class CoursesSearchResult(TypedDict):
 	courses: List[Course]
-
-class GetCoursesPageResponse(TypedDict):
-	result: CoursesPageResult
+	pageInfo: PageInfo
 
 
 
 end_point = "https://b.submeta.io/api"
-def create_request_object(offset: int, creatorHandle: str, search: str ="") -> dict:
+# courses have no page of their own, a result's url records the course id so it can be resolved again
+COURSE_URL = "submeta://course/"
+
+def course_episodes(result: Optional[dict]) -> List[EpisodeResult]:
+	"""Converts the result of a GetCourse query into episodes, each course chapter acts as a video."""
+	if result is None:
+		return []
+	course = cast(Course, result["course"])
+	if course is None:
+		return []
+	chapters = course["chapters"]
+	if chapters is None:
+		return []
+
+	episodes = []
+	for episode in chapters:
+		# SubMeta gives the duration of each part, accumulated into start and end times
+		chapterMarks = []
+		position = 0
+		for chapter in episode["contents"]:
+			if "duration" in chapter:
+				duration = int(chapter["duration"])
+				chapterMarks.append(ChapterResult(chapter["title"].strip(), position, position + duration))
+				position += duration
+		episodes.append(EpisodeResult(title=episode["title"], chapters=chapterMarks))
+
+	return episodes
+
+def parse_courses_page(text: str) -> CoursesSearchResult | None:
+	"""Returns the result of a SearchCourses response, None when the response carries no data or GraphQL errors."""
+	body = json.loads(text)
+	data = body.get("data")
+	if data is None or body.get("errors"):
+		return None
+	return cast(CoursesSearchResult | None, data.get("result"))
+
+def answered(text: str | None) -> str | None:
+	"""Returns a SearchCourses response if it carries a result, None for error responses so they are neither cached nor taken for a no-match."""
+	if text is None or parse_courses_page(text) is None:
+		return None
+	return text
+
+def episodes_answered(text: str | None, aliases: List[str]) -> str | None:
+	"""
+	Returns a GetCourse/GetCourses response if it resolved every alias, None for error or partial responses so they are not cached.
+	A response is complete when its data is not null, neither it nor any alias carries errors and every alias is present.
+	"""
+	if text is None:
+		return None
+	body = json.loads(text)
+	data = body.get("data")
+	if data is None or body.get("errors"):
+		return None
+	for alias in aliases:
+		if alias not in data or (data[alias] is not None and data[alias].get("errors")):
+			return None
+	return text
+
+DEFAULT_CREATORS = ["lachlangiles"]
+PAGE_SIZE = 50
+
+# only the fields course_to_instructional_result, the catalog and the creator filter read
+COURSE_FIELDS = "id title description level category publishedAt cover { fileName } authors { handle name }"
+# only the fields course_episodes reads, chapters that are not videos come back as empty objects
+EPISODE_FIELDS = "course { id chapters { title contents { ... on Video { title duration } } } } errors { key message }"
+# courses resolved by one batched GetCourses request
+EPISODE_BATCH_SIZE = 25
+
+def create_request_object(offset: int, creators: List[str], search: str ="", limit: int = 10000) -> dict:
 	obj = {
 		"operationName": "SearchCourses",
 		"variables": {
-			"creatorHandle": creatorHandle,
+			"creators": creators,
 			"searchTerm": search,
 			"offset": offset,
-			"limit": 10000
+			"limit": limit
 		},
-	  "query": "query SearchCourses($searchTerm: String, $creators: [String], $filter: CourseFilter, $offset: Int, $limit: Int) {\n  result: searchCourses(\n    searchTerm: $searchTerm\n    creators: $creators\n    filter: $filter\n    offset: $offset\n    limit: $limit\n  ) {\n    courses {\n      ... on Course {\n        ...CourseFieldsForCards\n        ...UserCourseFields\n        __typename\n      }\n      __typename\n    }\n    pageInfo {\n      hasNextPage\n      hasPreviousPage\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment CourseFieldsForCards on Course {\n  ...BaseCourseFields\n  duration\n  category\n  authors {\n    id\n    handle\n    name\n    role\n    bio\n    __typename\n  }\n  contentCount {\n    videos\n    __typename\n  }\n  isNew\n  lastContent\n  chapterCount\n  charge\n  __typename\n}\n\nfragment BaseCourseFields on Course {\n  id\n  title\n  slug\n  description\n  level\n  publishedAt\n  category\n  cover {\n    fileName\n    __typename\n  }\n  charge\n  vimeo\n  authors {\n    id\n    handle\n    name\n    bio\n    role\n    connectAccountId\n    prices {\n      ...SubscriptionPriceFields\n      __typename\n    }\n    avatar {\n      fileName\n      __typename\n    }\n    __typename\n  }\n  __typename\n}\n\nfragment SubscriptionPriceFields on Price {\n  ...BasePriceFields\n  id\n  billingPeriod\n  __typename\n}\n\nfragment BasePriceFields on Price {\n  id\n  currency\n  unitAmount\n  status\n  connectAccountId\n  __typename\n}\n\nfragment UserCourseFields on Course {\n  progress\n  lastContent\n  __typename\n}",
+		"query": "query SearchCourses($searchTerm: String, $creators: [String], $offset: Int, $limit: Int) {\n  result: searchCourses(searchTerm: $searchTerm, creators: $creators, offset: $offset, limit: $limit) {\n    courses { ... on Course { " + COURSE_FIELDS + " } }\n    pageInfo { hasNextPage }\n  }\n}"
 	}
 	return obj
 
-def create_episode_request_object(course: Course, creatorHandle: str) -> dict:
-
+def create_episode_request_object(course: Course) -> dict:
 	obj = {
 		"operationName": "GetCourse",
 		"variables": {
 			"courseId": str(course["id"]),
 		},
-		"query": "query GetCourse($courseSlug: String, $creatorHandle: String, $courseId: ID) {\n  result: getCourse(\n    courseSlug: $courseSlug\n    creatorHandle: $creatorHandle\n    courseId: $courseId\n  ) {\n    course {\n      id\n      ...EntireCourseLoggedOut\n      __typename\n    }\n    errors {\n      ...ErrorsFields\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment EntireCourseLoggedOut on Course {\n  ...CourseFields\n  chapters {\n    ...ChapterFields\n    contents {\n      ... on Video {\n        id\n        title\n        duration\n        __typename\n      }\n      ... on Group {\n        id\n        __typename\n      }\n      __typename\n    }\n    __typename\n  }\n  prices {\n    ...BasePriceFields\n    __typename\n  }\n  __typename\n}\n\nfragment CourseFields on Course {\n  ...BaseCourseFields\n  duration\n  contentCount {\n    videos\n    exercises\n    __typename\n  }\n  __typename\n}\n\nfragment BaseCourseFields on Course {\n  id\n  title\n  slug\n  description\n  level\n  publishedAt\n  category\n  cover {\n    fileName\n    __typename\n  }\n  charge\n  vimeo\n  authors {\n    id\n    handle\n    name\n    bio\n    role\n    connectAccountId\n    prices {\n      ...SubscriptionPriceFields\n      __typename\n    }\n    avatar {\n      fileName\n      __typename\n    }\n    __typename\n  }\n  __typename\n}\n\nfragment SubscriptionPriceFields on Price {\n  ...BasePriceFields\n  id\n  billingPeriod\n  __typename\n}\n\nfragment BasePriceFields on Price {\n  id\n  currency\n  unitAmount\n  status\n  connectAccountId\n  __typename\n}\n\nfragment ChapterFields on Chapter {\n  id\n  hidden\n  title\n  order\n  __typename\n}\n\nfragment ErrorsFields on ErrorOutput {\n  key\n  message\n  __typename\n}\n" 
+		"query": "query GetCourse($courseId: ID) {\n  result: getCourse(courseId: $courseId) { " + EPISODE_FIELDS + " }\n}"
 	}
 	return obj
 
+def create_episodes_request_object(courseIds: List[str]) -> dict:
+	"""
+	Builds one GetCourses request resolving every course id, course i is read back from the `c{i}` alias.
+	"""
+	variables = {f"c{i}": str(courseId) for i, courseId in enumerate(courseIds)}
+	params = ", ".join(f"${name}: ID" for name in variables)
+	fields = "".join(f"\n  {name}: getCourse(courseId: ${name}) {{ {EPISODE_FIELDS} }}" for name in variables)
+	obj = {
+		"operationName": "GetCourses",
+		"variables": variables,
+		"query": f"query GetCourses({params}) {{{fields}\n}}"
+	}
+	return obj
 
+"""
+EpisodeBatch loads the episodes of a group of courses, usually the candidates of one search, with a single batched request the first time any of them is needed.
+"""
+class EpisodeBatch():
 
-class SubMeta(SearchSource):
+	def __init__(self, source: "SubMeta", courses: List[Course]):
+		self.source = source
+		self.courses = courses
+		self.episodes: Dict[str, List[EpisodeResult]] | None = None
+		self.lock = threading.Lock()
+
+	def get(self, course: Course) -> List[EpisodeResult]:
+		with self.lock:
+			if self.episodes is None:
+				self.episodes = self.source.get_episodes_for_courses(self.courses)
+		return self.episodes.get(str(course["id"]), [])
 
-	courseIndex: List[Course] = []
+"""
+SubMeta searches the courses of a set of creators.
 
-	def __init__(self, limit = 1):
+creators are the SubMeta handles to search (https://submeta.io/@lachlangiles/ --> lachlangiles), the library sets them from the `submeta` author in folder.json.
+"""
+class SubMeta(SearchSource):
+
+	def __init__(self, limit = 1, creators: List[str] = DEFAULT_CREATORS, pageSize: int = PAGE_SIZE, concurrency: int = 4):
 		super().__init__("SubMeta")
-		#self.courseIndex = self.get_all_courses("lachlangiles")
+		# title index of the synced catalog, built once and reused for every query
+		self.catalogIndex: TitleIndex | None = None
+		self.catalogIndexed: List | None = None
+		# synced catalog narrowed down to the current creators, kept so the title index can be reused
+		self.catalogCourses: Tuple[List, Tuple[str, ...], List[Course]] | None = None
 		self.limit = limit
+		self.creators = list(creators)
+		self.pageSize = pageSize
+		self.concurrency = concurrency
 	
 	def search(self, query) -> List[InstructionalResult] | None:
-		print(f"Searching SubMeta for {query}")
-		c = self.search_for_course(query, "lachlangiles")
-		b = self.match_course(c, query)
+		report(f"Searching SubMeta for {query}")
+		c = self.catalog_courses()
+		if c is None:
+			c = self.search_for_course(query, self.creators)
+		return self.results(c, query)
+
+	def sync(self, catalog: Catalog) -> int:
+		"""Syncs each creator on its own, a creator whose listing failed keeps its previous courses and is not recorded as synced."""
+		changed = 0
+		for handle in dict.fromkeys(self.creators):
+			try:
+				changed += catalog.upsert(self.source, self.get_all_courses([handle]), id_key="id", updated_key="publishedAt", scopes=[handle])
+			except SourceError as e:
+				report(f"SubMeta Error[sync]: {e}")
+		return changed
+
+	def catalog_courses(self) -> List[Course] | None:
+		"""Returns the synced courses of the current creators, or None if the catalog has not been synced for all of them."""
+		items = cast(List[Course] | None, self.catalog_items())
+		if items is None or self.catalog is None or not set(self.creators) <= self.catalog.scopes(self.source):
+			return None
+		creators = tuple(self.creators)
+		if self.catalogCourses is None or self.catalogCourses[0] is not items or self.catalogCourses[1] != creators:
+			courses = [c for c in items if any(author["handle"] in creators for author in c["authors"])]
+			self.catalogCourses = (items, creators, courses)
+		return self.catalogCourses[2]
+
+	def search_for_course(self, query: str, creators: List[str]) -> List[Course]:
+		requestbody = create_request_object(0, creators, query)
+		text = self.cached(make_key("POST", end_point, requestbody), lambda: answered(self.post(requestbody)))
+		if text is None:
+			raise SourceError("SubMeta did not answer the search")
+		return parse_courses_page(text)["courses"]
+
+	def results(self, courses: List[Course], query: str) -> List[InstructionalResult] | None:
+		b = self.match_course(courses, query)
 		if b is None:
 			return None
+		batch = EpisodeBatch(self, [course for course, _ in b])
 		results = []
-		for course in b:
-			results.append(self.course_to_instructional_result(course))
+		for course, score in b:
+			results.append(self.course_to_instructional_result(course, score, batch))
 		return results
 
-	def search_for_course(self, query: str, creatorHandle: str) -> List[Course]:
-		requestbody = create_request_object(0, creatorHandle, query)
-		r = requests.post(end_point, json=requestbody)
-		response = r.json()
-		data = response["data"]
-		if data is None:
-			return []
-		result = cast(CoursesSearchResult, data["result"])
-		if result is None:
-			return []
-		courses = result["courses"]
-		return courses
-
-
-	def get_all_courses(self, creatorHandle: str, offset: int = 0) -> List[Course]:
-		if len(self.courseIndex) > 0:
-			return self.courseIndex
-		courses = []
-		requestbody = create_request_object(offset, creatorHandle)
-		r = requests.post(end_point, json=requestbody)
-		response = r.json()
-		data = response["data"]
-		if data is None:
-			return courses
-		result = cast(GetCoursesPageResponse, data)["result"]
-		if result is None:
-			return courses
-		groupings = result["groupings"]
-		if groupings is None:
-			return courses
-		for grouping in groupings:
-			courses.extend(grouping["courses"])
-		if result["hasMore"]:
-			courses.extend(self.get_all_courses(creatorHandle, offset + 3))
-		return courses
-
-	def match_course(self, course: List[Course], query: str) -> Optional[List[Course]]:
-		titlematcher = TitleMatcher(query, [Entry(title=c["title"], index=i) for i, c in enumerate(course)])
+	async def search_async(self, query) -> List[InstructionalResult] | None:
+		if self.async_transport is None:
+			return await super().search_async(query)
+		report(f"Searching SubMeta for {query}")
+		c = self.catalog_courses()
+		if c is None:
+			c = await self.search_for_course_async(query, self.creators)
+		return self.results(c, query)
+
+	async def sync_async(self, catalog: Catalog) -> int:
+		if self.async_transport is None:
+			return await super().sync_async(catalog)
+		handles = list(dict.fromkeys(self.creators))
+		crawled = await asyncio.gather(*[self.get_all_courses_async([handle]) for handle in handles], return_exceptions=True)
+		changed = 0
+		for handle, courses in zip(handles, crawled):
+			if isinstance(courses, SourceError):
+				report(f"SubMeta Error[sync]: {courses}")
+				continue
+			if isinstance(courses, BaseException):
+				raise courses
+			changed += await asyncio.to_thread(catalog.upsert, self.source, courses, id_key="id", updated_key="publishedAt", scopes=[handle])
+		return changed
+
+	async def search_for_course_async(self, query: str, creators: List[str]) -> List[Course]:
+		requestbody = create_request_object(0, creators, query)
+
+		async def fetch() -> str | None:
+			return answered(await self.post_async(requestbody))
+
+		text = await self.cached_async(make_key("POST", end_point, requestbody), fetch)
+		if text is None:
+			raise SourceError("SubMeta did not answer the search")
+		return parse_courses_page(text)["courses"]
+
+	async def post_async(self, body: dict) -> str | None:
+		"""Async variant of post(), falls back to post() on a worker thread outside of an async run."""
+		if self.async_transport is None:
+			return await asyncio.to_thread(self.post, body)
+		r = await self.async_transport.post(end_point, json=body)
+		if r.status_code != 200:
+			report(f"Error: {r.status_code}")
+			return None
+		return r.text
+
+	async def get_all_courses_async(self, creatorHandles: List[str]) -> List[Course]:
+		"""
+		Async variant of get_all_courses, pages are requested `concurrency` at a time for each creator, every creator at once.
+		Raises SourceError when a page could not be fetched.
+		"""
+		async def crawl(handle: str) -> List[Course]:
+			courses = []
+			offset = 0
+			while True:
+				offsets = [offset + i * self.pageSize for i in range(self.concurrency)]
+				texts = await asyncio.gather(*[self.post_async(create_request_object(o, [handle], limit=self.pageSize)) for o in offsets])
+				for o, text in zip(offsets, texts):
+					page = None if text is None else parse_courses_page(text)
+					if page is None:
+						raise SourceError(f"SubMeta did not answer the listing of {handle} at offset {o}")
+					courses += page["courses"]
+					if len(page["courses"]) < self.pageSize or not page["pageInfo"]["hasNextPage"]:
+						return courses
+				offset = offsets[-1] + self.pageSize
+
+		crawled = await asyncio.gather(*[crawl(handle) for handle in dict.fromkeys(creatorHandles)])
+		unique = {}
+		for courses in crawled:
+			for course in courses:
+				unique.setdefault(course["id"], course)
+		return list(unique.values())
+
+	def post(self, body: dict) -> str | None:
+		"""POSTs a GraphQL body, returns None on a non-200 response so it is not cached."""
+		r = self.transport.post(end_point, json=body)
+		if r.status_code != 200:
+			report(f"Error: {r.status_code}")
+			return None
+		return r.text
+
+	def get_courses_page(self, creators: List[str], offset: int) -> CoursesSearchResult | None:
+		"""Fetches one page of a creator listing, posted directly so a crawl is never served from the response cache."""
+		text = self.post(create_request_object(offset, creators, limit=self.pageSize))
+		if text is None:
+			return None
+		return parse_courses_page(text)
+
+	def get_all_courses(self, creatorHandles: List[str]) -> Iterator[Course]:
+		"""
+		Crawls the full course listing of every creator handle and yields each course once, deduplicated by id.
+		Pages are fetched `concurrency` at a time, a creator is done once a page comes back short or without a next page.
+		Raises SourceError when a page could not be fetched, rather than ending the listing there.
+		"""
+		seen = set()
+		with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="submeta-crawl") as pool:
+			for handle in dict.fromkeys(creatorHandles):
+				offset = 0
+				done = False
+				while not done:
+					offsets = [offset + i * self.pageSize for i in range(self.concurrency)]
+					pages = pool.map(lambda o: self.get_courses_page([handle], o), offsets)
+					for o, page in zip(offsets, pages):
+						if done:
+							continue
+						if page is None:
+							raise SourceError(f"SubMeta did not answer the listing of {handle} at offset {o}")
+						courses = page["courses"]
+						for course in courses:
+							if course["id"] in seen:
+								continue
+							seen.add(course["id"])
+							yield course
+						if len(courses) < self.pageSize or not page["pageInfo"]["hasNextPage"]:
+							done = True
+					offset = offsets[-1] + self.pageSize
+
+	def match_course(self, course: List[Course], query: str) -> Optional[List[Tuple[Course, int]]]:
+		index = None
+		if course is self.catalog_courses():
+			if self.catalogIndex is None or self.catalogIndexed is not course:
+				self.catalogIndex = TitleIndex([Entry(title=c["title"], index=i) for i, c in enumerate(course)])
+				self.catalogIndexed = course
+			index = self.catalogIndex
+		entries = [Entry(title=c["title"], index=i) for i, c in enumerate(course)] if index is None else index.title_list
+		titlematcher = TitleMatcher(query, entries, index)
 		best_matches = titlematcher.get_best_matches()
 		if len(best_matches) == 0:
 			return None
@@ -184,55 +381,66 @@ class SubMeta(SearchSource):
 			for match in best_matches:
 				if i >= self.limit:
 					break
-				results.append(course[match[2]])
+				results.append((course[match[2]], match[1]))
 				i += 1
 			return results
 		else: 
 			best_match = best_matches[0]
-			return [course[best_match[2]]]
+			return [(course[best_match[2]], best_match[1])]
 
-	def course_to_instructional_result(self, course: Course) -> InstructionalResult:
+	def course_to_instructional_result(self, course: Course, score: int | None = None, batch: EpisodeBatch | None = None) -> InstructionalResult:
 		return InstructionalResult(
 			title=course["title"],
 			source="SubMeta",
 			description=course["description"] or '',
 			category=[course["category"] or '', course["level"] or '', ],
-			image=f"https://optimg.submeta.io/uploads/{course["cover"]["fileName"]}",
+			image=f"https://optimg.submeta.io/uploads/{course['cover']['fileName']}",
 			instructor=[c["name"] for c in course["authors"]],
-			episodes=self.get_episodes_from_course(course)
+			url=f"{COURSE_URL}{course['id']}",
+			episodes_loader=lambda: self.get_episodes_from_course(course) if batch is None else batch.get(course),
+			score=score
 		)
 
-	def get_episodes_from_course(self, course: Course) -> List[EpisodeResult]:
-		body = create_episode_request_object(course, "lachlangiles")
-
-		r = requests.post(end_point, json=body)
-		if r.status_code != 200:
-			print(f"Error: {r.status_code}")
-			return []
-
-		data = r.json()["data"]
-		if data is None:
-			return []
-		result = data["result"]
-		if result is None:
-			return []
-		course = cast(Course, result["course"])
-		if course is None:
-			return []
-		chapters = course["chapters"]
-		if chapters is None:
-			return []
-
-		#each chapter acts as a video
-		episodes = []
-		for episode in chapters:
-			chapterMarks = []
-			for chapter in episode["contents"]:
-				if "duration" in chapter:
-					chapterMarks.append(ChapterResult(
-						title=chapter["title"], 
-						time=str(chapter["duration"]
-					)))
-			episodes.append(EpisodeResult(title=episode["title"], chapters=chapterMarks))
+	def resolve(self, url: str, title: str) -> InstructionalResult | None:
+		if not url.startswith(COURSE_URL):
+			return None
+		course = cast(Course, {"id": url[len(COURSE_URL):], "title": title})
+		return InstructionalResult(
+			title=title,
+			url=url,
+			source="SubMeta",
+			episodes_loader=lambda: self.get_episodes_from_course(course),
+		)
 
+	def get_episodes_from_course(self, course: Course) -> List[EpisodeResult]:
+		body = create_episode_request_object(course)
+
+		text = self.cached(make_key("POST", end_point, body), lambda: episodes_answered(self.post(body), ["result"]))
+		if text is None:
+			raise SourceError(f"SubMeta did not answer the episodes of course {course['id']}")
+
+		with metrics.span("submeta.parse"):
+			data = json.loads(text)["data"]
+			if data is None:
+				return []
+			return course_episodes(data["result"])
+
+	def get_episodes_for_courses(self, courses: List[Course]) -> Dict[str, List[EpisodeResult]]:
+		"""
+		Returns the episodes of many courses keyed by course id, resolved EPISODE_BATCH_SIZE courses per aliased request.
+		Raises SourceError when a batch could not be fetched, so missing episodes are never taken for a course without any.
+		"""
+		courseIds = list(dict.fromkeys(str(course["id"]) for course in courses))
+		episodes: Dict[str, List[EpisodeResult]] = {}
+		for i in range(0, len(courseIds), EPISODE_BATCH_SIZE):
+			chunk = courseIds[i:i + EPISODE_BATCH_SIZE]
+			body = create_episodes_request_object(chunk)
+			aliases = [f"c{j}" for j in range(len(chunk))]
+			text = self.cached(make_key("POST", end_point, body), lambda: episodes_answered(self.post(body), aliases))
+			if text is None:
+				raise SourceError(f"SubMeta did not answer the episodes of {len(chunk)} courses")
+			data = json.loads(text)["data"]
+			with metrics.span("submeta.parse"):
+				for j, courseId in enumerate(chunk):
+					episodes[courseId] = course_episodes(data[f"c{j}"])
 		return episodes
@@ -1,31 +1,140 @@
-from typing import List, Tuple, TypedDict, cast
-from fuzzywuzzy import fuzz
-from fuzzywuzzy import process
+from collections import defaultdict
+import heapq
+from typing import Dict, Generic, List, Tuple, TypedDict, TypeVar, cast
+
+from metrics.metrics import metrics
+
+T = TypeVar("T")
 
 class Entry(TypedDict):
 	title: str
 	index: int
 
+def normalize(title: str) -> str:
+	"""
+	Returns the token sorted form of a title, the same form fuzzywuzzy's token_sort_ratio compares.
+	"""
+	# fuzzywuzzy is imported on first use, repeat imports are a sys.modules lookup
+	from fuzzywuzzy import utils
+	return " ".join(sorted(utils.full_process(title, force_ascii=True).split()))
+
+def trigrams(normalized: str) -> set[str]:
+	padded = f"  {normalized} "
+	return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+"""
+TitleIndex precomputes the normalized form of every title in a list once, along with a trigram inverted index.
+
+Queries first prune the list to the titles sharing the most trigrams with the query and only score those exactly, so a 10k title list costs a few hundred ratio computations instead of 10k. An index can be reused for any number of queries against the same title list.
+
+Usage:
+	index = TitleIndex(entries)
+	matches = index.get_best_matches("Leglocks Enter The System", limit=5)
+"""
+class TitleIndex:
+		def __init__(self, title_list: List[Entry], max_candidates: int = 250):
+			self.title_list = title_list
+			self.max_candidates = max_candidates
+			self.normalized = [normalize(entry['title']) for entry in title_list]
+			self.postings: Dict[str, List[int]] = defaultdict(list)
+			self.sizes: List[int] = []
+			for position, normalized in enumerate(self.normalized):
+				grams = trigrams(normalized)
+				self.sizes.append(len(grams))
+				for gram in grams:
+					self.postings[gram].append(position)
+
+		def candidates(self, normalized_query: str, limit: int) -> List[int]:
+			"""
+			Returns the positions of the titles with the highest trigram Dice coefficient against the query.
+			Falls back to every title when nothing overlaps, so a query always gets scored results.
+			"""
+			query_grams = trigrams(normalized_query)
+			overlap: Dict[int, int] = defaultdict(int)
+			for gram in query_grams:
+				for position in self.postings.get(gram, ()):
+					overlap[position] += 1
+			if len(overlap) == 0:
+				return list(range(len(self.title_list)))
+			keep = max(self.max_candidates, limit)
+			if len(overlap) <= keep:
+				return list(overlap.keys())
+			size = len(query_grams)
+			return heapq.nlargest(keep, overlap.keys(), key=lambda position: overlap[position] / (size + self.sizes[position]))
+
+		def get_best_matches(self, search_query: str, limit: int = 5) -> List[Tuple[str, int, int]]:
+			"""
+			Returns the best matches for the search query, sorted by token_sort_ratio similarity.
+			:param limit: The maximum number of results to return (default: 5).
+			:return: A list of (title, score, index) tuples, index being the Entry index of the title.
+			"""
+			from fuzzywuzzy import fuzz
+			normalized_query = normalize(search_query)
+			if normalized_query == "" or len(self.title_list) == 0:
+				return []
+			scored = []
+			for position in self.candidates(normalized_query, limit):
+				score = fuzz.ratio(normalized_query, self.normalized[position])
+				scored.append((score, position))
+			best = heapq.nsmallest(limit, scored, key=lambda item: (-item[0], item[1]))
+			return [(self.title_list[position]['title'], score, self.title_list[position]['index']) for score, position in best]
+
 class TitleMatcher:
-		def __init__(self, search_query: str, title_list: List[Entry]):
+		def __init__(self, search_query: str, title_list: List[Entry], index: TitleIndex | None = None):
 			self.search_query = search_query
 			self.title_list = title_list
+			self.index = index
 
 		def get_best_matches(self, limit: int = 5) -> List[Tuple[str, int, int]]:
 			"""
 			Returns the best matches for the search query from the title list, sorted by similarity.
 			:param limit: The maximum number of results to return (default: 5).
-			:return: A list of tuples with the matched title and its similarity score.
+			:return: A list of tuples with the matched title, its similarity score and its index.
 			"""
-			titles = [entry['title'] for entry in self.title_list]
-			best_matches = process.extract(self.search_query, titles, scorer=fuzz.token_sort_ratio, limit=limit)
-			best_matches_translated = []
-
-			for best_match in best_matches:
-				for entry in self.title_list:
-					if best_match[0] == entry['title']:
-						#i hate this
-						best_matches_translated.append((best_match[0], best_match[1], entry['index']))
-						break
-			
-			return best_matches_translated
+			if self.index is None:
+				with metrics.span("titlematcher.index"):
+					self.index = TitleIndex(self.title_list)
+			with metrics.span("titlematcher.match"):
+				return self.index.get_best_matches(self.search_query, limit)
+
+"""
+TopMatches is the streaming counterpart of TitleIndex: titles are added one at a time as they arrive, each is scored by its trigram Dice coefficient against the query right away, and only the `max_candidates` best are kept in a heap. best() then ranks the kept titles exactly by token_sort_ratio.
+
+Memory stays bounded by max_candidates whatever the length of the list, and no index is built.
+
+Usage:
+	matches = TopMatches("Leglocks Enter The System", limit=5)
+	for video in videos:
+		matches.add(video["title"], video)
+	best = matches.best()
+"""
+class TopMatches(Generic[T]):
+		def __init__(self, search_query: str, limit: int = 5, max_candidates: int = 250):
+			self.normalized_query = normalize(search_query)
+			self.query_grams = trigrams(self.normalized_query)
+			self.limit = limit
+			self.max_candidates = max(max_candidates, limit)
+			self.count = 0
+			# min heap of (dice, -arrival, normalized title, title, item), the weakest candidate on top
+			self.heap: List[Tuple[float, int, str, str, T]] = []
+
+		def add(self, title: str, item: T):
+			position = self.count
+			self.count += 1
+			if self.normalized_query == "":
+				return
+			normalized = normalize(title)
+			grams = trigrams(normalized)
+			dice = len(self.query_grams & grams) / (len(self.query_grams) + len(grams))
+			entry = (dice, -position, normalized, title, item)
+			if len(self.heap) < self.max_candidates:
+				heapq.heappush(self.heap, entry)
+			elif entry[:2] > self.heap[0][:2]:
+				heapq.heapreplace(self.heap, entry)
+
+		def best(self) -> List[Tuple[str, int, T]]:
+			"""Returns the best `limit` candidates as (title, score, item) tuples, sorted by token_sort_ratio, ties going to the title that arrived first."""
+			from fuzzywuzzy import fuzz
+			scored = [(fuzz.ratio(self.normalized_query, normalized), position, title, item) for _, position, normalized, title, item in self.heap]
+			best = heapq.nlargest(self.limit, scored, key=lambda entry: entry[:2])
+			return [(title, score, item) for score, _, title, item in best]
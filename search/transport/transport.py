@@ -0,0 +1,284 @@
+import asyncio
+import contextvars
+import importlib.util
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Tuple
+from urllib.parse import urlsplit
+
+from metrics.metrics import metrics
+
+# requests and httpx are imported on first use so importing a source does not pay for them
+if TYPE_CHECKING:
+	import httpx
+	import requests
+
+# requests per second and burst size allowed per host
+DEFAULT_RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+	"bjjfanatics-msigw.ondigitalocean.app": (5, 10),
+	"bjjfanatics.com": (3, 6),
+	"b.submeta.io": (5, 10),
+}
+DEFAULT_RATE_LIMIT: Tuple[float, int] = (5, 10)
+DEFAULT_TIMEOUT: Tuple[float, float] = (5, 30)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# longest Retry-After honored in seconds, a server asking for more gets its failed response back instead of blocking a search past its deadlines
+DEFAULT_MAX_RETRY_AFTER = 10
+
+# requests sent in the current context, the engines give each search call its own counter so only calls that went to the network feed its latency
+sent_requests: contextvars.ContextVar[List[int] | None] = contextvars.ContextVar("sent_requests", default=None)
+
+
+def count_request():
+	counter = sent_requests.get()
+	if counter is not None:
+		counter[0] += 1
+
+
+"""
+TokenBucket allows `rate` acquisitions per second with bursts of up to `capacity`, blocking the caller until a token is available.
+"""
+class TokenBucket():
+
+	def __init__(self, rate: float, capacity: int):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = float(capacity)
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	def reserve(self) -> float:
+		"""Takes a token if one is available and returns 0, otherwise returns the seconds to wait before trying again."""
+		with self.lock:
+			now = time.monotonic()
+			self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+			self.updated = now
+			if self.tokens >= 1:
+				self.tokens -= 1
+				return 0
+			return (1 - self.tokens) / self.rate
+
+	def acquire(self):
+		wait = self.reserve()
+		while wait > 0:
+			time.sleep(wait)
+			wait = self.reserve()
+
+	async def acquire_async(self):
+		wait = self.reserve()
+		while wait > 0:
+			await asyncio.sleep(wait)
+			wait = self.reserve()
+
+
+"""
+Transport is the HTTP layer every SearchSource goes through.
+
+It keeps one pooled keep-alive session per host, rate limits each host with a token bucket, applies a default timeout and retries 429/5xx responses and connection errors with jittered exponential backoff (honoring Retry-After when the server sends it, up to max_retry_after seconds).
+
+Usage:
+	transport = Transport()
+	response = transport.get("https://bjjfanatics.com/products/...")
+"""
+class Transport():
+
+	def __init__(self, rate_limits: Dict[str, Tuple[float, int]] = DEFAULT_RATE_LIMITS, timeout: Tuple[float, float] = DEFAULT_TIMEOUT, retries: int = 3, backoff: float = 0.5, pool_size: int = 16, share: float = 1, max_retry_after: float = DEFAULT_MAX_RETRY_AFTER):
+		self.rate_limits = dict(rate_limits)
+		self.max_retry_after = max_retry_after
+		# part of each host's rate limit this transport may use, when several processes search side by side
+		self.share = share
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+		self.pool_size = pool_size
+		self.sessions: Dict[str, "requests.Session"] = {}
+		self.buckets: Dict[str, TokenBucket] = {}
+		self.lock = threading.Lock()
+
+	def session(self, host: str) -> "requests.Session":
+		import requests
+		from requests.adapters import HTTPAdapter
+		with self.lock:
+			if host not in self.sessions:
+				session = requests.Session()
+				adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+				session.mount("https://", adapter)
+				session.mount("http://", adapter)
+				self.sessions[host] = session
+			return self.sessions[host]
+
+	def bucket(self, host: str) -> TokenBucket:
+		with self.lock:
+			if host not in self.buckets:
+				rate, capacity = self.rate_limits.get(host, DEFAULT_RATE_LIMIT)
+				self.buckets[host] = TokenBucket(rate * self.share, max(1, int(capacity * self.share)))
+			return self.buckets[host]
+
+	def request(self, method: str, url: str, **kwargs) -> "requests.Response":
+		"""Sends a request, retrying transient failures. The last response is returned, or the last error raised, once retries run out."""
+		import requests
+		host = urlsplit(url).netloc.lower()
+		session = self.session(host)
+		bucket = self.bucket(host)
+		kwargs.setdefault("timeout", self.timeout)
+		attempt = 0
+		while True:
+			bucket.acquire()
+			count_request()
+			try:
+				with metrics.span("http.request", host=host):
+					response = session.request(method, url, **kwargs)
+			except (requests.ConnectionError, requests.Timeout):
+				metrics.count("http_errors", host=host)
+				if attempt >= self.retries:
+					raise
+			else:
+				metrics.count("http_requests", host=host, status=response.status_code)
+				if kwargs.get("stream"):
+					# a streamed body is read by the caller, only its declared size is known here
+					length = response.headers.get("Content-Length", "")
+					if length.isdigit():
+						metrics.count("http_bytes", int(length), host=host)
+				else:
+					metrics.count("http_bytes", len(response.content), host=host)
+				if response.status_code not in RETRY_STATUS or attempt >= self.retries:
+					return response
+				retry_after = self.retry_after(response)
+				if retry_after is not None and retry_after > self.max_retry_after:
+					return response
+				response.close()
+				if retry_after is not None:
+					time.sleep(retry_after)
+					attempt += 1
+					continue
+			time.sleep(self.delay(attempt))
+			attempt += 1
+
+	def retry_after(self, response) -> float | None:
+		"""Returns the seconds a response's Retry-After header asks for, None when it gives none in seconds."""
+		retry_after = response.headers.get("Retry-After")
+		if retry_after is None or not retry_after.isdigit():
+			return None
+		return float(retry_after)
+
+	def delay(self, attempt: int) -> float:
+		"""Full jitter backoff: a random delay between 0 and backoff * 2^attempt."""
+		return random.uniform(0, self.backoff * (2 ** attempt))
+
+	def get(self, url: str, **kwargs) -> "requests.Response":
+		return self.request("GET", url, **kwargs)
+
+	def post(self, url: str, **kwargs) -> "requests.Response":
+		return self.request("POST", url, **kwargs)
+
+	def close(self):
+		with self.lock:
+			for session in self.sessions.values():
+				session.close()
+			self.sessions.clear()
+
+
+shared: Transport | None = None
+shared_lock = threading.Lock()
+
+def shared_transport() -> Transport:
+	"""Returns the process wide transport used by sources that were not given their own."""
+	global shared
+	with shared_lock:
+		if shared is None:
+			shared = Transport()
+		return shared
+
+def share_transport(processes: int) -> Transport:
+	"""Replaces the process wide transport with one allowed 1/processes of every host's rate limit, for processes that search side by side."""
+	global shared
+	with shared_lock:
+		shared = Transport(share=1 / processes)
+		return shared
+
+
+def async_available() -> bool:
+	"""Returns whether httpx, which AsyncTransport needs, is installed."""
+	return importlib.util.find_spec("httpx") is not None
+
+
+"""
+AsyncTransport is the asyncio counterpart of Transport, built on httpx.AsyncClient, so one event loop can keep hundreds of requests in flight.
+
+It takes its rate limits, timeout and retry policy from a Transport and shares that transport's token buckets, so sync and async requests to a host are limited together. One client pools the connections of every host. The client belongs to the event loop it was first used in, AsyncSearchEngine opens one AsyncTransport per run and closes it at the end.
+
+Usage:
+	transport = AsyncTransport()
+	response = await transport.get("https://bjjfanatics.com/products/...")
+	await transport.close()
+"""
+class AsyncTransport():
+
+	def __init__(self, transport: Transport | None = None, max_connections: int = 100):
+		self.transport = shared_transport() if transport is None else transport
+		self.max_connections = max_connections
+		self.client: "httpx.AsyncClient | None" = None
+
+	def connect(self) -> "httpx.AsyncClient":
+		import httpx
+		if self.client is None:
+			connect, read = self.transport.timeout
+			self.client = httpx.AsyncClient(
+				timeout=httpx.Timeout(read, connect=connect),
+				limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+				follow_redirects=True,
+			)
+		return self.client
+
+	async def request(self, method: str, url: str, stream: bool = False, **kwargs) -> "httpx.Response":
+		"""
+		Sends a request, retrying transient failures like Transport.request.
+		With stream set the body is not read, the caller iterates it and must aclose() the response.
+		"""
+		import httpx
+		client = self.connect()
+		host = urlsplit(url).netloc.lower()
+		bucket = self.transport.bucket(host)
+		attempt = 0
+		while True:
+			await bucket.acquire_async()
+			count_request()
+			try:
+				with metrics.span("http.request", host=host):
+					response = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+			except httpx.TransportError:
+				metrics.count("http_errors", host=host)
+				if attempt >= self.transport.retries:
+					raise
+			else:
+				metrics.count("http_requests", host=host, status=response.status_code)
+				if stream:
+					length = response.headers.get("Content-Length", "")
+					if length.isdigit():
+						metrics.count("http_bytes", int(length), host=host)
+				else:
+					metrics.count("http_bytes", len(response.content), host=host)
+				if response.status_code not in RETRY_STATUS or attempt >= self.transport.retries:
+					return response
+				retry_after = self.transport.retry_after(response)
+				if retry_after is not None and retry_after > self.transport.max_retry_after:
+					return response
+				await response.aclose()
+				if retry_after is not None:
+					await asyncio.sleep(retry_after)
+					attempt += 1
+					continue
+			await asyncio.sleep(self.transport.delay(attempt))
+			attempt += 1
+
+	async def get(self, url: str, **kwargs) -> "httpx.Response":
+		return await self.request("GET", url, **kwargs)
+
+	async def post(self, url: str, **kwargs) -> "httpx.Response":
+		return await self.request("POST", url, **kwargs)
+
+	async def close(self):
+		if self.client is not None:
+			await self.client.aclose()
+			self.client = None